@@ -0,0 +1,8 @@
+'''
+Performance benchmarks for HODS
+
+Benchmarks follow airspeed velocity (asv) conventions and can be executed
+either with `asv run` or with the bundled runner that has no dependencies:
+
+    python -m benchmarks.run [--compare=REVISION] [PATTERN]
+'''
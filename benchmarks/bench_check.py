@@ -0,0 +1,50 @@
+'''
+Benchmarks for `hods check` over a generated directory tree
+'''
+
+
+from tempfile import TemporaryDirectory
+
+from hods._lib.cache import VerificationCache
+from hods._lib.files import scan_files
+from hods.cli import check
+from benchmarks.generate import write_tree
+
+
+class CheckSuite:
+    params = [[20, 200], [1, 4]]
+    param_names = ['files', 'jobs']
+    timeout = 300
+
+
+    def setup(self, files, jobs):
+        self.tempdir = TemporaryDirectory()
+        self.directory = self.tempdir.name
+        write_tree(self.directory, files=files)
+        with VerificationCache(self.directory) as cache:
+            self.run(jobs, cache)
+
+
+    def teardown(self, *params):
+        self.tempdir.cleanup()
+
+
+    def run(self, jobs, cache=None):
+        files = scan_files(self.directory, recursive=True)
+        for filename, status in check.check_files(files, jobs, cache):
+            if status != check.OK:
+                raise RuntimeError('{}: {}'.format(filename, status))
+
+
+    def time_scan(self, files, jobs):
+        for _ in scan_files(self.directory, recursive=True, jobs=jobs):
+            pass
+
+
+    def time_check(self, files, jobs):
+        self.run(jobs)
+
+
+    def time_check_cached(self, files, jobs):
+        with VerificationCache(self.directory) as cache:
+            self.run(jobs, cache)
@@ -0,0 +1,140 @@
+'''
+Benchmarks for data classes: attribute assignment and hashing
+'''
+
+
+from tempfile import TemporaryDirectory
+
+from hods import Metadata
+from hods._lib.hash import struct_hash
+from benchmarks.generate import (
+    ALBUM_SCHEMA,
+    DEPTHS,
+    SIZES,
+    album,
+    metadata,
+    nested,
+    write_document,
+)
+
+
+class SetattrSuite:
+    params = [SIZES]
+    param_names = ['tracks']
+
+
+    def setup(self, tracks):
+        self.meta = metadata(album(tracks), ALBUM_SCHEMA)
+        self.branch = deepest_branch(metadata(nested(tracks, depth=8)).data)
+        self.counter = 0
+
+
+    def time_setattr(self, tracks):
+        self.counter += 1
+        self.meta.data.album = 'Title {}'.format(self.counter)
+
+
+    def time_setattr_nested(self, tracks):
+        self.counter += 1
+        self.branch.changed = str(self.counter)
+
+
+    def time_transaction(self, tracks):
+        self.counter += 1
+        with self.meta.transaction():
+            self.meta.data.album = 'Title {}'.format(self.counter)
+            self.meta.data.year = str(self.counter)
+
+
+
+class HashSuite:
+    params = [SIZES, DEPTHS]
+    param_names = ['size', 'depth']
+
+
+    def setup(self, size, depth):
+        self.payload = nested(size, depth)
+        # Canonical JSON is cached only for data owned by Metadata object
+        self.tempdir = TemporaryDirectory()
+        self.meta = Metadata(filename=write_document(self.tempdir.name, 'nested', self.payload))
+        self.branch = deepest_branch(self.meta.data)
+        self.counter = 0
+
+
+    def teardown(self, *params):
+        self.tempdir.cleanup()
+
+
+    def time_struct_hash(self, size, depth):
+        struct_hash(self.payload)
+
+
+    def time_validate_hashes(self, size, depth):
+        self.meta.validate_hashes()
+
+
+    def time_validate_hashes_after_change(self, size, depth):
+        self.counter += 1
+        self.branch.changed = str(self.counter)
+        self.meta.validate_hashes(write_updates=True)
+
+
+
+def deepest_branch(node):
+    '''Follow the first key of each mapping down to the deepest mapping'''
+    while True:
+        child = getattr(node, next(iter(node)))
+        if not hasattr(child, '_data'):
+            return node
+        node = child
+
+
+
+class AccessSuite:
+    '''Attribute access through Metadata wrapper and through frozen view'''
+    params = [['wrapper', 'frozen']]
+    param_names = ['view']
+    rounds = 1000
+
+
+    def setup(self, view):
+        self.payload = album(10)
+        self.meta = metadata(self.payload, ALBUM_SCHEMA)
+        self.tree = self.meta.freeze() if view == 'frozen' else self.meta
+
+
+    def time_first_access(self, view):
+        meta = metadata(self.payload, ALBUM_SCHEMA)
+        tree = meta.freeze() if view == 'frozen' else meta
+        tree.info.hashes.data.sha256
+
+
+    def time_attribute_hops(self, view):
+        tree = self.tree
+        for _ in range(self.rounds):
+            tree.info.hashes.data.sha256
+            tree.data.album
+
+
+
+class DottedPathSuite:
+    '''Compiled dotted path accessors of frozen view'''
+    paths = ['info.hashes.data.sha256', 'data.album', 'data.tracks.5.title', 'data.missing']
+    rounds = 1000
+
+
+    def setup(self):
+        self.tree = metadata(album(10), ALBUM_SCHEMA).freeze()
+
+
+    def time_get(self):
+        tree = self.tree
+        for _ in range(self.rounds):
+            tree.get('info.hashes.data.sha256')
+            tree.get('data.album')
+
+
+    def time_select(self):
+        tree = self.tree
+        for _ in range(self.rounds):
+            tree.select(self.paths)
@@ -0,0 +1,74 @@
+'''
+Benchmarks for reading and writing metadata files
+'''
+
+
+from tempfile import TemporaryDirectory
+
+from hods._lib.files import get_object, write_object
+from benchmarks.generate import (
+    ALBUM_SCHEMA,
+    FORMATS,
+    SIZES,
+    album,
+    metadata,
+    write_document,
+)
+
+
+STRICT_YAML_LIMIT = 1000  # StrictYAML is too slow for larger documents
+
+
+class LoadSuite:
+    params = [FORMATS, SIZES, [False, True]]
+    param_names = ['format', 'tracks', 'readonly']
+
+
+    def setup(self, fileformat, tracks, readonly):
+        if fileformat == 'StrictYAML' and tracks > STRICT_YAML_LIMIT:
+            raise NotImplementedError
+        self.tempdir = TemporaryDirectory()
+        self.filename = write_document(
+            self.tempdir.name, 'album', album(tracks), fileformat, ALBUM_SCHEMA
+        )
+
+
+    def teardown(self, *params):
+        self.tempdir.cleanup()
+
+
+    def time_get_object(self, fileformat, tracks, readonly):
+        get_object(self.filename, fileformat, readonly=readonly)
+
+
+
+class WriteSuite:
+    params = [FORMATS, SIZES]
+    param_names = ['format', 'tracks']
+
+
+    def setup(self, fileformat, tracks):
+        if fileformat == 'StrictYAML' and tracks > STRICT_YAML_LIMIT:
+            raise NotImplementedError
+        self.tempdir = TemporaryDirectory()
+        self.filename = write_document(
+            self.tempdir.name, 'album', album(tracks), fileformat, ALBUM_SCHEMA
+        )
+        self.unchanged = get_object(self.filename, fileformat)
+        self.changed = metadata(album(tracks + 1), ALBUM_SCHEMA)._data
+        self.fileformat = fileformat
+        self.toggle = False
+
+
+    def teardown(self, *params):
+        self.tempdir.cleanup()
+
+
+    def time_write_changed(self, fileformat, tracks):
+        self.toggle = not self.toggle
+        data = self.changed if self.toggle else self.unchanged
+        write_object(data, self.filename, fileformat)
+
+
+    def time_write_unchanged(self, fileformat, tracks):
+        write_object(self.unchanged, self.filename, fileformat)
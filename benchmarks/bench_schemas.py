@@ -0,0 +1,61 @@
+'''
+Benchmarks for schema loading and validation
+'''
+
+
+from hods._lib.schemas import Schema, compile_schema, fetch_schema, registry
+from benchmarks.generate import ALBUM_SCHEMA, SIZES, album
+
+
+class SchemaSuite:
+    params = [['metadata-v1.json', ALBUM_SCHEMA]]
+    param_names = ['schema']
+    engine = 'jsonschema'
+
+
+    def setup(self, identifier):
+        self.schema = Schema(identifier, self.engine)
+        self.raw = fetch_schema(self.schema.id)
+
+
+    def time_compile(self, identifier):
+        compile_schema(self.raw, self.engine, self.schema.id)
+
+
+    def time_schema_cold(self, identifier):
+        registry.invalidate(self.schema.id, self.engine)
+        Schema(identifier, self.engine)
+
+
+    def time_schema_cached(self, identifier):
+        Schema(identifier, self.engine)
+
+
+
+class ValidateSuite:
+    params = [SIZES]
+    param_names = ['tracks']
+    engine = 'jsonschema'
+
+
+    def setup(self, tracks):
+        self.schema = Schema(ALBUM_SCHEMA, self.engine)
+        self.payload = album(tracks)
+
+
+    def time_validate(self, tracks):
+        self.schema.validate(self.payload)
+
+
+    def time_validate_path(self, tracks):
+        self.schema.validate_path(self.payload, ('album',))
+
+
+
+class CompiledSchemaSuite(SchemaSuite):
+    engine = 'compiled'
+
+
+
+class CompiledValidateSuite(ValidateSuite):
+    engine = 'compiled'
@@ -0,0 +1,105 @@
+'''
+Synthetic metadata documents for benchmarks
+
+All generated scalars are strings, so that the same documents can be
+serialized to every supported file format (StrictYAML has no other scalar
+types). Output is deterministic for given arguments.
+'''
+
+
+import os
+
+from hods import Metadata
+
+
+SIZES = (10, 1000, 10000)  # number of leaf values (or tracks) in a document
+DEPTHS = (1, 4, 8)  # nesting levels of generic documents
+FORMATS = ('JSON', 'YAML', 'StrictYAML')
+EXTENSIONS = {
+    'JSON': '.json',
+    'YAML': '.yml',
+    'StrictYAML': '.syml',
+}
+ALBUM_SCHEMA = 'music-album-v1.json'
+
+
+def album(tracks):
+    '''Payload that conforms to music album schema bundled with HODS'''
+    return {
+        'album': 'Album with {} tracks'.format(tracks),
+        'artist': 'Some Performer',
+        'year': '2010',
+        'image_url': 'http://imagehost/img.jpeg',
+        'genre': 'Benchmark',
+        'comment': '',
+        'composer': '',
+        'orig_artist': '',
+        'cd': '',
+        'tracks': [
+            {
+                'number': str(number),
+                'title': 'Track {:05d}'.format(number),
+                'artist': 'Performer {}'.format(number % 7),
+            }
+            for number in range(1, tracks + 1)
+        ],
+    }
+
+
+def nested(size, depth, branching=4):
+    '''
+    Payload of nested mappings `depth` levels deep with roughly `size` leaf
+    values. Each leaf is a short list of strings.
+    '''
+    leaves = [0]
+
+    def build(level, width):
+        if level >= depth or width <= 1:
+            node = {}
+            for _ in range(max(width, 1)):
+                number = leaves[0]
+                leaves[0] += 1
+                node['value{}'.format(number)] = ['item {}'.format(number), 'юникод']
+            return node
+        node = {}
+        children = min(branching, width)
+        for index in range(children):
+            share = width // children + (1 if index < width % children else 0)
+            node['level{}_{}'.format(level, index)] = build(level + 1, share)
+        return node
+
+    return build(1, size)
+
+
+def metadata(payload, schema=None):
+    '''Wrap payload into Metadata object with up to date hashes'''
+    meta = Metadata(payload)
+    if schema:
+        meta.info.schema.data = schema
+    meta.validate_hashes(write_updates=True)
+    return meta
+
+
+def write_document(directory, name, payload, fileformat='JSON', schema=None):
+    '''Write metadata file and return its path'''
+    filename = os.path.join(directory, name + EXTENSIONS[fileformat])
+    metadata(payload, schema).write(filename, fileformat=fileformat)
+    return filename
+
+
+def write_tree(directory, files=100, tracks=50, fanout=10):
+    '''
+    Write a directory tree of album metadata files in JSON format (`fanout`
+    files per subdirectory). Return list of paths.
+    '''
+    created = []
+    for number in range(files):
+        subdirectory = os.path.join(directory, 'dir{:03d}'.format(number // fanout))
+        os.makedirs(subdirectory, exist_ok=True)
+        created.append(write_document(
+            subdirectory,
+            'album{:05d}'.format(number),
+            album(tracks),
+            schema=ALBUM_SCHEMA,
+        ))
+    return created
@@ -0,0 +1,228 @@
+'''
+Usage:
+    python -m benchmarks.run [--quick] [--repeat=N] [--results=DIR]
+                             [--compare=REVISION] [--threshold=RATIO] [PATTERN]
+
+Run benchmarks without installing airspeed velocity. Only benchmarks whose
+names match PATTERN (regular expression) are executed.
+
+Results are saved as JSON to `DIR/MACHINE/COMMIT.json` (default directory:
+`.benchmarks`). If `--compare` is given, results are compared to the ones
+stored for another revision and exit code is 1 if any benchmark became
+slower by more than RATIO (default: 1.2).
+
+`--quick` runs each benchmark only once (useful to check that benchmarks
+still work).
+'''
+
+
+import importlib
+import itertools
+import json
+import os
+import pkgutil
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+from collections import namedtuple
+
+
+RESULTS_DIR = '.benchmarks'
+REPEAT = 5
+THRESHOLD = 1.2
+MIN_DURATION = 0.2  # seconds per measurement
+PREFIX = 'time_'
+
+Benchmark = namedtuple('Benchmark', 'name,cls,method,params')
+
+
+def main(*args):
+    if not args:
+        args = sys.argv[1:]
+    args = list(args)
+
+    options = {
+        '--repeat=': REPEAT,
+        '--results=': RESULTS_DIR,
+        '--compare=': None,
+        '--threshold=': THRESHOLD,
+    }
+    quick = False
+    pattern = None
+    for arg in args:
+        for flag, default in options.items():
+            if arg.startswith(flag):
+                value = arg.replace(flag, '', 1)
+                options[flag] = type(default)(value) if default is not None else value
+                break
+        else:
+            if arg == '--quick':
+                quick = True
+            elif arg in {'-h', '--help'}:
+                print(__doc__.strip())
+                return
+            else:
+                pattern = arg
+
+    results = {}
+    for benchmark in discover(pattern):
+        duration = measure(benchmark, repeat=1 if quick else options['--repeat='], quick=quick)
+        if duration is None:
+            print('{}: skipped'.format(benchmark.name), flush=True)
+            continue
+        results[benchmark.name] = duration
+        print('{}: {}'.format(benchmark.name, format_duration(duration)), flush=True)
+
+    commit = git_revision()
+    filename = save_results(results, options['--results='], commit)
+    print('Results saved to {}'.format(filename))
+
+    if options['--compare=']:
+        previous = load_results(options['--results='], git_revision(options['--compare=']))
+        regressions = compare(previous, results, options['--threshold='])
+        if regressions:
+            sys.exit(1)
+
+
+def discover(pattern=None, package='benchmarks'):
+    '''Yield Benchmark tuples for asv-style suites in the package'''
+    root = importlib.import_module(package)
+    for module_info in sorted(pkgutil.iter_modules(root.__path__), key=lambda m: m[1]):
+        module_name = module_info[1]
+        if not module_name.startswith('bench_'):
+            continue
+        module = importlib.import_module('{}.{}'.format(package, module_name))
+        for class_name, cls in sorted(vars(module).items()):
+            if not isinstance(cls, type) or cls.__module__ != module.__name__:
+                continue
+            for method in sorted(m for m in dir(cls) if m.startswith(PREFIX)):
+                for params in param_combinations(cls):
+                    name = '{}.{}.{}'.format(module_name, class_name, method)
+                    if params:
+                        name += '({})'.format(', '.join(str(p) for p in params))
+                    if pattern and not re.search(pattern, name):
+                        continue
+                    yield Benchmark(name, cls, method, params)
+
+
+def param_combinations(cls):
+    '''Expand asv `params` attribute into a list of argument tuples'''
+    params = getattr(cls, 'params', [])
+    if not params:
+        return [()]
+    if not isinstance(params[0], (list, tuple)):  # single parameter
+        params = [params]
+    return list(itertools.product(*params))
+
+
+def measure(benchmark, repeat=REPEAT, quick=False):
+    '''
+    Return median duration of a single benchmark call in seconds or None if
+    the benchmark is not applicable for given parameters
+    '''
+    instance = benchmark.cls()
+    setup = getattr(instance, 'setup', None)
+    teardown = getattr(instance, 'teardown', None)
+    if setup is not None:
+        try:
+            setup(*benchmark.params)
+        except NotImplementedError:
+            return None
+    try:
+        method = getattr(instance, benchmark.method)
+        timer = timeit.Timer(lambda: method(*benchmark.params))
+        if quick:
+            return timer.timeit(number=1)
+        number = calibrate(timer)
+        samples = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+        return statistics.median(samples)
+    finally:
+        if teardown is not None:
+            teardown(*benchmark.params)
+
+
+def calibrate(timer):
+    '''Find the number of loops that takes at least MIN_DURATION'''
+    number = 1
+    while True:
+        duration = timer.timeit(number=number)
+        if duration >= MIN_DURATION:
+            return number
+        number = max(number * 2, int(number * MIN_DURATION / max(duration, 1e-9)))
+
+
+def compare(previous, current, threshold=THRESHOLD):
+    '''Print comparison of two sets of results and return names of regressions'''
+    regressions = []
+    for name in sorted(set(previous).intersection(current)):
+        ratio = current[name] / previous[name]
+        if ratio > threshold:
+            mark = 'SLOWER'
+            regressions.append(name)
+        elif ratio < 1 / threshold:
+            mark = 'faster'
+        else:
+            continue
+        print('{:>6} {:6.2f}x {} -> {} {}'.format(
+            mark,
+            ratio,
+            format_duration(previous[name]),
+            format_duration(current[name]),
+            name,
+        ))
+    if not regressions:
+        print('No regressions')
+    return regressions
+
+
+def save_results(results, directory=RESULTS_DIR, commit=None):
+    '''Save results to JSON file and return its path'''
+    path = os.path.join(directory, machine_name())
+    os.makedirs(path, exist_ok=True)
+    filename = os.path.join(path, '{}.json'.format(commit or 'unknown'))
+    with open(filename, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'machine': machine_name(),
+            'python': platform.python_version(),
+            'results': results,
+        }, f, indent=2, sort_keys=True)
+    return filename
+
+
+def load_results(directory=RESULTS_DIR, commit=None):
+    filename = os.path.join(directory, machine_name(), '{}.json'.format(commit))
+    with open(filename) as f:
+        return json.load(f)['results']
+
+
+def machine_name():
+    return platform.node() or 'unknown'
+
+
+def git_revision(revision='HEAD'):
+    '''Return short commit hash (or the revision itself if git is not available)'''
+    try:
+        output = subprocess.check_output(
+            ['git', 'rev-parse', '--short', revision],
+            stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return revision
+    return output.decode().strip()
+
+
+def format_duration(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return '{:.3f}{}'.format(seconds / scale, unit)
+    return '{:.0f}ns'.format(seconds / 1e-9)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,11 +2,48 @@
 Human Oriented Data Storage
 '''
 
-from hods._lib.exceptions import (
-    HashMismatchError,
-    ValidationErrors,
-)
-from hods._lib.core import (
-    TreeStructuredData,
-    Metadata,
-)
+import sys
+from importlib import import_module
+
+
+# Public API is loaded on first access. That keeps `import hods` cheap for
+# the tools that do not need the whole library (e.g. `hods help`)
+_PUBLIC_API = {
+    'HashMismatchError':  'hods._lib.exceptions',
+    'ValidationErrors':   'hods._lib.exceptions',
+    'TreeStructuredData': 'hods._lib.core',
+    'FrozenTreeStructuredData': 'hods._lib.core',
+    'Metadata':           'hods._lib.core',
+    'Profiler':           'hods._lib.profile',
+    'RecordLog':          'hods._lib.records',
+}
+__all__ = sorted(_PUBLIC_API)
+
+
+def __getattr__(name):
+    try:
+        module = _PUBLIC_API[name]
+    except KeyError:
+        raise AttributeError(
+            'module {!r} has no attribute {!r}'.format(__name__, name)
+        )
+    value = globals()[name] = getattr(import_module(module), name)
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()).union(__all__))
+
+
+if sys.version_info < (3, 7):  # module level __getattr__ is not supported
+    from hods._lib.exceptions import (
+        HashMismatchError,
+        ValidationErrors,
+    )
+    from hods._lib.core import (
+        TreeStructuredData,
+        FrozenTreeStructuredData,
+        Metadata,
+    )
+    from hods._lib.profile import Profiler
+    from hods._lib.records import RecordLog
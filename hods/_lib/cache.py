@@ -0,0 +1,224 @@
+'''
+Persistent cache of verification results
+
+Files that passed verification are recorded together with their size,
+modification time and inode number. Such files can be skipped on subsequent
+checks if none of these values has changed, and neither hods itself nor the
+contents of the schemas used by the file have changed.
+
+Files modified shortly before the check are not recorded: they may be
+modified again within the granularity of modification time.
+'''
+
+
+import json
+import os
+import sqlite3
+import time
+from functools import lru_cache
+from hashlib import sha256
+
+from hods._lib.parsecache import RACY_WINDOW
+
+
+CACHE_FILENAME = '.hods-cache'
+CACHE_VERSION = 2
+
+
+class VerificationCache:
+    '''
+    On-disk storage of verification results (SQLite database).
+
+    Any problem with the database disables the cache instead of raising an
+    exception, so that the caller falls back to full verification.
+    '''
+
+
+    def __init__(self, directory='.', filename=CACHE_FILENAME):
+        self.path = os.path.join(directory, filename)
+        self._schemas = {}  # schema identifier -> hash of its contents
+        self._db = None
+        try:
+            self._db = self._connect()
+        except sqlite3.DatabaseError:  # corrupted cache file
+            try:
+                os.remove(self.path)
+                self._db = self._connect()
+            except (OSError, sqlite3.DatabaseError):
+                self._db = None
+
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=5)
+        try:
+            version = db.execute('PRAGMA user_version').fetchone()[0]
+            if version != CACHE_VERSION:
+                db.execute('DROP TABLE IF EXISTS verified')
+                db.execute('PRAGMA user_version = {:d}'.format(CACHE_VERSION))
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS verified ('
+                '    path TEXT PRIMARY KEY,'
+                '    size INTEGER,'
+                '    mtime_ns INTEGER,'
+                '    inode INTEGER,'
+                '    schemas TEXT,'
+                '    result TEXT,'
+                '    fingerprint TEXT'
+                ')'
+            )
+            db.commit()
+        except sqlite3.DatabaseError:
+            db.close()
+            raise
+        return db
+
+
+    @property
+    def enabled(self):
+        return self._db is not None
+
+
+    def is_verified(self, filename, stat):
+        '''Check if file with given stat result has passed verification before'''
+        if self._db is None or stat is None:
+            return False
+        try:
+            row = self._db.execute(
+                'SELECT size, mtime_ns, inode, schemas, fingerprint FROM verified WHERE path = ?',
+                (cache_key(filename),)
+            ).fetchone()
+        except sqlite3.DatabaseError:
+            self._db = None
+            return False
+        if row is None or row[:3] != stat_tuple(stat):
+            return False
+        return row[4] == self.fingerprint(json.loads(row[3]))
+
+
+    def fingerprint(self, schemas):
+        '''
+        Hash of hods version and of the contents of given schemas. None if any
+        of the schemas can not be fetched
+        '''
+        digest = sha256(hods_version().encode())
+        for identifier in schemas:
+            try:
+                content = self._schemas[identifier]
+            except KeyError:
+                content = self._schemas[identifier] = schema_hash(identifier)
+            if content is None:
+                return None
+            digest.update('\n{}\n{}'.format(identifier, content).encode())
+        return digest.hexdigest()
+
+
+    def record(self, filename, stat, schemas, result):
+        '''
+        Save verification result. Only successful results for the files that
+        were not modified recently are kept
+        '''
+        if self._db is None:
+            return
+        schemas = [identifier for identifier in schemas if identifier]
+        fingerprint = None
+        if result == 'OK' and stat is not None and time.time() - stat.st_mtime >= RACY_WINDOW:
+            fingerprint = self.fingerprint(schemas)
+        try:
+            if fingerprint is None:
+                self._db.execute(
+                    'DELETE FROM verified WHERE path = ?',
+                    (cache_key(filename),)
+                )
+            else:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO verified VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (cache_key(filename),) + stat_tuple(stat)
+                    + (json.dumps(schemas), result, fingerprint)
+                )
+        except sqlite3.DatabaseError:
+            self._db = None
+
+
+    def commit(self):
+        '''Write pending changes to disk and keep the cache open'''
+        if self._db is None:
+            return
+        try:
+            self._db.commit()
+        except sqlite3.DatabaseError:
+            self._db = None
+
+
+    def close(self):
+        '''Write pending changes to disk'''
+        if self._db is None:
+            return
+        try:
+            self._db.commit()
+            self._db.close()
+        except sqlite3.DatabaseError:
+            pass
+        self._db = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+
+def cache_key(filename):
+    '''Normalize file path for usage as cache key'''
+    return os.path.realpath(filename)
+
+
+@lru_cache(maxsize=None)
+def hods_version():
+    '''
+    Identify installed version of hods by the size and modification time of
+    its modules and bundled schemas (version number does not change between
+    development snapshots)
+    '''
+    import hods
+    package = os.path.dirname(os.path.abspath(hods.__file__))
+    files = []
+    for directory, subdirectories, filenames in os.walk(package):
+        subdirectories[:] = sorted(d for d in subdirectories if d != '__pycache__')
+        for name in sorted(filenames):
+            if name.endswith(('.py', '.json')):
+                stat = os.stat(os.path.join(directory, name))
+                relative = os.path.relpath(os.path.join(directory, name), package)
+                files.append('{} {} {}'.format(relative, stat.st_size, stat.st_mtime_ns))
+    return sha256('\n'.join(files).encode()).hexdigest()
+
+
+def schema_hash(identifier):
+    '''Hash of the current contents of schema, None if it is not available'''
+    from hods._lib.schemas import fetch_schema, restore_full_schema_id
+    try:
+        raw = fetch_schema(restore_full_schema_id(identifier))
+    except (OSError, ValueError):  # schema errors are reported by verification
+        return None
+    return sha256(raw.encode()).hexdigest()
+
+
+def stat_tuple(stat):
+    '''Extract values that are compared to detect changed files'''
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+def get_stat(filename):
+    '''
+    Return os.stat() result or None if file is not accessible.
+    Cached result is used for os.DirEntry objects.
+    '''
+    try:
+        if isinstance(filename, str):
+            return os.stat(filename)
+        else:
+            return filename.stat()
+    except OSError:
+        return None
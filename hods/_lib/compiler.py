@@ -0,0 +1,698 @@
+'''
+Schema engine that compiles JSON Schema into Python code
+
+jsonschema interprets schema dictionaries on every validation. This engine
+translates each subschema into a specialized Python function once, so that
+validation executes only the checks that are relevant for the schema.
+
+Supported keywords are the ones of draft-07 except `format` (which is not
+asserted by jsonschema by default either) and `$ref` to anything other than
+JSON pointers. Schema with unsupported keywords can not be compiled
+(ValueError is raised).
+
+Validation stops at the first error found. Raised SchemaValidationError
+provides the same attributes as jsonschema.ValidationError: `message`,
+`validator`, `validator_value`, `instance`, `path` and `schema_path`.
+Messages are formatted like the ones of jsonschema. Paths of errors from
+`false` subschemas lead to the rejected value, jsonschema ends them at the
+parent keyword instead.
+'''
+
+
+import copy
+import re
+from collections.abc import Sequence
+from fractions import Fraction
+from itertools import count
+from numbers import Number
+from urllib.parse import unquote, urldefrag, urljoin
+
+from hods._lib.exceptions import SchemaValidationError
+
+
+IGNORED_KEYWORDS = {
+    '$schema',
+    '$id',
+    '$comment',
+    'title',
+    'description',
+    'default',
+    'examples',
+    'definitions',
+    'format',
+    'readOnly',
+    'writeOnly',
+    'contentMediaType',
+    'contentEncoding',
+}
+OBJECT_KEYWORDS = {
+    'required',
+    'minProperties',
+    'maxProperties',
+    'properties',
+    'patternProperties',
+    'additionalProperties',
+    'dependencies',
+    'propertyNames',
+}
+ARRAY_KEYWORDS = {
+    'minItems',
+    'maxItems',
+    'uniqueItems',
+    'items',
+    'additionalItems',
+    'contains',
+}
+STRING_KEYWORDS = {
+    'minLength',
+    'maxLength',
+    'pattern',
+}
+NUMBER_KEYWORDS = {
+    'minimum',
+    'maximum',
+    'exclusiveMinimum',
+    'exclusiveMaximum',
+    'multipleOf',
+}
+GENERIC_KEYWORDS = {
+    'type',
+    'enum',
+    'const',
+    'allOf',
+    'anyOf',
+    'oneOf',
+    'not',
+    'if',
+    'then',
+    'else',
+}
+# keyword: (comparison, limit with special message, special message, message)
+SIZE_LIMITS = {
+    'minProperties': ('<', 1, 'should be non-empty', 'does not have enough properties'),
+    'maxProperties': ('>', 0, 'is expected to be empty', 'has too many properties'),
+    'minItems': ('<', 1, 'should be non-empty', 'is too short'),
+    'maxItems': ('>', 0, 'is expected to be empty', 'is too long'),
+    'minLength': ('<', 1, 'should be non-empty', 'is too short'),
+    'maxLength': ('>', 0, 'is expected to be empty', 'is too long'),
+}
+SUPPORTED_KEYWORDS = IGNORED_KEYWORDS | OBJECT_KEYWORDS | ARRAY_KEYWORDS \
+                   | STRING_KEYWORDS | NUMBER_KEYWORDS | GENERIC_KEYWORDS
+
+TYPE_CHECKS = {
+    'object':  'isinstance(data, dict)',
+    'array':   'isinstance(data, list)',
+    'string':  'isinstance(data, str)',
+    'boolean': 'isinstance(data, bool)',
+    'null':    'data is None',
+    'number':  '(isinstance(data, Number) and not isinstance(data, bool))',
+    'integer': '(isinstance(data, int) and not isinstance(data, bool)'
+               ' or isinstance(data, float) and data.is_integer())',
+}
+
+
+class SchemaCompiler:
+    '''
+    Generates validator functions for a schema and its subschemas.
+
+    Every subschema is compiled into a separate function once, functions for
+    the subschemas used in multiple places (e.g. via `$ref`) are shared.
+    Referenced documents other than the schema itself are obtained with
+    `load(url)`.
+    '''
+
+
+    def __init__(self, schema, base_uri='', load=None):
+        if isinstance(schema, dict):
+            base_uri = urljoin(base_uri, schema.get('$id', ''))
+        self.base_uri = urldefrag(base_uri)[0]
+        self.documents = {self.base_uri: schema}
+        self.load = load
+        self.namespace = dict(
+            Invalid=SchemaValidationError,
+            Number=Number,
+            equal=equal,
+            extras_msg=extras_msg,
+            fail=fail,
+            is_multiple=is_multiple,
+            is_unique=is_unique,
+        )
+        self._names = {}  # id(schema) -> (schema, function name)
+        self._counter = count()
+        self._queue = []
+        self.validate = self.function(schema)
+
+
+    def function(self, schema, base_uri=None):
+        '''Return validator function for a (sub)schema'''
+        name = self._name(schema, base_uri or self.base_uri)
+        source = []
+        while self._queue:
+            source.append(self._generate(*self._queue.pop()))
+        if source:
+            code = compile('\n\n'.join(source), '<compiled schema {}>'.format(self.base_uri), 'exec')
+            exec(code, self.namespace)
+        return self.namespace[name]
+
+
+    def detached(self):
+        '''
+        Return a copy of compiler that reuses already generated functions, but
+        does not keep the new ones in this compiler
+        '''
+        clone = copy.copy(self)
+        clone.namespace = dict(self.namespace)
+        clone._names = dict(self._names)
+        clone._queue = []
+        return clone
+
+
+    def _name(self, schema, base_uri):
+        '''Return function name for schema, schedule code generation if needed'''
+        known, name = self._names.get(id(schema), (None, None))
+        if known is schema:
+            return name
+        name = 'validate_{}'.format(next(self._counter))
+        self._names[id(schema)] = (schema, name)
+        self._queue.append((schema, base_uri, name))
+        return name
+
+
+    def _constant(self, value):
+        '''Make value available to generated code, return its name'''
+        name = 'const_{}'.format(next(self._counter))
+        self.namespace[name] = value
+        return name
+
+
+    def _generate(self, schema, base_uri, name):
+        body = self._body(schema, base_uri)
+        lines = ['def {}(data):'.format(name)]
+        lines.extend('    ' + line for line in body or ['pass'])
+        return '\n'.join(lines)
+
+
+    def _body(self, schema, base_uri):
+        if schema is True:
+            return []
+        if schema is False:
+            return self._fail('False schema does not allow {!r}', None, False)
+        if not isinstance(schema, dict):
+            raise ValueError('schema must be an object or a boolean: {!r}'.format(schema))
+        if '$id' in schema:
+            base_uri = urldefrag(urljoin(base_uri, schema['$id']))[0]
+        if '$ref' in schema:  # other keywords are ignored next to $ref in draft-07
+            target, target_uri = self._resolve(schema['$ref'], base_uri)
+            return ['{}(data)'.format(self._name(target, target_uri))]
+        unknown = set(schema) - SUPPORTED_KEYWORDS
+        if unknown:
+            raise ValueError('keywords not supported by compiled schema engine: {}'.format(
+                ', '.join(sorted(unknown))
+            ))
+
+        lines = []
+        lines.extend(self._type(schema))
+        lines.extend(self._values(schema))
+        groups = (
+            ('object', OBJECT_KEYWORDS, self._object),
+            ('array', ARRAY_KEYWORDS, self._array),
+            ('string', STRING_KEYWORDS, self._string),
+            ('number', NUMBER_KEYWORDS, self._number),
+        )
+        for type_name, keywords, generate in groups:
+            if keywords.intersection(schema):
+                group = generate(schema, base_uri)
+                if group:
+                    lines.append('if {}:'.format(TYPE_CHECKS[type_name]))
+                    lines.extend(indent(group))
+        lines.extend(self._combinators(schema, base_uri))
+        return lines
+
+
+    def _fail(self, message, keyword, value, *args):
+        '''
+        Lines that raise validation error. Message is formatted with `args`
+        (expressions in generated code) or with the instance if no args given.
+        '''
+        return ['raise fail({!r}, {!r}, {}, data{})'.format(
+            message,
+            keyword,
+            self._constant(value),
+            ''.join(', ' + arg for arg in args),
+        )]
+
+
+    def _size(self, schema, keyword):
+        '''Lines for minItems, maxLength and other size limits'''
+        operator, special, special_text, text = SIZE_LIMITS[keyword]
+        limit = schema[keyword]
+        return ['if len(data) {} {!r}:'.format(operator, limit)] + indent(self._fail(
+            '{!r} ' + (special_text if limit == special else text),
+            keyword,
+            limit,
+        ))
+
+
+    def _call(self, function, argument, schema_path, path=()):
+        '''
+        Lines that call another validator function and extend the paths of
+        raised error. Path elements are expressions in generated code.
+        '''
+        return [
+            'try:',
+            '    {}({})'.format(function, argument),
+            'except Invalid as error:',
+            '    error.descend(({},){})'.format(
+                ', '.join(schema_path),
+                ''.join(', ' + item for item in path),
+            ),
+            '    raise',
+        ]
+
+
+    def _resolve(self, reference, base_uri):
+        '''Find referenced subschema, return it with its base URI'''
+        url, fragment = urldefrag(urljoin(base_uri, reference))
+        document = self.documents.get(url)
+        if document is None:
+            if self.load is None:
+                raise ValueError('can not resolve reference: {}'.format(reference))
+            document = self.documents[url] = self.load(url)
+        return resolve_pointer(document, fragment), url
+
+
+    def _type(self, schema):
+        if 'type' not in schema:
+            return []
+        types = schema['type']
+        if isinstance(types, str):
+            types = [types]
+        try:
+            condition = ' or '.join(TYPE_CHECKS[name] for name in types)
+        except KeyError as error:
+            raise ValueError('unknown type: {}'.format(error.args[0]))
+        message = '{{!r}} is not of type {}'.format(escape(', '.join(repr(t) for t in types)))
+        return ['if not ({}):'.format(condition or 'False')] \
+             + indent(self._fail(message, 'type', schema['type']))
+
+
+    def _values(self, schema):
+        lines = []
+        if 'enum' in schema:
+            enum = self._constant(schema['enum'])
+            lines.append('if not any(equal(data, value) for value in {}):'.format(enum))
+            lines.extend(indent(self._fail(
+                '{{!r}} is not one of {}'.format(escape(repr(schema['enum']))),
+                'enum',
+                schema['enum'],
+            )))
+        if 'const' in schema:
+            lines.append('if not equal(data, {}):'.format(self._constant(schema['const'])))
+            lines.extend(indent(self._fail(
+                '{} was expected'.format(escape(repr(schema['const']))),
+                'const',
+                schema['const'],
+            )))
+        return lines
+
+
+    def _object(self, schema, base_uri):
+        lines = []
+        for name in schema.get('required', ()):
+            lines.append('if {!r} not in data:'.format(name))
+            lines.extend(indent(self._fail(
+                escape('{!r} is a required property'.format(name)),
+                'required',
+                schema['required'],
+            )))
+        for keyword in ('minProperties', 'maxProperties'):
+            if keyword in schema:
+                lines.extend(self._size(schema, keyword))
+        for name, subschema in schema.get('properties', {}).items():
+            if subschema is True or subschema == {}:
+                continue
+            lines.append('if {!r} in data:'.format(name))
+            lines.extend(indent(self._call(
+                self._name(subschema, base_uri),
+                'data[{!r}]'.format(name),
+                ("'properties'", repr(name)),
+                (repr(name),),
+            )))
+        for name, dependency in schema.get('dependencies', {}).items():
+            lines.append('if {!r} in data:'.format(name))
+            if isinstance(dependency, list):
+                for required in dependency:
+                    lines.append('    if {!r} not in data:'.format(required))
+                    lines.extend(indent(self._fail(
+                        escape('{!r} is a dependency of {!r}'.format(required, name)),
+                        'dependencies',
+                        schema['dependencies'],
+                    ), 2))
+            else:
+                lines.extend(indent(self._call(
+                    self._name(dependency, base_uri),
+                    'data',
+                    ("'dependencies'", repr(name)),
+                )))
+        if 'propertyNames' in schema:
+            lines.append('for key in data:')
+            lines.extend(indent(self._call(
+                self._name(schema['propertyNames'], base_uri),
+                'key',
+                ("'propertyNames'",),
+            )))
+        lines.extend(self._property_loop(schema, base_uri))
+        return lines
+
+
+    def _property_loop(self, schema, base_uri):
+        '''Lines for patternProperties and additionalProperties'''
+        patterns = schema.get('patternProperties', {})
+        additional = schema.get('additionalProperties', True)
+        if not patterns and (additional is True or additional == {}):
+            return []
+        lines = []
+        if additional is False:
+            lines.append('extras = []')
+        lines.append('for key, value in data.items():')
+        if additional is not True:
+            lines.append('    matched = False')
+        for pattern, subschema in patterns.items():
+            search = self._constant(re.compile(pattern).search)
+            lines.append('    if {}(key):'.format(search))
+            if additional is not True:
+                lines.append('        matched = True')
+            if subschema is True or subschema == {}:
+                continue
+            lines.extend(indent(self._call(
+                self._name(subschema, base_uri),
+                'value',
+                ("'patternProperties'", repr(pattern)),
+                ('key',),
+            ), 2))
+        if additional is True:
+            return lines
+        known = self._constant(frozenset(schema.get('properties', ())))
+        lines.append('    if not matched and key not in {}:'.format(known))
+        if additional is False:
+            lines.append('        extras.append(key)')
+            lines.append('if extras:')
+            if patterns:
+                message = '{{}} {{}} not match any of the regexes: {}'.format(
+                    escape(', '.join(repr(pattern) for pattern in sorted(patterns)))
+                )
+                verbs = "'does', 'do'"
+            else:
+                message = 'Additional properties are not allowed ({} {} unexpected)'
+                verbs = "'was', 'were'"
+            lines.extend(indent(self._fail(
+                message,
+                'additionalProperties',
+                False,
+                '*extras_msg(sorted(extras, key=str), {})'.format(verbs),
+            )))
+        else:
+            lines.extend(indent(self._call(
+                self._name(additional, base_uri),
+                'value',
+                ("'additionalProperties'",),
+                ('key',),
+            ), 2))
+        return lines
+
+
+    def _array(self, schema, base_uri):
+        lines = []
+        for keyword in ('minItems', 'maxItems'):
+            if keyword in schema:
+                lines.extend(self._size(schema, keyword))
+        if schema.get('uniqueItems'):
+            lines.append('if not is_unique(data):')
+            lines.extend(indent(self._fail('{!r} has non-unique elements', 'uniqueItems', True)))
+        items = schema.get('items', True)
+        if isinstance(items, list):
+            for index, subschema in enumerate(items):
+                lines.append('if len(data) > {}:'.format(index))
+                lines.extend(indent(self._call(
+                    self._name(subschema, base_uri),
+                    'data[{}]'.format(index),
+                    ("'items'", str(index)),
+                    (str(index),),
+                )))
+            additional = schema.get('additionalItems', True)
+            if additional is False:
+                lines.append('if len(data) > {}:'.format(len(items)))
+                lines.extend(indent(self._fail(
+                    'Additional items are not allowed ({} {} unexpected)',
+                    'additionalItems',
+                    False,
+                    '*extras_msg(data[{}:])'.format(len(items)),
+                )))
+            elif additional is not True and additional != {}:
+                lines.append('for index in range({}, len(data)):'.format(len(items)))
+                lines.extend(indent(self._call(
+                    self._name(additional, base_uri),
+                    'data[index]',
+                    ("'additionalItems'",),
+                    ('index',),
+                )))
+        elif items is not True and items != {}:
+            lines.append('for index, item in enumerate(data):')
+            lines.extend(indent(self._call(
+                self._name(items, base_uri),
+                'item',
+                ("'items'",),
+                ('index',),
+            )))
+        if 'contains' in schema:
+            function = self._name(schema['contains'], base_uri)
+            lines.extend([
+                'for item in data:',
+                '    try:',
+                '        {}(item)'.format(function),
+                '    except Invalid:',
+                '        continue',
+                '    break',
+                'else:',
+            ])
+            lines.extend(indent(self._fail(
+                'None of {!r} are valid under the given schema',
+                'contains',
+                schema['contains'],
+            )))
+        return lines
+
+
+    def _string(self, schema, base_uri):
+        lines = []
+        for keyword in ('minLength', 'maxLength'):
+            if keyword in schema:
+                lines.extend(self._size(schema, keyword))
+        if 'pattern' in schema:
+            search = self._constant(re.compile(schema['pattern']).search)
+            lines.append('if not {}(data):'.format(search))
+            lines.extend(indent(self._fail(
+                '{{!r}} does not match {}'.format(escape(repr(schema['pattern']))),
+                'pattern',
+                schema['pattern'],
+            )))
+        return lines
+
+
+    def _number(self, schema, base_uri):
+        lines = []
+        comparisons = (
+            ('minimum', '<', 'is less than the minimum of'),
+            ('maximum', '>', 'is greater than the maximum of'),
+            ('exclusiveMinimum', '<=', 'is less than or equal to the minimum of'),
+            ('exclusiveMaximum', '>=', 'is greater than or equal to the maximum of'),
+        )
+        for keyword, operator, text in comparisons:
+            if keyword not in schema:
+                continue
+            limit = schema[keyword]
+            lines.append('if data {} {!r}:'.format(operator, limit))
+            lines.extend(indent(self._fail(
+                '{{!r}} {} {}'.format(text, escape(repr(limit))),
+                keyword,
+                limit,
+            )))
+        if 'multipleOf' in schema:
+            divisor = schema['multipleOf']
+            lines.append('if not is_multiple(data, {!r}):'.format(divisor))
+            lines.extend(indent(self._fail(
+                '{{!r}} is not a multiple of {}'.format(escape(repr(divisor))),
+                'multipleOf',
+                divisor,
+            )))
+        return lines
+
+
+    def _combinators(self, schema, base_uri):
+        lines = []
+        for index, subschema in enumerate(schema.get('allOf', ())):
+            lines.extend(self._call(
+                self._name(subschema, base_uri),
+                'data',
+                ("'allOf'", str(index)),
+            ))
+        if 'anyOf' in schema:
+            functions = [self._name(s, base_uri) for s in schema['anyOf']]
+            lines.extend([
+                'for validate in ({},):'.format(', '.join(functions)),
+                '    try:',
+                '        validate(data)',
+                '    except Invalid:',
+                '        continue',
+                '    break',
+                'else:',
+            ])
+            lines.extend(indent(self._fail(
+                '{!r} is not valid under any of the given schemas',
+                'anyOf',
+                schema['anyOf'],
+            )))
+        if 'oneOf' in schema:
+            variants = [
+                '({}, {})'.format(self._name(s, base_uri), self._constant(s))
+                for s in schema['oneOf']
+            ]
+            lines.extend([
+                'valid = []',
+                'for validate, subschema in ({},):'.format(', '.join(variants)),
+                '    try:',
+                '        validate(data)',
+                '    except Invalid:',
+                '        continue',
+                '    valid.append(subschema)',
+                'if not valid:',
+            ])
+            lines.extend(indent(self._fail(
+                '{!r} is not valid under any of the given schemas',
+                'oneOf',
+                schema['oneOf'],
+            )))
+            lines.append('if len(valid) > 1:')
+            lines.extend(indent(self._fail(
+                '{!r} is valid under each of {}',
+                'oneOf',
+                schema['oneOf'],
+                'data',
+                "', '.join(map(repr, valid[1:] + valid[:1]))",
+            )))
+        if 'not' in schema:
+            lines.extend([
+                'try:',
+                '    {}(data)'.format(self._name(schema['not'], base_uri)),
+                'except Invalid:',
+                '    pass',
+                'else:',
+            ])
+            lines.extend(indent(self._fail(
+                '{{!r}} should not be valid under {}'.format(escape(repr(schema['not']))),
+                'not',
+                schema['not'],
+            )))
+        if 'if' in schema and ('then' in schema or 'else' in schema):
+            lines.extend([
+                'try:',
+                '    {}(data)'.format(self._name(schema['if'], base_uri)),
+                'except Invalid:',
+            ])
+            if 'else' in schema:
+                lines.extend(indent(self._call(
+                    self._name(schema['else'], base_uri),
+                    'data',
+                    ("'else'",),
+                )))
+            else:
+                lines.append('    pass')
+            if 'then' in schema:
+                lines.append('else:')
+                lines.extend(indent(self._call(
+                    self._name(schema['then'], base_uri),
+                    'data',
+                    ("'then'",),
+                )))
+        return lines
+
+
+
+def fail(message, keyword, value, instance, *args):
+    '''Create validation error (called from generated code)'''
+    return SchemaValidationError(
+        message.format(*(args or (instance,))),
+        validator=keyword,
+        validator_value=value,
+        instance=instance,
+    )
+
+
+def extras_msg(extras, singular='was', plural='were'):
+    '''Listing of unexpected items and a verb for error message, as in jsonschema'''
+    verb = singular if len(extras) == 1 else plural
+    return ', '.join(repr(extra) for extra in extras), verb
+
+
+def equal(one, two):
+    '''Compare JSON values like jsonschema does: True is not equal to 1'''
+    if one is two:
+        return True
+    if isinstance(one, str) or isinstance(two, str):
+        return one == two
+    if isinstance(one, dict) and isinstance(two, dict):
+        return len(one) == len(two) and all(
+            key in two and equal(value, two[key])
+            for key, value in one.items()
+        )
+    if isinstance(one, Sequence) and isinstance(two, Sequence):
+        return len(one) == len(two) and all(equal(a, b) for a, b in zip(one, two))
+    if isinstance(one, bool) or isinstance(two, bool):
+        return isinstance(one, bool) and isinstance(two, bool) and one == two
+    return one == two
+
+
+def is_unique(items):
+    for index, item in enumerate(items):
+        for other in items[index + 1:]:
+            if equal(item, other):
+                return False
+    return True
+
+
+def is_multiple(number, divisor):
+    if isinstance(divisor, float):
+        quotient = number / divisor
+        try:
+            return int(quotient) == quotient
+        except OverflowError:
+            return Fraction(number) % Fraction(divisor) == 0
+    return number % divisor == 0
+
+
+def resolve_pointer(document, fragment):
+    '''Find subschema by JSON pointer (URI fragment)'''
+    fragment = unquote(fragment)
+    if not fragment:
+        return document
+    if not fragment.startswith('/'):
+        raise ValueError('only JSON pointers are supported in references: #{}'.format(fragment))
+    for part in fragment[1:].split('/'):
+        part = part.replace('~1', '/').replace('~0', '~')
+        if isinstance(document, list):
+            part = int(part)
+        try:
+            document = document[part]
+        except (KeyError, IndexError, TypeError):
+            raise ValueError('unresolvable JSON pointer: #{}'.format(fragment))
+    return document
+
+
+def escape(text):
+    '''Escape text for usage in message template'''
+    return text.replace('{', '{{').replace('}', '}}')
+
+
+def indent(lines, level=1):
+    prefix = '    ' * level
+    return [prefix + line for line in lines]
@@ -7,19 +7,32 @@ import json
 import os
 from collections import namedtuple, OrderedDict
 from collections.abc import Mapping
+from contextlib import contextmanager
 from datetime import datetime, timezone
+from functools import partial
 
 from hods import (
     HashMismatchError,
     __name__ as _top_level_module,
 )
-from hods._lib.hash import datahash
+from hods._lib.hash import (
+    datahash,
+    datahashes,
+    encode_key,
+    iter_canonical,
+)
 from hods._lib.files import (
     get_object,
     write_object,
 )
 from hods._lib.schemas import Schema
 
+
+_MISSING = object()  # placeholder for attributes that did not exist before
+_SHARED = object()  # canonical JSON cache is disabled for data shared with the caller
+JOURNAL_LIMIT = 32  # changed keys above which the whole node is validated at commit
+
+
 class TreeStructuredData:
     '''
     Generic data class. Keeps all data in one tree-like object and exposes its
@@ -27,12 +40,22 @@ class TreeStructuredData:
     parent.
 
     Handles reading, modification and validation of data structure.
+
+    Canonical JSON representation of branches may be cached between hash
+    calculations when the data tree is owned by this object (see
+    `_own_data()`), i.e. it can be modified only via this class' interface.
+    Trees that were passed in by the caller are never cached, because the
+    caller may still modify them directly. Lists are not cached because they
+    may be modified in place.
     '''
     __slots__ = (
         '_data',
         '_children',
         '_parent',
+        '_key',
         '_validator',
+        '_journal',
+        '_canonical',
     )
     __module__ = _top_level_module
 
@@ -47,11 +70,53 @@ class TreeStructuredData:
             )
         self._data = data
         self._parent = parent
+        self._key = None
         self._children = dict()
         self._validator = validator
+        self._journal = None
+        self._canonical = _SHARED
         self.validate()
 
 
+    def _own_data(self):
+        '''
+        Mark the data tree as referenced only by this object, which allows
+        caching its canonical JSON representation
+        '''
+        self._canonical = None
+
+
+    def _child(self, key, shared=False):
+        '''
+        Create wrapper for a branch of this data tree. The branch is a part of
+        already validated tree, so it is not validated again (unlike calling
+        the constructor, which would validate the whole tree up to the root
+        and fail on values staged inside a transaction).
+
+        Branches that are shared with the caller (e.g. mappings assigned as new
+        values) are excluded from canonical JSON cache
+        '''
+        child = object.__new__(type(self))
+        init = partial(object.__setattr__, child)
+        init('_data', self._data[key])
+        init('_parent', self)
+        init('_key', key)
+        init('_children', dict())
+        init('_validator', None)
+        init('_journal', None)
+        init('_canonical', _SHARED if shared or self._canonical is _SHARED else None)
+        self._children[key] = child
+        return child
+
+
+    def freeze(self):
+        '''
+        Return read-only view of this data tree for fast repeated access (see
+        FrozenTreeStructuredData)
+        '''
+        return FrozenTreeStructuredData(self._data)
+
+
     def validate(self):
         '''
         Ensure this data tree and its parent are valid, raise ValidationError
@@ -63,13 +128,120 @@ class TreeStructuredData:
             self._parent.validate()
 
 
+    def _validate_change(self, attr):
+        '''
+        Validate data tree after a write to a single attribute of this node.
+
+        Validators that provide `validate_path(data, path)` method are asked to
+        check only the changed path, other validators check the whole node.
+        '''
+        path = (attr,)
+        node = self
+        while node is not None:
+            if node._validator is not None:
+                validate_path = getattr(node._validator, 'validate_path', None)
+                if validate_path is None:
+                    node._validator(node._data)
+                else:
+                    validate_path(node._data, path)
+            if node._parent is not None and node._key is None:
+                node._parent.validate()  # unknown position in the tree
+                break
+            path = (node._key,) + path
+            node = node._parent
+
+
+    def _invalidate_canonical(self, attr):
+        '''Drop cached canonical representation along the path to the root'''
+        node = self
+        while node is not None:
+            cache = node._canonical
+            if cache is not None and cache is not _SHARED:
+                try:
+                    cache.values[cache.index[attr]] = None
+                except KeyError:  # new key was added
+                    node._canonical = None
+            attr = node._key
+            node = node._parent
+
+
+    def _iter_canonical(self):
+        '''
+        Yield canonical JSON representation of this node piece by piece.
+        Cached pieces are reused and missing ones are cached for later.
+        '''
+        cache = self._canonical
+        if cache is _SHARED:
+            yield from iter_canonical(self._data)
+            return
+        if cache is None:
+            cache = self._canonical = CanonicalCache(self._data)
+        run = []
+        for position, key in enumerate(cache.keys):
+            run.append(cache.prefixes[position])
+            value = cache.values[position]
+            if value is not None:
+                run.append(value)
+                continue
+            child = self._children.get(key)
+            if child is None:
+                raw = self._data[key]
+                if is_cacheable(raw):
+                    value = cache.values[position] = ''.join(iter_canonical(raw))
+                    run.append(value)
+                    continue
+            yield ''.join(run)
+            run = []
+            if child is None:
+                yield from iter_canonical(raw)
+            else:
+                yield from child._iter_canonical()  # child keeps its own cache
+        run.append('}' if cache.keys else '{}')
+        yield ''.join(run)
+
+
+    @contextmanager
+    def transaction(self):
+        '''
+        Stage multiple changes to the data tree and validate them once when
+        leaving the context. If validation fails (or any other exception is
+        raised) all staged changes are rolled back.
+
+        Nested transactions are merged into the outermost one.
+        '''
+        root = self
+        while root._parent is not None:
+            root = root._parent
+        if root._journal is not None:
+            yield self
+            return
+
+        journal = root._journal = []
+        try:
+            yield self
+            root._journal = None
+            validate_journal(journal)
+        except Exception:
+            for node, attr, previous in reversed(journal):
+                if previous is _MISSING:
+                    del node._data[attr]
+                    node._children.pop(attr, None)
+                    if node._canonical is not _SHARED:
+                        node._canonical = None
+                else:
+                    node._data[attr] = previous
+                node._invalidate_canonical(attr)
+            raise
+        finally:
+            root._journal = None
+
+
     def __getattr__(self, attr):
         if attr in self._children:
             response = self._children[attr]
         elif attr in self._data:
             if is_mapping(self._data[attr]):
-                response = self._children[attr] = \
-                    type(self)(data=self._data[attr], parent=self)
+                response = self._child(attr)
             else:
                 response = self._data[attr]
         else:
@@ -95,8 +267,17 @@ class TreeStructuredData:
 
         if (node_exists and not node_is_mapping and not value_is_mapping) \
         or not node_exists:
+            root = self
+            while root._parent is not None:
+                root = root._parent
+            if root._journal is not None:  # defer validation until commit
+                root._journal.append((self, attr, self._data.get(attr, _MISSING)))
             self._data[attr] = value  # write leaf/branch value
-            self.validate()
+            if is_mapping(value):  # caller keeps a reference to the new branch
+                self._child(attr, shared=True)
+            self._invalidate_canonical(attr)
+            if root._journal is None:
+                self._validate_change(attr)
         elif node_exists and node_is_mapping and not value_is_mapping:
             raise AttributeError('can not replace branch node with leaf node: {}'.format(attr))
         elif node_exists and not node_is_mapping and value_is_mapping:
@@ -137,6 +318,171 @@ class TreeStructuredData:
 
 
 
+class FrozenTreeStructuredData:
+    '''
+    Read-only view of a data tree for fast repeated access.
+
+    Exposes nodes via attributes like TreeStructuredData, but never validates
+    data and does not allow modifications. Child views are cached. The view
+    refers to the same data as the object it was created from, so changes made
+    elsewhere are visible through it.
+
+    Data keys that clash with the names of methods are available only via
+    dictionary style access.
+    '''
+    __slots__ = (
+        '_data',
+        '_children',
+    )
+    __module__ = _top_level_module
+
+
+    def __init__(self, data):
+        if not is_mapping(data):
+            raise ValueError(
+                "{cls}() expected a mapping object but received '{data}'".format(
+                    cls = type(self).__name__,
+                    data = type(data).__name__,
+                )
+            )
+        object.__setattr__(self, '_data', data)
+        object.__setattr__(self, '_children', dict())
+
+
+    def __getattribute__(self, attr):
+        # Attribute lookup is overridden entirely: falling back to
+        # __getattr__ would raise and catch AttributeError on every access
+        if attr in _FROZEN_RESERVED:
+            return object.__getattribute__(self, attr)
+        children = _frozen_children(self)
+        child = children.get(attr)
+        if child is not None:
+            return child
+        try:
+            value = _frozen_data(self)[attr]
+        except KeyError:
+            raise AttributeError(
+                "'{cls}' object has no attribute '{attr}'".format(
+                    cls=type(self).__name__,
+                    attr=attr
+                )
+            )
+        if isinstance(value, dict) \
+        or not isinstance(value, _NOT_MAPPINGS) and isinstance(value, Mapping):
+            value = children[attr] = type(self)(value)
+        return value
+
+
+    def get(self, path, default=_MISSING):
+        '''
+        Get the value at dotted path, e.g. `get('a.b.0.c')`. Numeric path
+        elements are used as indices for lists. Raise KeyError if the path
+        does not exist and no default value is provided.
+        '''
+        getter = _COMPILED_PATHS.get(path) or compile_path(path)
+        try:
+            value = getter(_frozen_data(self))
+        except (KeyError, IndexError, TypeError):
+            if default is _MISSING:
+                raise KeyError(path)
+            return default
+        if isinstance(value, dict) \
+        or not isinstance(value, _NOT_MAPPINGS) and isinstance(value, Mapping):
+            return type(self)(value)
+        return value
+
+
+    def select(self, paths, default=None):
+        '''
+        Get the values for multiple dotted paths at once. Missing values are
+        replaced with `default`
+        '''
+        get = _frozen_get
+        return [get(self, path, default) for path in paths]
+
+
+    def freeze(self):
+        return self
+
+
+    def __setattr__(self, attr, value):
+        raise AttributeError('can not modify read-only data: {}'.format(attr))
+
+
+    def __delattr__(self, attr):
+        raise AttributeError('can not modify read-only data: {}'.format(attr))
+
+
+    def __repr__(self):
+        return '<{cls}({data})>'.format(
+            cls = self.__class__.__name__,
+            data = self._data,
+        )
+
+
+    def __eq__(self, other):
+        if isinstance(other, (type(self), TreeStructuredData)):
+            return datahash(self) == datahash(other)
+        else:
+            return NotImplemented
+
+
+    def __iter__(self):
+        return iter(self._data)
+
+
+    def __len__(self):
+        return len(self._data)
+
+
+    def __contains__(self, key):
+        return key in self._data
+
+
+    def __getitem__(self, key):
+        '''Fallback dictionary API. Use attribute access as the primary API'''
+        value = self._data[key]
+        if is_mapping(value):
+            return type(self)(value)
+        return value
+
+
+    def __setitem__(self, key, value):
+        raise AttributeError('can not modify read-only data: {}'.format(key))
+
+
+
+_FROZEN_RESERVED = frozenset(dir(FrozenTreeStructuredData))
+_frozen_data = FrozenTreeStructuredData._data.__get__
+_frozen_children = FrozenTreeStructuredData._children.__get__
+_frozen_get = FrozenTreeStructuredData.get
+
+
+
+class CanonicalCache:
+    '''
+    Cached pieces of canonical JSON representation of a single
+    TreeStructuredData node
+    '''
+    __slots__ = (
+        'keys',
+        'index',
+        'prefixes',
+        'values',
+    )
+
+
+    def __init__(self, data):
+        self.keys = sorted(data)
+        self.index = {key: position for position, key in enumerate(self.keys)}
+        self.prefixes = [
+            '{}{}:'.format(',' if position else '{', encode_key(key))
+            for position, key in enumerate(self.keys)
+        ]
+        self.values = [None] * len(self.keys)
+
+
+
 class Metadata:
     '''
     Holds structured data with a defined schema.
@@ -147,6 +493,7 @@ class Metadata:
     __slots__ = (
         '_data_container',
         '_file',
+        '_readonly',
     )
     __module__ = _top_level_module
 
@@ -174,7 +521,8 @@ class Metadata:
     '''
 
 
-    def __init__(self, data=None, filename=None, fileformat=None):
+    def __init__(self, data=None, filename=None, fileformat=None, readonly=False):
+        self._readonly = readonly
         if filename or fileformat:
             self._file = FileInfo(filename, fileformat)
         else:
@@ -187,30 +535,48 @@ class Metadata:
         except Exception:  # assume we are given only payload
             only_payload = True
 
+        owned = data is None  # caller may keep references to provided data
         if data is not None and only_payload:
             empty['data'] = data
             data = empty
         elif data is None and filename is not None:
-            data = get_object(filename, fileformat)
+            data = get_object(filename, fileformat, readonly=readonly)
         elif data is None:
             data = empty
 
         schema = Schema(data['info']['version'])
-        self._data_container = TreeStructuredData(data, validator=schema.validate)
+        self._data_container = TreeStructuredData(data, validator=schema)
+        if owned:
+            self._data_container._own_data()
 
         for key in self.info.schema:
             branch = getattr(self, key)
             schema = Schema(getattr(self.info.schema, key))
-            branch._validator = schema.validate
+            branch._validator = schema
             branch.validate()
 
 
-    def write(self, filename=None, fileformat=None, backup='.hods~'):
-        '''Write changed data structure into the file'''
+    @contextmanager
+    def transaction(self):
+        '''
+        Stage multiple changes and validate them once when leaving the
+        context. All changes are rolled back if validation fails.
+        '''
+        with self._data_container.transaction():
+            yield self
+
+
+    def write(self, filename=None, fileformat=None, backup=None):
+        '''
+        Write changed data structure into the file. Return False if the file
+        already had identical contents and was not touched
+        '''
+        if self._readonly:
+            raise ValueError('can not write metadata opened in read-only mode')
         self.validate_hashes()  # TODO: maybe update hashes implicitly?
         if not filename:
             filename, fileformat = self._file
-        write_object(self._data, filename, fileformat=fileformat, suffix=backup)
+        return write_object(self._data, filename, fileformat=fileformat, suffix=backup)
 
 
     def validate_hashes(self, write_updates=False, sections=(), required=('md5', 'sha256')):
@@ -229,15 +595,15 @@ class Metadata:
 
             data = self[section]
             algorithms = set(hashes).union(required)
+            algorithms.discard('timestamp')
+            actual_hashes = datahashes(data, algorithms)
 
             for algo in algorithms:
-                if algo == 'timestamp':
-                    continue
                 try:
                     current = hashes[algo]
                 except AttributeError:
                     current = None
-                actual = datahash(data, algo)
+                actual = actual_hashes[algo]
 
                 if current == actual or (not write_updates and current is None):
                     continue
@@ -324,11 +690,88 @@ class TranslatorWrapper:
 
 
 
+def validate_journal(journal):
+    '''
+    Validate changes staged in transaction journal. Each validator in the tree
+    runs at most once per key: validators that provide `validate_path()`
+    check the single changed path or each changed key of their node, others
+    (and the ones with more than JOURNAL_LIMIT changed keys) check the whole
+    node.
+    '''
+    changes = OrderedDict()  # id(node) -> (node, changed paths)
+    detached = OrderedDict()  # parents of nodes with unknown position in the tree
+    for node, attr, _ in journal:
+        path = (attr,)
+        while node is not None:
+            if node._validator is not None:
+                changes.setdefault(id(node), (node, OrderedDict()))[1][path] = True
+            if node._parent is not None and node._key is None:
+                detached[id(node._parent)] = node._parent
+                break
+            path = (node._key,) + path
+            node = node._parent
+    for node, paths in changes.values():
+        validate_path = getattr(node._validator, 'validate_path', None)
+        if validate_path is not None and len(paths) == 1:
+            validate_path(node._data, next(iter(paths)))
+            continue
+        keys = OrderedDict.fromkeys(path[0] for path in paths)
+        if validate_path is None or len(keys) > JOURNAL_LIMIT:
+            node._validator(node._data)
+        else:
+            for key in keys:
+                validate_path(node._data, (key,))
+    for node in detached.values():
+        node.validate()
+
+
 def is_mapping(value):
     '''Check if argument value is mapping'''
+    if isinstance(value, dict):  # fast path for concrete types
+        return True
+    if isinstance(value, _NOT_MAPPINGS):
+        return False
     return isinstance(value, Mapping)
 
 
+def compile_path(path):
+    '''
+    Return a function that gets the value at dotted path from raw data tree.
+    Numeric path elements are used as indices for lists. Compiled functions
+    are cached.
+    '''
+    if len(_COMPILED_PATHS) >= COMPILED_PATHS_LIMIT:
+        _COMPILED_PATHS.clear()
+    keys = tuple(path.split('.')) if path else ()
+    steps = tuple((key, int(key) if key.isdigit() else None) for key in keys)
+
+    def getter(data):
+        for key, index in steps:
+            if index is not None and isinstance(data, list):
+                data = data[index]
+            else:
+                data = data[key]
+        return data
+
+    getter.keys = keys
+    _COMPILED_PATHS[path] = getter
+    return getter
+
+
+def is_cacheable(value):
+    '''
+    Check that value can be modified only via TreeStructuredData interface,
+    i.e. it does not contain any lists
+    '''
+    stack = [value]
+    for node in stack:  # stack grows while being iterated
+        if is_mapping(node):
+            stack.extend(node.values())
+        elif isinstance(node, (list, tuple)):
+            return False
+    return True
+
+
 def timestamp():
     offset = (
         datetime.now().replace(microsecond=0)
@@ -338,3 +781,6 @@ def timestamp():
 
 
 FileInfo = namedtuple('FileInfo', 'name,format')
+_NOT_MAPPINGS = (str, int, float, list, tuple, type(None))
+_COMPILED_PATHS = {}
+COMPILED_PATHS_LIMIT = 1024
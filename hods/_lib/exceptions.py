@@ -4,6 +4,7 @@ Custom exceptions used in HODS package
 
 
 from abc import ABCMeta
+from collections import deque
 import jsonschema.exceptions
 from hods import __name__ as _top_level_module
 
@@ -27,6 +28,38 @@ for cls in ThirdPartyValidationErrors:
     ValidationError.register(cls)
 
 
+class SchemaValidationError(ValidationError):
+    '''
+    Validation error raised by schema engines implemented in this package.
+    Attributes are compatible with jsonschema.ValidationError: `path` and
+    `schema_path` are deques of keys that lead to the invalid node and to the
+    failed keyword in schema.
+    '''
+
+
+    def __init__(self, message, validator=None, validator_value=None, instance=None):
+        super().__init__(message)
+        self.message = message
+        self.validator = validator
+        self.validator_value = validator_value
+        self.instance = instance
+        self.path = deque()
+        self.schema_path = deque() if validator is None else deque([validator])
+
+
+    def descend(self, schema_path, *path):
+        '''Prepend path elements when error propagates from nested node'''
+        self.schema_path.extendleft(reversed(schema_path))
+        self.path.extendleft(reversed(path))
+
+
+    def __str__(self):
+        if not self.path:
+            return self.message
+        return '{} (at {})'.format(self.message, '/'.join(str(key) for key in self.path))
+
+
+
 # Unfortunately, abstract base classes do not work in `except` clause in Python 3:
 # - https://bugs.python.org/issue12029
 # - https://stackoverflow.com/questions/23890645
@@ -9,33 +9,68 @@ Supported file formats:
 # Checklist for adding support of new formats:
 #   - get_object
 #   - write_object
-#   - detect_format
+#   - FORMATS
 #   - module docsctring
 
 
+import io
 import os
 import json
 import shutil
-from collections import OrderedDict
+import stat
+import tempfile
+import threading
+from collections import OrderedDict, deque, namedtuple
 from contextlib import contextmanager
-import strictyaml
-from ruamel import yaml
+from fnmatch import fnmatchcase
+from functools import lru_cache
 
+from hods._lib.parsecache import parse_cache
+from hods._lib.profile import profiled
 
-def get_object(filename, fileformat=None):
-    '''Read serialized object from file. Detect file format if not specified'''
+
+@profiled('parse')
+def get_object(filename, fileformat=None, readonly=False):
+    '''
+    Read serialized object from file. Detect file format if not specified.
+
+    If `readonly` is True, faster loaders are used that return plain Python
+    objects. Comments and formatting are not preserved in that case, so the
+    object should not be written back to the file.
+
+    If parse cache is enabled, objects parsed from unchanged YAML files are
+    loaded from cache (see ParseCache).
+    '''
     if not fileformat:
         fileformat = detect_format(filename)
-    loaders = {
-        'JSON':       load_json,
-        'StrictYAML': load_strict_yaml,
-        'YAML':       load_yaml,
-    }
+    if readonly:
+        loaders = {
+            'JSON':       load_json_plain,
+            'StrictYAML': load_strict_yaml_plain,
+            'YAML':       load_yaml_plain,
+        }
+    else:
+        loaders = {
+            'JSON':       load_json,
+            'StrictYAML': load_strict_yaml,
+            'YAML':       load_yaml,
+        }
+    if parse_cache.enabled:
+        return parse_cache.load(filename, fileformat, readonly, loaders[fileformat])
     return loaders[fileformat](filename)
 
 
-def write_object(obj, filename, fileformat=None, suffix='.hods~'):
-    '''Write serialized object to file. Detect file format if not specified'''
+@profiled('write')
+def write_object(obj, filename, fileformat=None, suffix=None):
+    '''
+    Write serialized object to file. Detect file format if not specified.
+
+    File is replaced atomically (see `AtomicWriter`) and only if serialized
+    data differs from its current contents. If `suffix` is provided, previous
+    version of the file is kept with that suffix.
+
+    Return True if the file was written.
+    '''
     if not filename:
         raise ValueError('can not write data without filename')
     if not fileformat:
@@ -47,26 +82,241 @@ def write_object(obj, filename, fileformat=None, suffix='.hods~'):
         'YAML':       write_yaml,
     }
 
-    with backup(filename, suffix):
-        writers[fileformat](obj, filename)
+    writer = AtomicWriter(filename, backup=suffix)
+    with writer as stream:
+        writers[fileformat](obj, stream)
+    return writer.written
+
+
+class AtomicWriter:
+    '''
+    Context manager that provides a text stream for replacing file contents.
+
+    Data is written to a temporary file in the same directory, which is
+    flushed to disk and renamed over the original file only if no exceptions
+    were raised. Readers never see partially written file and the original
+    file stays intact if writing fails. File mode is preserved.
+
+    Written data is compared with the contents of existing file on the fly,
+    and if they are identical the file is not touched at all. After leaving
+    the context `written` attribute tells whether the file was replaced.
+
+    If `backup` suffix is provided, previous version of the file is kept as
+    a hard link with that suffix (no data is copied).
+    '''
+
+
+    def __init__(self, filename, backup=None):
+        self.filename = os.path.realpath(filename)  # do not replace symlinks
+        self.backup = backup
+        self.written = False
+        self._target = None
+        self._stream = None
+
+
+    def __enter__(self):
+        self.written = False
+        self._target = ChangedFile(self.filename)
+        self._stream = io.TextIOWrapper(io.BufferedWriter(self._target))
+        return self._stream
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        target = self._target
+        try:
+            if exc_type is None:
+                self._stream.flush()
+                if target.commit():
+                    self._replace(target.temporary)
+                    target.temporary = None
+                    self.written = True
+        finally:
+            target.discard()
+
+
+    def _replace(self, temporary):
+        filename = self.filename
+        try:
+            mode = stat.S_IMODE(os.stat(filename).st_mode)
+        except FileNotFoundError:
+            mode = DEFAULT_MODE & ~get_umask()
+        os.chmod(temporary, mode)
+        if self.backup:
+            keep_backup(filename, self.backup)
+        os.replace(temporary, filename)
+        fsync_directory(os.path.dirname(filename))
+
+
+
+class ChangedFile(io.RawIOBase):
+    '''
+    Binary stream that compares written data with the contents of existing
+    file. Temporary file for new contents is created only after the first
+    difference is found.
+    '''
+
+
+    def __init__(self, filename):
+        super().__init__()
+        self.filename = filename
+        self.temporary = None
+        self._new = None
+        self._matched = 0
+        try:
+            self._old = open(filename, 'rb')
+        except FileNotFoundError:
+            self._old = None
+            self._diverge()
+
+
+    def writable(self):
+        return True
+
+
+    def write(self, data):
+        if self._new is None:
+            if self._old.read(len(data)) == data:
+                self._matched += len(data)
+                return len(data)
+            self._diverge()
+        return self._new.write(data)
+
+
+    def _diverge(self):
+        '''Start writing temporary file, copy the matched part of old file'''
+        directory, basename = os.path.split(self.filename)
+        descriptor, self.temporary = tempfile.mkstemp(
+            prefix='.{}.'.format(basename),
+            suffix='.tmp',
+            dir=directory,
+        )
+        self._new = os.fdopen(descriptor, 'wb')
+        if self._old is not None:
+            self._old.seek(0)
+            remaining = self._matched
+            while remaining:
+                chunk = self._old.read(min(remaining, COPY_CHUNK_SIZE))
+                self._new.write(chunk)
+                remaining -= len(chunk)
+            self._old.close()
+
+
+    def commit(self):
+        '''
+        Flush new contents to disk. Return False if the contents did not
+        change and there is nothing to commit.
+        '''
+        if self._new is None:
+            if not self._old.read(1):
+                return False
+            self._diverge()
+        self._new.flush()
+        os.fsync(self._new.fileno())
+        self._new.close()
+        return True
+
+
+    def discard(self):
+        '''Close all files and remove uncommitted temporary file'''
+        for f in (self._old, self._new):
+            if f is not None:
+                f.close()
+        if self.temporary is not None:
+            try:
+                os.remove(self.temporary)
+            except FileNotFoundError:
+                pass
+            self.temporary = None
+        self.close()
+
+
+
+COPY_CHUNK_SIZE = 1024 * 1024
+DEFAULT_MODE = 0o666  # same as for open()
+
+
+def get_umask():
+    '''
+    Return umask of the process without changing it. Setting umask affects
+    all threads, so it is read from /proc when possible
+    '''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('Umask:'):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError, IndexError):
+        pass
+    return initial_umask()
+
+
+@lru_cache(maxsize=None)
+def initial_umask():
+    '''
+    Read umask once by setting it temporarily. Restrictive value is used in
+    the meantime, so files created by other threads are never world-writable
+    '''
+    with _UMASK_LOCK:
+        umask = os.umask(0o077)
+        os.umask(umask)
+    return umask
+
+
+_UMASK_LOCK = threading.Lock()
+
+
+def fsync_directory(directory):
+    '''Make sure that rename operation is persisted on disk'''
+    try:
+        descriptor = os.open(directory, os.O_RDONLY)
+    except OSError:  # not supported on some platforms
+        return
+    try:
+        os.fsync(descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(descriptor)
+
+
+def keep_backup(filename, suffix='.hods~'):
+    '''
+    Keep current version of the file with given suffix. Hard link is created
+    if possible, otherwise the file is copied. Return backup file name or None
+    if there is nothing to backup.
+    '''
+    backup_name = get_backup_name(filename, suffix)
+    try:
+        os.link(filename, backup_name)
+    except FileNotFoundError:  # no need to backup non-existent files
+        return None
+    except OSError:  # hard links are not supported
+        shutil.copy2(filename, backup_name)
+    return backup_name
+
+
+def get_backup_name(filename, suffix='.hods~'):
+    '''Choose backup file name that does not overwrite previous backups'''
+    suffix_for_duplicates = '{num}~'
+    backup_name = filename + suffix
+    backup_number = 0
+    while os.path.exists(backup_name):
+        backup_number += 1
+        backup_name = \
+            filename  \
+            + suffix  \
+            + suffix_for_duplicates.format(num=backup_number)
+    return backup_name
 
 
 @contextmanager
 def backup(filename, suffix='.hods~'):
     '''Context manager to execute dangerous file operations with backup'''
-    suffix_for_duplicates = '{num}~'
     backup_created = False
 
     # Create backup file with given suffix
     if suffix:
-        backup_name = filename + suffix
-        backup_number = 0
-        while os.path.exists(backup_name):  # never overwrite previous backups
-            backup_number += 1
-            backup_name = \
-                filename  \
-                + suffix  \
-                + suffix_for_duplicates.format(num=backup_number)
+        backup_name = get_backup_name(filename, suffix)
         try:
             shutil.copyfile(filename, backup_name)
             backup_created = True
@@ -81,46 +331,202 @@ def backup(filename, suffix='.hods~'):
         os.remove(backup_name)
 
 
-def get_files(directory='.', recursive=False):
+def get_files(directory='.', recursive=False, include=(), exclude=(), jobs=1):
     '''Detect metadata files in given directory'''
-    if recursive:
-        traverse = os.walk(directory)
+    for entry in scan_files(directory, recursive, include, exclude, jobs):
+        yield entry.path
+
+
+def scan_files(directory='.', recursive=False, include=(), exclude=(), jobs=1):
+    '''
+    Detect metadata files in given directory. Yield os.DirEntry objects that
+    cache the results of stat() calls.
+
+    Files and directories matching the patterns from `.hodsignore` files are
+    skipped. Each line of `.hodsignore` is a glob pattern; patterns without
+    a slash are matched against file names at any depth, other patterns are
+    matched against paths relative to the directory containing `.hodsignore`.
+    Patterns with trailing slash match only directories. Empty lines and
+    lines starting with `#` are ignored.
+
+    `include` and `exclude` are sequences of glob patterns with the same
+    syntax, relative to `directory`. If `include` is not empty, only matching
+    files are yielded.
+
+    Directories are scanned in a pool of `jobs` threads. The order of
+    yielded entries is not defined.
+    '''
+    filters = ScanFilters(
+        include=parse_patterns(include),
+        exclude=parse_patterns(exclude),
+        recursive=recursive,
+    )
+    root = ScanTarget(path=directory, relative='', ignore=())
+    if jobs <= 1 or not recursive:
+        pending = [root]
+        while pending:
+            files, directories = scan_directory(pending.pop(), filters)
+            yield from files
+            pending.extend(directories)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(jobs) as pool:
+        pending = deque([pool.submit(scan_directory, root, filters)])
+        while pending:
+            files, directories = pending.popleft().result()
+            yield from files
+            pending.extend(pool.submit(scan_directory, d, filters) for d in directories)
+
+
+ScanFilters = namedtuple('ScanFilters', 'include,exclude,recursive')
+ScanTarget = namedtuple('ScanTarget', 'path,relative,ignore')
+IgnorePattern = namedtuple('IgnorePattern', 'pattern,anchored,directory_only')
+IGNORE_FILENAME = '.hodsignore'
+SCAN_THREADS = 4  # jobs for scan_files(), helps on network and cold filesystems
+
+
+def scan_directory(target, filters):
+    '''
+    Scan a single directory. Return the list of metadata files and the list of
+    subdirectories to scan next
+    '''
+    try:
+        entries = list(os.scandir(target.path))
+    except OSError:  # unreadable directories are skipped, like in os.walk()
+        return [], []
+    ignore = local_ignore(target, (entry.name for entry in entries))
+
+    files = []
+    directories = []
+    for entry in entries:
+        relative = target.relative + entry.name
+        if entry.is_dir():
+            if not filters.recursive or entry.is_symlink():
+                continue
+            if not is_wanted_directory(relative, ignore, filters):
+                continue
+            directories.append(ScanTarget(
+                path=entry.path,
+                relative=relative + '/',
+                ignore=ignore,
+            ))
+        elif is_metadata(entry.name):
+            if is_wanted_file(relative, ignore, filters):
+                files.append(entry)
+    return files, directories
+
+
+def local_ignore(target, names=None):
+    '''
+    Return ignore patterns that apply to the contents of target directory:
+    inherited ones and the ones from its own `.hodsignore` file. If the list
+    of file names in the directory is not provided, it is not read.
+    '''
+    filename = os.path.join(target.path, IGNORE_FILENAME)
+    if names is None:
+        present = os.path.isfile(filename)
     else:
-        traverse = (next(os.walk(directory)),)
-    for parent, dirs, files in traverse:
-        for filename in files:
-            full_path = os.path.join(parent, filename)
-            if is_metadata(full_path):
-                yield full_path
+        present = IGNORE_FILENAME in names
+    if not present:
+        return target.ignore
+    return target.ignore + tuple(
+        (target.relative, pattern)
+        for pattern in read_ignore_file(filename)
+    )
+
+
+def is_wanted_directory(relative, ignore, filters):
+    '''Check if subdirectory should be scanned'''
+    return not is_ignored(relative, True, ignore) \
+       and not matches_any(relative, True, filters.exclude)
+
+
+def is_wanted_file(relative, ignore, filters):
+    '''Check if metadata file passes ignore patterns and include/exclude filters'''
+    if is_ignored(relative, False, ignore) \
+    or matches_any(relative, False, filters.exclude):
+        return False
+    return not filters.include or matches_any(relative, False, filters.include)
+
+
+def read_ignore_file(filename):
+    '''Read patterns from .hodsignore file'''
+    with open(filename) as f:
+        return parse_patterns(f)
+
+
+def parse_patterns(lines):
+    patterns = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        directory_only = line.endswith('/')
+        line = line.rstrip('/')
+        anchored = '/' in line
+        patterns.append(IgnorePattern(
+            pattern=line.lstrip('/'),
+            anchored=anchored,
+            directory_only=directory_only,
+        ))
+    return tuple(patterns)
+
+
+def is_ignored(relative, is_directory, ignore):
+    '''Check path against the patterns from all applicable .hodsignore files'''
+    for base, pattern in ignore:
+        if matches(relative[len(base):], is_directory, pattern):
+            return True
+    return False
+
+
+def matches_any(relative, is_directory, patterns):
+    for pattern in patterns:
+        if matches(relative, is_directory, pattern):
+            return True
+    return False
+
+
+def matches(relative, is_directory, pattern):
+    '''Match path relative to pattern base directory against IgnorePattern'''
+    if pattern.directory_only and not is_directory:
+        return False
+    if not pattern.anchored:
+        relative = relative.rpartition('/')[2]
+    return fnmatchcase(relative, pattern.pattern)
+
+
+FORMATS = {
+    '.json': 'JSON',
+    '.syml': 'StrictYAML',
+    '.yml':  'YAML',
+    '.yaml': 'YAML',
+}
 
 
 def detect_format(filename):
-    _, extension = os.path.splitext(filename.lower())
-    if extension == '.syml':
-        return 'StrictYAML'
-    elif extension == '.json':
-        return 'JSON'
-    elif extension in {'.yml', '.yaml'}:
-        return 'YAML'
-    else:
+    _, extension = os.path.splitext(filename)
+    try:
+        return FORMATS[extension.lower()]
+    except KeyError:
         raise ValueError('can not detect file format for {}'.format(filename))
 
 
 def is_metadata(filename):
-    try:
-        detect_format(filename)
-        return True
-    except ValueError:
-        return False
+    _, extension = os.path.splitext(filename)
+    return extension.lower() in FORMATS
 
 
 def load_strict_yaml(filename):
+    import strictyaml
     with open(filename) as f:
         serialized = f.read()
         return strictyaml.load(serialized).data
 
 
 def load_yaml(filename):
+    yaml = import_ruamel_yaml()
     with open(filename) as f:
         return yaml.load(f, Loader=yaml.RoundTripLoader)
 
@@ -130,26 +536,90 @@ def load_json(filename):
         return json.load(f, object_pairs_hook=OrderedDict)
 
 
-def write_strict_yaml(data, filename):
+def load_json_plain(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def load_yaml_plain(filename):
+    yaml = import_ruamel_yaml()
+    with open(filename) as f:
+        return yaml.load(f, Loader=plain_yaml_loaders().typed)
+
+
+def load_strict_yaml_plain(filename):
+    '''
+    Load StrictYAML file without validating its restrictions. All scalar
+    values are loaded as strings, like StrictYAML does without a schema.
+    '''
+    yaml = import_ruamel_yaml()
+    with open(filename) as f:
+        return yaml.load(f, Loader=plain_yaml_loaders().strings)
+
+
+@lru_cache(maxsize=None)
+def plain_yaml_loaders():
+    '''
+    Build YAML loader classes that produce plain Python objects. LibYAML
+    based parser is used when available.
+
+    Scalar values are resolved according to the same rules as in the
+    round-trip loader (YAML 1.2), so canonical data hashes are identical.
+    '''
+    import_ruamel_yaml()
+    from ruamel.yaml.constructor import BaseConstructor, SafeConstructor
+    from ruamel.yaml.resolver import BaseResolver, VersionedResolver
+    try:
+        from ruamel.yaml.cyaml import CParser
+    except ImportError:  # C extension is not available
+        from ruamel.yaml.loader import BaseLoader, SafeLoader
+        return PlainLoaders(typed=SafeLoader, strings=BaseLoader)
+
+    class TypedLoader(CParser, SafeConstructor, VersionedResolver):
+        def __init__(self, stream, version=None, preserve_quotes=None):
+            CParser.__init__(self, stream)
+            self._parser = self._composer = self
+            SafeConstructor.__init__(self, loader=self)
+            VersionedResolver.__init__(self, version, loader=self)
+
+    class StringsLoader(CParser, BaseConstructor, BaseResolver):
+        def __init__(self, stream, version=None, preserve_quotes=None):
+            CParser.__init__(self, stream)
+            self._parser = self._composer = self
+            BaseConstructor.__init__(self, loader=self)
+            BaseResolver.__init__(self, loadumper=self)
+
+    return PlainLoaders(typed=TypedLoader, strings=StringsLoader)
+
+
+PlainLoaders = namedtuple('PlainLoaders', 'typed,strings')
+
+
+def write_strict_yaml(data, stream):
+    import strictyaml
     # TODO: https://github.com/crdoconnor/strictyaml/issues/43
-    with open(filename, 'w') as f:
-        f.write(strictyaml.as_document(data).as_yaml())
+    stream.write(strictyaml.as_document(data).as_yaml())
 
 
-# Dump OrderedDicts as simple dictionaries
-yaml.add_representer(OrderedDict, yaml.RoundTripDumper.represent_dict, Dumper=yaml.RoundTripDumper)
+@lru_cache(maxsize=None)
+def import_ruamel_yaml():
+    '''Import YAML library on first use (it takes a while)'''
+    from ruamel import yaml
+    # Dump OrderedDicts as simple dictionaries
+    yaml.add_representer(OrderedDict, yaml.RoundTripDumper.represent_dict, Dumper=yaml.RoundTripDumper)
+    return yaml
 
-def write_yaml(data, filename):
-    with open(filename, 'w') as f:
-        yaml.dump(
-            data,
-            f,
-            default_flow_style=False,
-            allow_unicode=True,
-            Dumper=yaml.RoundTripDumper,
-        )
+
+def write_yaml(data, stream):
+    yaml = import_ruamel_yaml()
+    yaml.dump(
+        data,
+        stream,
+        default_flow_style=False,
+        allow_unicode=True,
+        Dumper=yaml.RoundTripDumper,
+    )
 
 
-def write_json(data, filename):
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=2)
+def write_json(data, stream):
+    json.dump(data, stream, indent=2)
@@ -6,28 +6,208 @@ Calculate hashes of structured data regardless of its format
 import json
 import hashlib
 
+from hods._lib.profile import profiled
+
 
 def struct_hash(data, algorithm='sha256'):
     '''
     Calculate hash of structured data that can be serialized into JSON
     '''
-    datastring = json.dumps(
-        data,
-        indent=None,
-        separators=',:',
-        sort_keys=True,  # TODO: does this sorting depend on locale?
-    )
-    databytes = datastring.encode()
-
-    if algorithm in hashlib.algorithms_guaranteed:
-        hasher = getattr(hashlib, algorithm)
-        return hasher(databytes).hexdigest()
+    return struct_hashes(data, (algorithm,))[algorithm]
+
+
+@profiled('hash')
+def struct_hashes(data, algorithms=('sha256',)):
+    '''
+    Calculate several hashes of structured data at once. Data is serialized
+    only once and the same bytes are fed to all hashing algorithms.
+
+    Canonical JSON representation is never built as a whole: it is streamed
+    into hash objects in chunks to keep memory usage low for large data.
+
+    Return dictionary of algorithm names and hexadecimal digests
+    '''
+    return pieces_hashes(iter_canonical(data), algorithms)
+
+
+def pieces_hashes(pieces, algorithms=('sha256',)):
+    '''
+    Calculate several hashes of a string that is provided as an iterable of
+    pieces
+    '''
+    hashers = get_hashers(algorithms)
+    for chunk in join_chunks(pieces):
+        for hasher in hashers.values():
+            hasher.update(chunk)
+    return {algo: hasher.hexdigest() for algo, hasher in hashers.items()}
+
+
+CHUNK_SIZE = 64 * 1024
+SCALAR_TYPES = (str, int, float, bool, type(None))
+CONTAINER_TYPES = (dict, list, tuple)
+SMALL_SUBTREE = 256  # number of nodes that are serialized at once
+_encoder = json.JSONEncoder(
+    indent=None,
+    separators=(',', ':'),
+    sort_keys=True,  # TODO: does this sorting depend on locale?
+)
+
+
+def canonical_json(data):
+    '''Serialize data into canonical JSON string (as defined by specification)'''
+    return _encoder.encode(data)
+
+
+def canonical_chunks(data, chunk_size=CHUNK_SIZE):
+    '''
+    Yield canonical JSON representation of data as a sequence of byte strings
+    of approximately `chunk_size` length.
+
+    Concatenation of all chunks is equal to `canonical_json(data).encode()`
+    '''
+    return join_chunks(iter_canonical(data), chunk_size)
+
+
+def join_chunks(pieces, chunk_size=CHUNK_SIZE):
+    '''Join small string pieces into byte chunks of approximately chunk_size'''
+    buffer = []
+    buffered = 0
+    for piece in pieces:
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= chunk_size:
+            yield ''.join(buffer).encode()
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+def iter_canonical(data):
+    '''
+    Yield canonical JSON representation of data piece by piece.
+
+    Small subtrees are serialized at once with the C-accelerated encoder,
+    larger containers are walked recursively.
+    '''
+    if not isinstance(data, CONTAINER_TYPES) \
+    or count_nodes(data, SMALL_SUBTREE) <= SMALL_SUBTREE:
+        yield _encoder.encode(data)
+        return
+
+    is_dict = isinstance(data, dict)
+    if is_dict:
+        yield '{'
+        items = sorted(data.items())
+    else:
+        yield '['
+        items = data
+
+    separator = ''
+    batch = []
+    batch_size = 0
+    for item in items:
+        value = item[1] if is_dict else item
+        if isinstance(value, CONTAINER_TYPES):
+            size = 1 + count_nodes(value, SMALL_SUBTREE)
+        else:
+            size = 1
+        if batch and batch_size + size > SMALL_SUBTREE:
+            yield separator
+            yield encode_batch(batch, is_dict)
+            separator = ','
+            batch = []
+            batch_size = 0
+        if size <= SMALL_SUBTREE:
+            batch.append(item)
+            batch_size += size
+            continue
+        yield separator
+        if is_dict:
+            yield encode_key(item[0])
+            yield ':'
+        yield from iter_canonical(value)
+        separator = ','
+    if batch:
+        yield separator
+        yield encode_batch(batch, is_dict)
+    yield '}' if is_dict else ']'
+
+
+def encode_batch(batch, is_dict):
+    '''Serialize a slice of container at once, without enclosing brackets'''
+    if is_dict:
+        return _encoder.encode(dict(batch))[1:-1]
+    else:
+        return _encoder.encode(batch)[1:-1]
+
+
+def count_nodes(data, limit):
+    '''
+    Count nodes in data tree below the given one, stop counting after
+    reaching the limit
+    '''
+    count = 0
+    stack = [data]
+    for node in stack:  # stack grows while being iterated
+        if isinstance(node, dict):
+            node = node.values()
+        count += len(node)
+        if count > limit:
+            break
+        for child in node:
+            if isinstance(child, CONTAINER_TYPES):
+                stack.append(child)
+    return count
+
+
+def encode_key(key):
+    '''Serialize mapping key into canonical JSON string'''
+    return _encoder.encode(canonical_key(key))
+
+
+def canonical_key(key):
+    '''Convert mapping key to string the same way json module does'''
+    if isinstance(key, str):
+        return key
+    elif isinstance(key, SCALAR_TYPES):
+        return _encoder.encode(key)
     else:
-        raise ValueError('unsupported hashing algorithm: {}'.format(algorithm))
+        raise TypeError(
+            'keys must be str, int, float, bool or None, not {}'.format(
+                type(key).__name__
+            )
+        )
+
+
+def get_hashers(algorithms):
+    '''Initialize hash objects for given algorithm names'''
+    hashers = {}
+    for algorithm in algorithms:
+        if algorithm in hashlib.algorithms_guaranteed:
+            hashers[algorithm] = getattr(hashlib, algorithm)()
+        else:
+            raise ValueError('unsupported hashing algorithm: {}'.format(algorithm))
+    return hashers
 
 
 def datahash(container, algorithm='sha256'):
     '''
     Calculate data hash for HODS container object
     '''
-    return struct_hash(container._data, algorithm)
+    return datahashes(container, (algorithm,))[algorithm]
+
+
+@profiled('hash')
+def datahashes(container, algorithms=('sha256',)):
+    '''
+    Calculate several data hashes for HODS container object at once.
+
+    Containers may provide cached canonical representation of their data via
+    `_iter_canonical()` method
+    '''
+    try:
+        pieces = container._iter_canonical()
+    except AttributeError:
+        pieces = iter_canonical(container._data)
+    return pieces_hashes(pieces, algorithms)
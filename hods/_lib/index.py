@@ -0,0 +1,376 @@
+'''
+Local index of metadata files
+
+Schema identifiers, data hashes and scalar values of payload sections are
+stored in SQLite database, so that files can be searched without loading
+them. Files are re-read only if their size, modification time or inode
+number have changed since the last update, or if the selection of indexed
+data paths is different from the one used before.
+'''
+
+
+import fnmatch
+import json
+import os
+import re
+import sqlite3
+from collections import namedtuple
+
+from hods._lib.cache import get_stat, stat_tuple
+from hods._lib.files import get_object
+from hods._lib.profile import track_file
+
+
+INDEX_FILENAME = '.hods-index'
+INDEX_VERSION = 1
+MAX_DEPTH = 8  # nesting level of indexed data paths
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS files ('
+    '    path TEXT PRIMARY KEY,'
+    '    size INTEGER,'
+    '    mtime_ns INTEGER,'
+    '    inode INTEGER'
+    ')',
+    'CREATE TABLE IF NOT EXISTS schemas ('
+    '    path TEXT,'
+    '    section TEXT,'
+    '    schema TEXT'
+    ')',
+    'CREATE TABLE IF NOT EXISTS hashes ('
+    '    path TEXT,'
+    '    section TEXT,'
+    '    algorithm TEXT,'
+    '    value TEXT'
+    ')',
+    'CREATE TABLE IF NOT EXISTS data ('
+    '    path TEXT,'
+    '    key TEXT,'
+    '    value TEXT,'
+    '    number REAL'
+    ')',
+    'CREATE TABLE IF NOT EXISTS settings ('
+    '    name TEXT PRIMARY KEY,'
+    '    value TEXT'
+    ')',
+    'CREATE INDEX IF NOT EXISTS schemas_by_path ON schemas (path)',
+    'CREATE INDEX IF NOT EXISTS schemas_by_id ON schemas (schema)',
+    'CREATE INDEX IF NOT EXISTS hashes_by_path ON hashes (path)',
+    'CREATE INDEX IF NOT EXISTS hashes_by_value ON hashes (value)',
+    'CREATE INDEX IF NOT EXISTS data_by_path ON data (path)',
+    'CREATE INDEX IF NOT EXISTS data_by_value ON data (key, value)',
+    'CREATE INDEX IF NOT EXISTS data_by_number ON data (key, number)',
+)
+_TABLES = ('files', 'schemas', 'hashes', 'data')  # tables with per-file rows
+
+
+class MetadataIndex:
+    '''
+    On-disk index of metadata files (SQLite database).
+
+    File paths are stored relative to the directory that contains the index.
+    Damaged index file is recreated. If `create` is False, FileNotFoundError
+    is raised when there is no index file.
+    '''
+
+
+    def __init__(self, directory='.', filename=INDEX_FILENAME, create=True):
+        self.directory = os.path.realpath(directory)
+        self.path = os.path.join(directory, filename)
+        self._db = None
+        if not create and not os.path.exists(self.path):
+            raise FileNotFoundError('index file not found: {}'.format(self.path))
+        try:
+            self._db = self._connect()
+        except sqlite3.DatabaseError:  # corrupted index file
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:  # removed by another process
+                pass
+            except OSError as error:
+                raise sqlite3.DatabaseError('damaged index file can not be removed: {}'.format(error))
+            self._db = self._connect()
+
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=5)
+        try:
+            version = db.execute('PRAGMA user_version').fetchone()[0]
+            if version != INDEX_VERSION:
+                for table in _TABLES + ('settings',):
+                    db.execute('DROP TABLE IF EXISTS {}'.format(table))
+                db.execute('PRAGMA user_version = {:d}'.format(INDEX_VERSION))
+            for statement in _SCHEMA:
+                db.execute(statement)
+            db.commit()
+        except sqlite3.DatabaseError:
+            db.close()
+            raise
+        return db
+
+
+    def update(self, files, paths=()):
+        '''
+        Bring the index up to date with the given files. Files that are not
+        listed are removed from the index. Files may be given as paths or as
+        os.DirEntry objects.
+
+        If `paths` are provided, only data values under these dotted path
+        prefixes are indexed (e.g. `data.year`). All files are read again if
+        `paths` differ from the ones of the previous update.
+
+        Return IndexStats with the number of updated, removed and failed files.
+        '''
+        known = dict(
+            (row[0], tuple(row[1:]))
+            for row in self._db.execute('SELECT path, size, mtime_ns, inode FROM files')
+        )
+        selection = json.dumps(sorted(set(paths)))
+        reindex = self._setting('paths') != selection
+        updated = failed = 0
+        with self._db:
+            if reindex:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO settings VALUES (?, ?)',
+                    ('paths', selection)
+                )
+            for item in files:
+                filename = getattr(item, 'path', item)
+                key = self.key(filename)
+                stat = get_stat(item)
+                if stat is None:
+                    continue
+                previous = known.pop(key, None)
+                if previous == stat_tuple(stat) and not reindex:
+                    continue
+                try:
+                    with track_file(filename):
+                        document = get_object(filename, readonly=True)
+                        rows = extract_rows(document, paths)
+                except Exception:  # unreadable files are not indexed
+                    failed += 1
+                    if previous is not None:
+                        known[key] = previous  # remove from index
+                    continue
+                self._delete(key)
+                self._insert(key, stat, rows)
+                updated += 1
+            for key in known:
+                self._delete(key)
+        return IndexStats(updated=updated, removed=len(known), failed=failed)
+
+
+    def _setting(self, name):
+        row = self._db.execute('SELECT value FROM settings WHERE name = ?', (name,)).fetchone()
+        return row and row[0]
+
+
+    def _delete(self, key):
+        for table in _TABLES:
+            self._db.execute('DELETE FROM {} WHERE path = ?'.format(table), (key,))
+
+
+    def _insert(self, key, stat, rows):
+        schemas, hashes, values = rows
+        self._db.execute(
+            'INSERT INTO files VALUES (?, ?, ?, ?)',
+            (key,) + stat_tuple(stat)
+        )
+        self._db.executemany(
+            'INSERT INTO schemas VALUES (?, ?, ?)',
+            ((key,) + row for row in schemas)
+        )
+        self._db.executemany(
+            'INSERT INTO hashes VALUES (?, ?, ?, ?)',
+            ((key,) + row for row in hashes)
+        )
+        self._db.executemany(
+            'INSERT INTO data VALUES (?, ?, ?, ?)',
+            ((key,) + row for row in values)
+        )
+
+
+    def key(self, filename):
+        '''Normalize file path for usage as index key'''
+        return os.path.relpath(os.path.realpath(filename), self.directory)
+
+
+    def query(self, predicates=(), schema=None):
+        '''
+        Find files matching all predicates. Predicates are either Predicate
+        tuples or strings like `data.year>2000` (see `parse_predicate()`).
+        If `schema` glob pattern is provided, only files that use matching
+        schema identifier (for any section) are returned.
+
+        Return sorted list of paths relative to the index directory.
+        '''
+        conditions = []
+        parameters = []
+        for predicate in predicates:
+            if isinstance(predicate, str):
+                predicate = parse_predicate(predicate)
+            condition, values = predicate_sql(predicate)
+            conditions.append(condition)
+            parameters.extend(values)
+        if schema:
+            conditions.append('path IN (SELECT path FROM schemas WHERE schema GLOB ?)')
+            parameters.append(schema)
+        sql = 'SELECT path FROM files'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY path'
+        return [row[0] for row in self._db.execute(sql, parameters)]
+
+
+    def schemas(self, filename):
+        '''Return dictionary of section names and schema identifiers for indexed file'''
+        return dict(self._db.execute(
+            'SELECT section, schema FROM schemas WHERE path = ?',
+            (self.key(filename),)
+        ))
+
+
+    def close(self):
+        if self._db is None:
+            return
+        self._db.commit()
+        self._db.close()
+        self._db = None
+
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+
+IndexStats = namedtuple('IndexStats', 'updated,removed,failed')
+Predicate = namedtuple('Predicate', 'key,operator,value')
+
+OPERATORS = ('!=', '<=', '>=', '=', '<', '>', '~')  # longest first
+_PREDICATE = re.compile(
+    r'^(?P<key>[^!=<>~?]+?)\s*(?:(?P<exists>\?)|(?P<operator>{})\s*(?P<value>.*))$'.format(
+        '|'.join(re.escape(op) for op in OPERATORS)
+    )
+)
+
+
+def parse_predicate(text):
+    '''
+    Parse query predicate. Supported syntax:
+
+        data.year=2010      value equals (numbers and strings are compared as text)
+        data.year!=2010     no value equals
+        data.year>2000      numeric comparisons: <, <=, >, >=
+        data.title~Track*   glob pattern
+        data.comment?       value exists
+    '''
+    match = _PREDICATE.match(text.strip())
+    if not match:
+        raise ValueError('invalid query predicate: {}'.format(text))
+    if match.group('exists'):
+        return Predicate(key=match.group('key'), operator='?', value=None)
+    return Predicate(
+        key=match.group('key'),
+        operator=match.group('operator'),
+        value=match.group('value'),
+    )
+
+
+def predicate_sql(predicate):
+    '''Return SQL condition and its parameters for a predicate'''
+    key, operator, value = predicate
+    subquery = 'SELECT path FROM data WHERE key = ?'
+    if operator == '?':
+        return 'path IN ({})'.format(subquery), [key]
+    elif operator == '=':
+        return 'path IN ({} AND value = ?)'.format(subquery), [key, value]
+    elif operator == '!=':
+        return 'path NOT IN ({} AND value = ?)'.format(subquery), [key, value]
+    elif operator == '~':
+        return 'path IN ({} AND value GLOB ?)'.format(subquery), [key, value]
+    elif operator in {'<', '<=', '>', '>='}:
+        number = to_number(value)
+        if number is None:
+            raise ValueError('numeric value expected: {}{}{}'.format(*predicate))
+        return 'path IN ({} AND number {} ?)'.format(subquery, operator), [key, number]
+    raise ValueError('unsupported operator: {}'.format(operator))
+
+
+def extract_rows(document, paths=()):
+    '''
+    Extract index rows from a metadata document. Return a tuple of lists:
+    (section, schema), (section, algorithm, hash) and (key, value, number)
+    '''
+    info = document['info']
+    schemas = [('info', info['version'])]
+    schemas.extend((section, schema) for section, schema in info.get('schema', {}).items())
+    hashes = []
+    for section, values in info.get('hashes', {}).items():
+        hashes.extend(
+            (section, algorithm, value)
+            for algorithm, value in values.items()
+            if algorithm != 'timestamp'
+        )
+    values = []
+    for section in document:
+        if section != 'info':
+            values.extend(flatten(document[section], section, paths))
+    return schemas, hashes, values
+
+
+def flatten(data, prefix, paths=(), depth=0):
+    '''
+    Yield (dotted key, text value, numeric value) for scalar values in a tree
+    of mappings. Lists of scalars produce a row for each item; mappings
+    inside lists are not indexed.
+    '''
+    if isinstance(data, dict):
+        if depth >= MAX_DEPTH:
+            return
+        for key, value in data.items():
+            path = '{}.{}'.format(prefix, key)
+            if paths and not any(is_related(path, p) for p in paths):
+                continue
+            yield from flatten(value, path, paths, depth + 1)
+    elif isinstance(data, list):
+        for item in data:
+            if not isinstance(item, (dict, list)):
+                yield from flatten(item, prefix, paths, depth)
+    else:
+        yield prefix, to_text(data), to_number(data)
+
+
+def is_related(path, selected):
+    '''Check if path is a part of selected subtree or its ancestor'''
+    return path == selected \
+        or path.startswith(selected + '.') \
+        or selected.startswith(path + '.') \
+        or fnmatch.fnmatchcase(path, selected)
+
+
+def to_text(value):
+    if isinstance(value, str):
+        return value
+    try:
+        return json.dumps(value)
+    except TypeError:  # e.g. dates in YAML
+        return str(value)
+
+
+def to_number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
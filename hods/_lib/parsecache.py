@@ -0,0 +1,225 @@
+'''
+Persistent cache of parsed YAML documents
+
+Parsing YAML (especially with comment preserving round-trip loader) is much
+slower than unpickling the resulting tree. Parsed objects are stored in cache
+directory and are reused while the source file is not modified, like Python
+does with .pyc files.
+
+Cache entries are keyed by real path of the file, its size, modification time
+and inode number, by the kind of tree (round-trip or plain) and by the version
+of the loader. Least recently used entries are removed when the size of the
+cache exceeds the limit.
+
+Cache is disabled by default. Default settings may be overridden with
+environment variables: HODS_PARSE_CACHE, HODS_PARSE_CACHE_SIZE (in MiB) and
+HODS_CACHE_DIR.
+
+Entries are stored with pickle, so the cache directory must not be writable
+by untrusted users.
+'''
+
+
+import os
+import sys
+import tempfile
+import time
+from functools import lru_cache
+from hashlib import sha256
+
+from hods._lib.profile import count
+
+
+CACHE_VERSION = 1
+CACHED_FORMATS = {'YAML', 'StrictYAML'}  # JSON parser is as fast as unpickling
+MIN_SIZE = 16 * 1024  # smaller files are parsed quickly anyway
+RACY_WINDOW = 2  # seconds; recently modified files may change again within mtime granularity
+DEFAULT_SIZE = 256  # MiB
+EVICT_TO = 0.75  # share of the size limit that is kept after eviction
+VARIANTS = {False: 'roundtrip', True: 'plain'}
+
+
+class ParseCache:
+    '''
+    On-disk storage of parsed documents.
+
+    Round-trip trees (that preserve comments and formatting) and plain trees
+    (produced by readonly loaders) are kept in separate subdirectories.
+
+    Any problem with cache entries is treated as a cache miss, the file is
+    parsed as usual then.
+    '''
+
+
+    def __init__(self, directory=None, max_size=None, enabled=None):
+        env = os.environ.get
+        if directory is None:
+            directory = env('HODS_CACHE_DIR') or os.path.join(
+                env('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                'hods',
+            )
+        if max_size is None:
+            try:
+                max_size = int(float(env('HODS_PARSE_CACHE_SIZE', DEFAULT_SIZE)) * 1024 * 1024)
+            except ValueError:  # must not break importing the package
+                import warnings
+                warnings.warn('ignoring invalid value of HODS_PARSE_CACHE_SIZE')
+                max_size = DEFAULT_SIZE * 1024 * 1024
+        if enabled is None:
+            enabled = env('HODS_PARSE_CACHE', '').lower() in {'1', 'yes', 'true', 'on'}
+        self.directory = os.path.join(directory, 'parsed')
+        self.max_size = max_size
+        self.enabled = enabled
+        self._size = None  # total size of entries, calculated on first write
+
+
+    def load(self, filename, fileformat, readonly, loader):
+        '''
+        Return the object parsed from file. Cached object is used if the file
+        was not modified, otherwise `loader(filename)` is called and its result
+        is saved to cache.
+        '''
+        if fileformat not in CACHED_FORMATS:
+            return loader(filename)
+        stat = os.stat(filename)
+        if stat.st_size < MIN_SIZE:
+            return loader(filename)
+        path = self.path(filename, readonly)
+        key = self.key(filename, stat, fileformat, readonly)
+        obj = self.read(path, key)
+        if obj is not None:
+            count('parse cache hits')
+            return obj
+        count('parse cache misses')
+        obj = loader(filename)
+        if time.time() - stat.st_mtime < RACY_WINDOW:
+            return obj
+        if stat_tuple(os.stat(filename)) != stat_tuple(stat):  # changed while parsing
+            return obj
+        self.write(path, key, obj)
+        return obj
+
+
+    def path(self, filename, readonly=False):
+        '''Cache entry location for given file'''
+        name = sha256(os.fsencode(os.path.realpath(filename))).hexdigest() + '.pickle'
+        return os.path.join(self.directory, VARIANTS[bool(readonly)], name)
+
+
+    def key(self, filename, stat, fileformat, readonly=False):
+        '''Values that must match for cache entry to be valid'''
+        return (
+            CACHE_VERSION,
+            os.path.realpath(filename),
+            fileformat,
+            VARIANTS[bool(readonly)],
+            loader_version(fileformat, bool(readonly)),
+        ) + stat_tuple(stat)
+
+
+    def read(self, path, key):
+        '''Read cache entry, return None if there is no valid entry'''
+        import pickle
+        try:
+            with open(path, 'rb') as f:
+                if pickle.load(f) != key:
+                    return None
+                obj = pickle.load(f)
+            os.utime(path)  # mark as recently used
+            return obj
+        except FileNotFoundError:
+            return None
+        except Exception:  # damaged entry
+            self.remove(path)
+            return None
+
+
+    def write(self, path, key, obj):
+        '''Write cache entry atomically, ignore errors'''
+        import pickle
+        directory = os.path.dirname(path)
+        temp = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            descriptor, temp = tempfile.mkstemp(suffix='.tmp', dir=directory)
+            with os.fdopen(descriptor, 'wb') as f:
+                pickle.dump(key, f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+                size = f.tell()
+            os.replace(temp, path)
+        except Exception:  # unpicklable objects, read-only or full disk, etc
+            if temp is not None:
+                self.remove(temp)
+            return
+        if self._size is None:
+            self._size = sum(size for _, _, size in self.entries())
+        else:
+            self._size += size
+        if self._size > self.max_size:
+            self.evict(int(self.max_size * EVICT_TO))
+
+
+    def entries(self):
+        '''Yield (path, last usage time, size) for all cache entries'''
+        for variant in VARIANTS.values():
+            try:
+                scanner = os.scandir(os.path.join(self.directory, variant))
+            except OSError:
+                continue
+            for entry in scanner:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                yield entry.path, stat.st_mtime, stat.st_size
+
+
+    def evict(self, target_size):
+        '''Remove least recently used entries until cache fits into target size'''
+        entries = sorted(self.entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if total <= target_size:
+                break
+            self.remove(path)
+            total -= size
+        self._size = total
+
+
+    def invalidate(self, filename=None):
+        '''Remove cached objects for given file or all cache entries'''
+        if filename is not None:
+            targets = [self.path(filename, readonly) for readonly in VARIANTS]
+        else:
+            targets = [path for path, _, _ in self.entries()]
+        for target in targets:
+            self.remove(target)
+        self._size = None
+
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+
+def stat_tuple(stat):
+    '''Same values as used by VerificationCache to detect changed files'''
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+@lru_cache(maxsize=None)
+def loader_version(fileformat, readonly):
+    '''Versions of the libraries that produce parsed objects'''
+    import ruamel.yaml
+    versions = [sys.version_info[:2], ruamel.yaml.__version__]
+    if fileformat == 'StrictYAML' and not readonly:
+        import strictyaml
+        versions.append(strictyaml.__version__)
+    return tuple(versions)
+
+
+parse_cache = ParseCache()
@@ -0,0 +1,195 @@
+'''
+Lightweight instrumentation of time consuming operations
+
+Functions decorated with `profiled()` report their run time to the active
+Profiler. When no profiler is active the overhead is a single global lookup
+per call.
+
+    from hods._lib.profile import Profiler
+
+    profiler = Profiler()
+    with profiler.activate():
+        ...
+    print(profiler.format())
+'''
+
+
+import json
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+
+_active = None  # Profiler that receives measurements
+
+
+def profiled(phase):
+    '''Decorator that reports function run time under the given phase name'''
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            profiler = _active
+            if profiler is None:
+                return function(*args, **kwargs)
+            profiler.start(phase)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.stop()
+        return wrapper
+    return decorator
+
+
+def count(counter, value=1):
+    '''Increment a counter of the active profiler'''
+    profiler = _active
+    if profiler is not None:
+        profiler.counters[counter] = profiler.counters.get(counter, 0) + value
+
+
+def track_file(filename):
+    '''Context manager that measures the time spent on processing a file'''
+    profiler = _active
+    if profiler is None:
+        return _NOT_TRACKED
+    return profiler.track_file(filename)
+
+
+def get_profiler():
+    '''Return active profiler or None'''
+    return _active
+
+
+
+class Profiler:
+    '''
+    Collects run time of operations grouped by phase names and by processed
+    files.
+
+    Own time of a phase does not include the time spent in nested phases, so
+    own times of all phases add up to total profiled time.
+    '''
+
+
+    def __init__(self):
+        self.phases = {}  # name -> [calls, total, own, max]
+        self.files = {}  # filename -> seconds
+        self.counters = {}
+        self.wall = 0
+        self._stack = []  # [phase, started, nested]
+        self._started = None
+
+
+    @contextmanager
+    def activate(self):
+        '''Make this profiler receive measurements within the `with` block'''
+        global _active
+        previous = _active
+        _active = self
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.wall += time.perf_counter() - started
+            _active = previous
+
+
+    def start(self, phase):
+        self._stack.append([phase, time.perf_counter(), 0])
+
+
+    def stop(self):
+        phase, started, nested = self._stack.pop()
+        elapsed = time.perf_counter() - started
+        if self._stack:
+            self._stack[-1][2] += elapsed
+        stats = self.phases.get(phase)
+        if stats is None:
+            stats = self.phases[phase] = [0, 0, 0, 0]
+        stats[0] += 1
+        if not any(frame[0] == phase for frame in self._stack):  # recursion
+            stats[1] += elapsed
+        stats[2] += elapsed - nested
+        stats[3] = max(stats[3], elapsed)
+
+
+    @contextmanager
+    def track_file(self, filename):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.files[filename] = self.files.get(filename, 0) + elapsed
+
+
+    def report(self):
+        '''Return collected measurements as JSON serializable dictionary'''
+        return {
+            'wall': self.wall,
+            'phases': {
+                name: dict(zip(('calls', 'total', 'own', 'max'), stats))
+                for name, stats in self.phases.items()
+            },
+            'files': dict(self.files),
+            'counters': dict(self.counters),
+        }
+
+
+    def merge(self, report):
+        '''Add measurements from another profiler report (e.g. from a worker process)'''
+        for name, values in report['phases'].items():
+            stats = self.phases.get(name)
+            if stats is None:
+                stats = self.phases[name] = [0, 0, 0, 0]
+            stats[0] += values['calls']
+            stats[1] += values['total']
+            stats[2] += values['own']
+            stats[3] = max(stats[3], values['max'])
+        for filename, elapsed in report['files'].items():
+            self.files[filename] = self.files.get(filename, 0) + elapsed
+        for counter, value in report['counters'].items():
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+
+    def dump(self, filename):
+        '''Save report to JSON file'''
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+
+
+    def format(self, limit=10):
+        '''Return human readable summary: per phase breakdown and slowest files'''
+        lines = [
+            'Profile: {:.3f}s wall time, {} files'.format(self.wall, len(self.files)),
+            '{:<16} {:>8} {:>10} {:>10} {:>10}'.format('Phase', 'Calls', 'Total', 'Own', 'Max'),
+        ]
+        phases = sorted(self.phases.items(), key=lambda item: item[1][2], reverse=True)
+        for name, (calls, total, own, longest) in phases:
+            lines.append('{:<16} {:>8} {:>9.3f}s {:>9.3f}s {:>9.3f}s'.format(
+                name, calls, total, own, longest
+            ))
+        for counter, value in sorted(self.counters.items()):
+            lines.append('{:<16} {:>8}'.format(counter, value))
+        slowest = sorted(self.files.items(), key=lambda item: item[1], reverse=True)[:limit]
+        if slowest:
+            lines.append('Slowest files:')
+            lines.extend('{:>9.3f}s  {}'.format(elapsed, name) for name, elapsed in slowest)
+        return '\n'.join(lines)
+
+
+
+class NotTracked:
+    '''No-op context manager'''
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        return None
+
+
+
+_NOT_TRACKED = NotTracked()
@@ -0,0 +1,397 @@
+'''
+Append-only record logs for large HODS collections
+
+Records that belong to a list inside a metadata document are appended to a
+JSON Lines companion file instead of rewriting the whole document. Appending
+a record costs the same regardless of collection size: only the new record is
+validated (against the item schema) and hashed.
+
+Log file layout:
+
+    {"hods-records": 1, "base": "<sha256 of the section in base file>", ...}
+    {"chain": "<sha256>", "record": {...}}
+    {"chain": "<sha256>", "record": {...}}
+
+Each chain value is the SHA256 hash of the previous chain value followed by
+the canonical JSON of the record, so that modification, removal or
+reordering of records is detected. The first chain value is derived from the
+hash stored in the base document, which binds the log to a specific version
+of it.
+
+`RecordLog.compact()` merges logged records into the base document, which
+becomes a regular HODS file with standard data hashes. Before the base
+document is replaced, a marker with the new section hash is appended to the
+log:
+
+    {"compacted": "<sha256 of the section after compaction>"}
+
+so that a log left behind by interrupted compaction is recognized later: it
+is removed if the base document already contains its records, or the marker
+is dropped if the base document was not replaced.
+'''
+
+
+import json
+import mmap
+import os
+from hashlib import sha256
+
+from hods import HashMismatchError, Metadata
+from hods._lib.files import (
+    detect_format,
+    get_object,
+    import_ruamel_yaml,
+    plain_yaml_loaders,
+)
+from hods._lib.hash import canonical_json
+from hods._lib.schemas import Schema, get_items_scope, get_scope
+
+
+LOG_SUFFIX = '.records.jsonl'
+LOG_VERSION = 1
+TAIL_CHUNK_SIZE = 4096
+
+
+class RecordLog:
+    '''
+    Append-only log of records for a list inside a metadata document.
+
+    `path` is a sequence of mapping keys that leads from the `section` to the
+    list of records (empty path means that the section itself is the list).
+    Base document must have an up to date sha256 hash for the section.
+
+    Only the schema for individual items is checked on append, constraints on
+    the list as a whole (e.g. `maxItems`) are checked on compaction.
+    '''
+    __slots__ = (
+        'filename',
+        'log',
+        'section',
+        'path',
+        'sync',
+        '_base',
+        '_chain',
+        '_validators',
+    )
+
+
+    def __init__(self, filename, path=(), section='data', suffix=LOG_SUFFIX, sync=False):
+        self.filename = filename
+        self.log = filename + suffix
+        self.section = section
+        self.path = tuple(path)
+        self.sync = sync
+        self._load_base()
+        self._chain = None
+        header = self._read_header()
+        if header is not None:
+            self._recover()
+            if self._finish_compaction(header):
+                return
+            self._check_header(header)
+            self._chain = self._last_chain()
+
+
+    def _load_base(self):
+        '''Read info section of the base document and prepare item validators'''
+        info = read_info(self.filename)
+        try:
+            self._base = info['hashes'][self.section]['sha256']
+        except KeyError:
+            raise ValueError('no sha256 hash for {} section in {}'.format(
+                self.section, self.filename
+            ))
+        schema = Schema(info['schema'].get(self.section))
+        self._validators = item_validators(schema, self.path)
+
+
+    def _read_header(self):
+        try:
+            with open(self.log, 'rb') as f:
+                line = f.readline()
+        except FileNotFoundError:
+            return None
+        if not line.endswith(b'\n'):  # crashed before header was written
+            os.remove(self.log)
+            return None
+        return json.loads(line.decode())
+
+
+    def _check_header(self, header):
+        if header.get('hods-records') != LOG_VERSION:
+            raise ValueError('unsupported record log format: {}'.format(self.log))
+        section = header.get('section')
+        path = header.get('path')
+        if section != self.section or not isinstance(path, list) or tuple(path) != self.path:
+            raise ValueError('record log {} belongs to another list: {}'.format(
+                self.log,
+                '.'.join(str(key) for key in [section] + (path if isinstance(path, list) else [])),
+            ))
+        if header.get('base') != self._base:
+            raise ValueError('record log {} was created for another version of {}'.format(
+                self.log, self.filename
+            ))
+
+
+    def _recover(self):
+        '''Drop incomplete last line left by interrupted append'''
+        with open(self.log, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            position = size
+            while position > 0:
+                start = max(0, position - TAIL_CHUNK_SIZE)
+                f.seek(start)
+                chunk = f.read(position - start)
+                newline = chunk.rfind(b'\n')
+                if newline >= 0:
+                    end = start + newline + 1
+                    if end != size:
+                        f.truncate(end)
+                    return
+                position = start
+
+
+    def _finish_compaction(self, header):
+        '''
+        Clean up after interrupted compaction. Return True if the log was
+        already merged into the base document and was removed.
+        '''
+        line = read_last_line(self.log)
+        try:
+            compacted = json.loads(line.decode()).get('compacted')
+        except ValueError:
+            return False
+        if compacted is None:
+            return False
+        same_list = header.get('section') == self.section \
+                and tuple(header.get('path', ())) == self.path
+        if compacted == self._base and same_list:
+            os.remove(self.log)
+            return True
+        self._drop_last_line(len(line))  # base document was not replaced
+        return False
+
+
+    def _drop_last_line(self, length):
+        with open(self.log, 'rb+') as f:
+            f.truncate(f.seek(0, os.SEEK_END) - length)
+
+
+    def _last_chain(self):
+        '''Read the chain value from the last line of the log'''
+        line = read_last_line(self.log)
+        entry = json.loads(line.decode())
+        return entry.get('chain', self._base)
+
+
+    def _write(self, lines, sync=False):
+        with open(self.log, 'ab') as f:
+            f.write(b''.join(lines))
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+
+
+    def append(self, *records):
+        '''Validate records against the item schema and add them to the log'''
+        lines = []
+        chain = self._chain or self._base
+        for record in records:
+            for compiled, subschema in self._validators:
+                compiled.validate_subschema(record, subschema)
+            chain = chain_hash(chain, record)
+            lines.append(encode_line({'chain': chain, 'record': record}))
+        if not lines:
+            return
+        if self._chain is None:
+            lines.insert(0, encode_line({
+                'hods-records': LOG_VERSION,
+                'base': self._base,
+                'section': self.section,
+                'path': list(self.path),
+            }))
+        self._write(lines, self.sync)
+        self._chain = chain
+
+
+    def __iter__(self):
+        '''
+        Yield logged records in order of appending. Raise HashMismatchError
+        if the log was modified.
+        '''
+        if self._chain is None:
+            return
+        chain = self._base
+        with open(self.log, 'rb') as f:
+            f.readline()  # header
+            for number, line in enumerate(f, start=1):
+                entry = json.loads(line.decode())
+                record = entry['record']
+                chain = chain_hash(chain, record)
+                if chain != entry['chain']:
+                    raise HashMismatchError('record #{} in {} does not match its hash'.format(
+                        number, self.log
+                    ))
+                yield record
+        if chain != self._chain:
+            raise HashMismatchError('records were removed from {}'.format(self.log))
+
+
+    def verify(self):
+        '''Check the integrity of the log and return the number of records'''
+        count = 0
+        for count, _ in enumerate(self, start=1):
+            pass
+        return count
+
+
+    def compact(self, backup=None):
+        '''
+        Merge logged records into the base document, update its hashes and
+        remove the log. Return the number of merged records.
+
+        The base document is replaced atomically. If compaction is
+        interrupted, the log is either removed (if the base document was
+        replaced) or stays valid when it is opened again.
+
+        HashMismatchError is raised and nothing is changed if the section in
+        the base document does not match the hash the log was created for.
+        '''
+        records = list(self)
+        if not records:
+            return 0
+        meta = Metadata(filename=self.filename)
+        stored = meta.info.hashes[self.section].sha256
+        if stored != self._base:
+            raise HashMismatchError('{} was modified after record log {} was created'.format(
+                self.filename, self.log
+            ))
+        meta.validate_hashes(sections=[self.section])
+        keys = (self.section,) + self.path
+        node = meta._data_container
+        for key in keys[:-1]:
+            node = getattr(node, key)
+        setattr(node, keys[-1], list(getattr(node, keys[-1])) + records)
+        meta.validate_hashes(write_updates=True, sections=[self.section])
+        marker = encode_line({'compacted': meta.info.hashes[self.section].sha256})
+        self._write([marker], sync=True)
+        try:
+            meta.write(backup=backup)
+        except BaseException:
+            self._drop_last_line(len(marker))
+            raise
+        os.remove(self.log)
+        self._load_base()
+        self._chain = None
+        return len(records)
+
+
+
+def read_info(filename):
+    '''
+    Read info section of a metadata file. Reading stops after the info
+    section when possible, so the payload is neither parsed nor validated
+    '''
+    fileformat = detect_format(filename)
+    if fileformat == 'JSON':
+        info = read_json_info(filename)
+    else:
+        info = read_yaml_info(filename, fileformat)
+    if info is None:  # unusual layout, load the whole document
+        info = get_object(filename, readonly=True)['info']
+    return info
+
+
+def read_json_info(filename):
+    '''Scan top level JSON object until the info member is found'''
+    from hods._lib.stream import JsonStream, Span
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            stream = JsonStream(buffer)
+            root = stream.skip_whitespace(0)
+            for key, start, end, value in stream.iter_container(root, expect='{'):
+                if key == 'info':
+                    return stream.load(Span(start, end))
+    return None
+
+
+def read_yaml_info(filename, fileformat):
+    '''
+    Parse only the top level `info:` block of YAML document. Return None if
+    there is no such block (e.g. the document uses flow style)
+    '''
+    lines = []
+    with open(filename) as f:
+        for line in f:
+            if lines:
+                if line[:1] not in (' ', '\r', '\n', '#'):  # next top level key
+                    break
+                lines.append(line)
+            elif line.startswith('info:'):
+                lines.append(line)
+    if not lines:
+        return None
+    yaml = import_ruamel_yaml()
+    loaders = plain_yaml_loaders()
+    loader = loaders.strings if fileformat == 'StrictYAML' else loaders.typed
+    try:
+        return yaml.load(''.join(lines), Loader=loader)['info']
+    except Exception:
+        return None
+
+
+def item_validators(schema, path):
+    '''
+    Return the list of (CompiledSchema, subschema) pairs that apply to each
+    item of the list located at `path` inside the data validated by `schema`
+    '''
+    if schema.parsed is None:
+        return []
+    compiled = schema._compiled
+    pending = [schema.parsed]
+    for key in path:
+        descendants = []
+        for subschema in pending:
+            scope = get_scope(compiled, subschema, key)
+            if scope is None:
+                raise ValueError('schema can not be applied to separate records: {}'.format(schema.id))
+            descendants.extend(scope.children)
+        pending = descendants
+    validators = []
+    for subschema in pending:
+        scope = get_items_scope(compiled, subschema)
+        if scope is None:
+            raise ValueError('schema can not be applied to separate records: {}'.format(schema.id))
+        prefix, rest = scope.children
+        if prefix:
+            raise ValueError('record logs do not support positional item schemas: {}'.format(schema.id))
+        if rest is not None:
+            validators.append((compiled, rest))
+    return validators
+
+
+def chain_hash(previous, record):
+    '''Calculate next value of the hash chain'''
+    hasher = sha256(previous.encode())
+    hasher.update(canonical_json(record).encode())
+    return hasher.hexdigest()
+
+
+def encode_line(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode() + b'\n'
+
+
+def read_last_line(filename):
+    '''Read the last line of a text file without reading the whole file'''
+    with open(filename, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        tail = b''
+        while position > 0:
+            start = max(0, position - TAIL_CHUNK_SIZE)
+            f.seek(start)
+            tail = f.read(position - start) + tail
+            position = start
+            newline = tail.rfind(b'\n', 0, len(tail) - 1)
+            if newline >= 0:
+                return tail[newline + 1:]
+        return tail
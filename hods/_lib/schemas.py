@@ -5,11 +5,18 @@ Helpers for working with data schemas
 
 import os
 import json
-import jsonschema
-import urllib
-import pkg_resources
-from collections import OrderedDict
+import pkgutil
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
 from functools import lru_cache
+from hashlib import sha256
+
+from hods._lib.profile import profiled
 
 
 URL_PREFIXES_MIRRORED_IN_PACKAGE = OrderedDict((
@@ -30,9 +37,11 @@ class Schema:
         'engine',
         'id',
         'raw',
+        '_compiled',
     )
 
 
+    @profiled('schema')
     def __init__(self, identifier=None, engine='jsonschema'):
         '''Get schema object by schema ID (usually URL)'''
         if not identifier:  # Allow empty schema
@@ -40,29 +49,20 @@ class Schema:
             self.engine = engine
             self.id = None
             self.raw = None
+            self._compiled = None
             return
 
         identifier = restore_full_schema_id(identifier)
-        local_path = get_package_path(identifier)
-        raw_schema = None
-        if local_path:
-            try:
-                raw_schema = read_from_package(local_path)
-            except FileNotFoundError:
-                pass
-        if not raw_schema:
-            raw_schema = read_from_url(identifier)
-
-        if engine == 'jsonschema':
-            self.parsed = json.loads(raw_schema)
-        else:
-            raise ValueError('unknown schema engine: {}'.format(engine))
+        compiled = registry.get(identifier, engine)
 
         self.id = identifier
         self.engine = engine
-        self.raw = raw_schema
+        self.raw = compiled.raw
+        self.parsed = compiled.parsed
+        self._compiled = compiled
 
 
+    @profiled('validate')
     def validate(self, data):
         '''
         Validate native Python data structure against the schema.
@@ -71,10 +71,39 @@ class Schema:
         '''
         if self.parsed is None:
             return
-        if self.engine == 'jsonschema':
-            return jsonschema.validate(data, self.parsed)
-        else:
-            raise ValueError('unknown schema engine: {}'.format(self.engine))
+        return self._compiled.validate(data)
+
+
+    @profiled('validate')
+    def validate_path(self, data, path):
+        '''
+        Validate data structure after a change at given path (a sequence of
+        mapping keys). Only the parts of schema that can reach the changed
+        node are evaluated.
+
+        Raises `hods.ValidationError` for invalid data.
+        '''
+        if self.parsed is None:
+            return
+        if not path:
+            return self._compiled.validate(data)
+        compiled = self._compiled
+        pending = [(data, self.parsed)]
+        for key in path:
+            descendants = []
+            for instance, schema in pending:
+                scope = get_scope(compiled, schema, key)
+                if scope is None or not isinstance(instance, Mapping) or key not in instance:
+                    compiled.validate_subschema(instance, schema)
+                    continue
+                compiled.validate_subschema(instance, scope.schema)
+                descendants.extend((instance[key], child) for child in scope.children)
+            pending = descendants
+        for instance, schema in pending:
+            compiled.validate_subschema(instance, schema)
+
+
+    __call__ = validate
 
 
     def __repr__(self):
@@ -82,6 +111,344 @@ class Schema:
 
 
 
+CompiledSchema = namedtuple('CompiledSchema', 'raw,parsed,validate,validate_subschema,scopes')
+SchemaScope = namedtuple('SchemaScope', 'schema,children')
+RegistryInfo = namedtuple('RegistryInfo', 'hits,misses,size,maxsize')
+
+
+class SchemaRegistry:
+    '''
+    Process-wide storage for parsed schemas and ready to use validators.
+
+    Entries are keyed by schema identifier and engine name. When the registry
+    grows larger than `maxsize` the least recently used entries are evicted
+    (`maxsize=None` means no limit).
+    '''
+
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+
+    def get(self, identifier, engine='jsonschema'):
+        '''Return CompiledSchema for given identifier, load it if neccessary'''
+        key = (identifier, engine)
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+
+        compiled = compile_schema(fetch_schema(identifier), engine, identifier)
+        with self._lock:
+            self._entries[key] = compiled
+            if self.maxsize is not None:
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return compiled
+
+
+    def invalidate(self, identifier=None, engine=None):
+        '''
+        Drop cached entries for given identifier and/or engine. If no
+        arguments are provided, the registry is cleared completely.
+        '''
+        with self._lock:
+            for key in list(self._entries):
+                cached_id, cached_engine = key
+                if identifier is not None and cached_id != identifier:
+                    continue
+                if engine is not None and cached_engine != engine:
+                    continue
+                del self._entries[key]
+
+
+    def info(self):
+        '''Report registry statistics'''
+        with self._lock:
+            return RegistryInfo(
+                hits=self.hits,
+                misses=self.misses,
+                size=len(self._entries),
+                maxsize=self.maxsize,
+            )
+
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+
+@profiled('schema compile')
+def compile_schema(raw_schema, engine='jsonschema', identifier=None):
+    '''
+    Parse raw schema and prepare a validator function for it.
+
+    Supported engines:
+        - jsonschema - validation is performed by jsonschema library
+        - compiled - schema is compiled into Python code (see SchemaCompiler)
+    '''
+    if engine == 'jsonschema':
+        import jsonschema
+        parsed = json.loads(raw_schema)
+        validator_class = jsonschema.validators.validator_for(parsed)
+        validator_class.check_schema(parsed)
+        validator = validator_class(parsed, **reference_options(parsed))
+
+        def validate(data):
+            error = jsonschema.exceptions.best_match(validator.iter_errors(data))
+            if error is not None:
+                raise error
+
+        evolved = {}
+
+        def validate_subschema(data, subschema):
+            try:
+                schema, scoped = evolved[id(subschema)]
+            except KeyError:
+                schema = None
+            if schema is not subschema:
+                if len(evolved) >= SCOPE_CACHE_SIZE:
+                    evolved.clear()
+                scoped = validator.evolve(schema=subschema)
+                evolved[id(subschema)] = (subschema, scoped)
+            error = jsonschema.exceptions.best_match(scoped.iter_errors(data))
+            if error is not None:
+                raise error
+    elif engine == 'compiled':
+        import jsonschema
+        from hods._lib.compiler import SchemaCompiler
+        parsed = json.loads(raw_schema)
+        validator_class = jsonschema.validators.validator_for(parsed, default=jsonschema.Draft7Validator)
+        if validator_class is not jsonschema.Draft7Validator:
+            raise ValueError('compiled schema engine supports only draft-07 schemas')
+        validator_class.check_schema(parsed)
+        compiler = SchemaCompiler(parsed, base_uri=identifier or '', load=load_reference)
+        validate = compiler.validate
+        subschemas = {}
+
+        def validate_subschema(data, subschema):
+            try:
+                schema, function = subschemas[id(subschema)]
+            except KeyError:
+                schema = None
+            if schema is not subschema:
+                if len(subschemas) >= SCOPE_CACHE_SIZE:
+                    subschemas.clear()
+                function = compiler.detached().function(subschema)
+                subschemas[id(subschema)] = (subschema, function)
+            function(data)
+    else:
+        raise ValueError('unknown schema engine: {}'.format(engine))
+    return CompiledSchema(
+        raw=raw_schema,
+        parsed=parsed,
+        validate=validate,
+        validate_subschema=validate_subschema,
+        scopes=dict(),
+    )
+
+
+# Keywords that apply subschemas to the whole instance. Path-scoped
+# validation falls back to validating the complete node if any of these is used
+UNSCOPED_KEYWORDS = {
+    '$ref',
+    'allOf',
+    'anyOf',
+    'oneOf',
+    'not',
+    'if',
+    'then',
+    'else',
+    'dependencies',
+    'dependentSchemas',
+    'unevaluatedProperties',
+    'unevaluatedItems',
+    '$recursiveRef',
+    '$dynamicRef',
+}
+SCOPE_CACHE_SIZE = 1024
+
+
+def get_scope(compiled, schema, key):
+    '''
+    Split mapping schema into the part that validates the mapping itself
+    (with all values except `key` accepted as is) and the list of subschemas
+    that apply to the value under `key`.
+
+    Return None if schema can not be split.
+    '''
+    cache_key = (id(schema), key)  # schema is kept alive by `compiled`
+    try:
+        return compiled.scopes[cache_key]
+    except KeyError:
+        pass
+
+    if not isinstance(schema, dict) or UNSCOPED_KEYWORDS.intersection(schema):
+        scope = None
+    else:
+        shallow = dict(schema)
+        children = []
+        matched = False
+
+        properties = schema.get('properties', {})
+        if properties:
+            shallow['properties'] = dict.fromkeys(properties, True)
+        if key in properties:
+            children.append(properties[key])
+            matched = True
+
+        patterns = schema.get('patternProperties', {})
+        if patterns:
+            shallow['patternProperties'] = dict.fromkeys(patterns, True)
+        for pattern, subschema in patterns.items():
+            if re.search(pattern, key):
+                children.append(subschema)
+                matched = True
+
+        additional = schema.get('additionalProperties')
+        if isinstance(additional, dict):
+            del shallow['additionalProperties']
+            if not matched:
+                children.append(additional)
+
+        scope = SchemaScope(schema=shallow, children=children)
+
+    if len(compiled.scopes) >= SCOPE_CACHE_SIZE:
+        compiled.scopes.clear()
+    compiled.scopes[cache_key] = scope
+    return scope
+
+
+def get_items_scope(compiled, schema):
+    '''
+    Split array schema into the part that validates the array itself (without
+    looking at its items) and the subschemas for items. Children of returned
+    scope are a pair of the list of subschemas for leading items and
+    a subschema for all other items (or None).
+
+    Return None if schema can not be split.
+    '''
+    cache_key = (id(schema), _ITEMS)
+    try:
+        return compiled.scopes[cache_key]
+    except KeyError:
+        pass
+
+    scope = None
+    if isinstance(schema, dict) and not UNSCOPED_KEYWORDS.intersection(schema):
+        if 'prefixItems' in schema:  # draft 2020-12
+            prefix, rest = schema['prefixItems'], schema.get('items')
+        elif isinstance(schema.get('items'), list):
+            prefix, rest = schema['items'], schema.get('additionalItems')
+        else:
+            prefix, rest = [], schema.get('items')
+        if rest is True:
+            rest = None
+        if rest is None or isinstance(rest, dict):
+            shallow = dict(schema)
+            for keyword in ('prefixItems', 'items', 'additionalItems'):
+                shallow.pop(keyword, None)
+            scope = SchemaScope(schema=shallow, children=(prefix, rest))
+
+    if len(compiled.scopes) >= SCOPE_CACHE_SIZE:
+        compiled.scopes.clear()
+    compiled.scopes[cache_key] = scope
+    return scope
+
+
+_ITEMS = object()  # scope cache marker for array items
+
+
+@profiled('schema fetch')
+def fetch_schema(identifier):
+    '''Get raw schema text from this package or from the network'''
+    local_path = get_package_path(identifier)
+    raw_schema = None
+    if local_path:
+        try:
+            raw_schema = read_from_package(local_path)
+        except FileNotFoundError:
+            pass
+    if not raw_schema:
+        raw_schema = read_from_url(identifier)
+    return raw_schema
+
+
+def reference_options(schema):
+    '''
+    Keyword arguments for jsonschema validator that make it resolve `$ref`
+    via shared reference registry
+    '''
+    try:
+        return dict(registry=reference_registry())
+    except ImportError:  # jsonschema < 4.18
+        import jsonschema
+        handlers = dict.fromkeys(('http', 'https'), load_reference)
+        resolver = jsonschema.RefResolver.from_schema(
+            schema,
+            store=dict(bundled_schemas()),
+            handlers=handlers,
+        )
+        return dict(resolver=resolver)
+
+
+@lru_cache(maxsize=None)
+def reference_registry():
+    '''
+    Process-wide registry of schemas that may be referenced with `$ref`.
+
+    Schemas bundled with this package are loaded in advance under all URLs
+    mirrored in package. Other schemas are retrieved on first use via
+    `fetch_schema()` (that is, from package or from persistent cache of
+    remote schemas) and are kept for the lifetime of the process.
+    '''
+    from referencing import Registry
+    return Registry(retrieve=retrieve_reference).with_resources(
+        (uri, make_resource(contents)) for uri, contents in bundled_schemas()
+    )
+
+
+def retrieve_reference(uri):
+    '''Retrieve referenced schema that is not present in registry'''
+    return make_resource(load_reference(uri))
+
+
+@lru_cache(maxsize=None)
+def load_reference(uri):
+    '''Load and parse referenced schema, bare file names point to hods.ml'''
+    return json.loads(fetch_schema(restore_full_schema_id(uri)))
+
+
+def make_resource(contents):
+    from referencing import Resource
+    from referencing.jsonschema import DRAFT202012
+    return Resource.from_contents(contents, default_specification=DRAFT202012)
+
+
+def bundled_schemas():
+    '''Yield (URL, parsed schema) for all schemas shipped with this package'''
+    for name in list_package_dir(PACKAGE_SCHEMAS):
+        if not name.endswith('.json'):
+            continue
+        contents = json.loads(read_from_package(PACKAGE_SCHEMAS + name))
+        for prefix, directory in URL_PREFIXES_MIRRORED_IN_PACKAGE.items():
+            if directory == PACKAGE_SCHEMAS:
+                yield prefix + name, contents
+
+
+PACKAGE_SCHEMAS = 'schemas/'
+
+
 def detect_schema_engine(identifier):  # TODO
     pass
 
@@ -89,18 +456,188 @@ def detect_schema_engine(identifier):  # TODO
 def read_from_package(path):
     '''Get contents of a file in this package'''
     package = 'hods'
-    return pkg_resources.resource_string(package, path).decode()
+    try:
+        from importlib.resources import files
+    except ImportError:  # Python < 3.9
+        return pkgutil.get_data(package, path).decode()
+    return files(package).joinpath(path).read_bytes().decode()
+
+
+def list_package_dir(path):
+    '''List file names in a directory of this package'''
+    package = 'hods'
+    try:
+        from importlib.resources import files
+    except ImportError:  # Python < 3.9
+        import hods
+        directory = os.path.join(os.path.dirname(hods.__file__), path)
+        return sorted(os.listdir(directory))
+    return sorted(item.name for item in files(package).joinpath(path).iterdir())
 
 
 @lru_cache(maxsize=32)
 def read_from_url(url):
-    '''Get text contents from remote URL'''
-    with urllib.request.urlopen(url) as response:
+    '''Get text contents from remote URL (with persistent caching)'''
+    return remote_cache.get(url)
+
+
+def download(url, headers=None, timeout=None):
+    '''
+    Fetch remote URL. Return response object and its decoded contents.
+    Contents are None if server reports that resource was not modified
+    '''
+    import urllib.request
+    request = urllib.request.Request(url, headers=headers or {})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            try:
+                encoding = response.headers.get_content_charset() or 'utf-8'
+            except Exception:
+                encoding = 'utf-8'
+            return response, response.read().decode(encoding)
+    except urllib.error.HTTPError as error:
+        if error.code == 304:  # not modified
+            return error, None
+        raise
+
+
+class RemoteSchemaCache:
+    '''
+    Persistent storage for schemas downloaded from network.
+
+    Cached entries younger than `ttl` seconds are used without network
+    access. Older entries are revalidated with conditional requests
+    (ETag/Last-Modified) and are used as a fallback if server is not
+    reachable. In `offline` mode network is never accessed.
+
+    Default settings may be overridden with environment variables:
+    HODS_CACHE_DIR, HODS_SCHEMA_TTL, HODS_OFFLINE, HODS_TIMEOUT
+    '''
+
+
+    def __init__(self, directory=None, ttl=None, offline=None, timeout=None):
+        env = os.environ.get
+        if directory is None:
+            directory = env('HODS_CACHE_DIR') or os.path.join(
+                env('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                'hods',
+            )
+        if ttl is None:
+            ttl = env_number('HODS_SCHEMA_TTL', 24 * 60 * 60)
+        if offline is None:
+            offline = env('HODS_OFFLINE', '').lower() in {'1', 'yes', 'true', 'on'}
+        if timeout is None:
+            timeout = env_number('HODS_TIMEOUT', 10)
+        self.directory = os.path.join(directory, 'schemas')
+        self.ttl = ttl
+        self.offline = offline
+        self.timeout = timeout
+
+
+    def get(self, url):
+        '''Get schema text from cache or from network'''
+        entry = self.load(url)
+        if entry is not None:
+            age = time.time() - entry['fetched']
+            if self.offline or 0 <= age < self.ttl:
+                return entry['content']
+        elif self.offline:
+            raise urllib.error.URLError(
+                'offline mode: schema is not available from cache: {}'.format(url)
+            )
+
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
         try:
-            encoding = response.headers.get_content_charset()
-        except Exception:
-            encoding = 'utf-8'
-        return response.read().decode(encoding)
+            response, content = download(url, headers, timeout=self.timeout)
+        except (urllib.error.URLError, OSError):
+            if entry is None:
+                raise
+            return entry['content']  # stale entry is better than nothing
+
+        if content is None:
+            content = entry['content']
+        self.save(url, dict(
+            url=url,
+            content=content,
+            etag=response.headers.get('ETag') or (entry or {}).get('etag'),
+            last_modified=response.headers.get('Last-Modified')
+                          or (entry or {}).get('last_modified'),
+            fetched=time.time(),
+        ))
+        return content
+
+
+    def path(self, url):
+        '''Cache file location for given URL'''
+        return os.path.join(self.directory, sha256(url.encode()).hexdigest() + '.json')
+
+
+    def load(self, url):
+        '''Read cache entry for URL, return None if there is no valid entry'''
+        try:
+            with open(self.path(url)) as f:
+                entry = json.load(f)
+            if entry['url'] != url:
+                return None
+            entry['content'], entry['fetched']  # check required fields
+            return entry
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+
+    def save(self, url, entry):
+        '''Write cache entry atomically, ignore errors'''
+        path = self.path(url)
+        temp = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temp, 'w') as f:
+                json.dump(entry, f)
+            os.replace(temp, path)
+        except OSError:
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+
+
+    def invalidate(self, url=None):
+        '''Remove cached entry for URL or all cached entries'''
+        if url is not None:
+            targets = [self.path(url)]
+        else:
+            try:
+                targets = [os.path.join(self.directory, name)
+                           for name in os.listdir(self.directory)]
+            except OSError:
+                targets = []
+        for target in targets:
+            try:
+                os.remove(target)
+            except OSError:
+                pass
+
+
+
+def env_number(name, default):
+    '''
+    Read numeric setting from environment variable. Malformed values are
+    ignored with a warning, so that they do not break importing the package
+    '''
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        import warnings
+        warnings.warn('ignoring invalid value of {}: {!r}'.format(name, value))
+        return default
 
 
 def get_package_path(url):
@@ -122,3 +659,7 @@ def restore_full_schema_id(partial):
         return urllib.parse.urljoin(default_prefix, partial)
     else:
         return partial
+
+
+registry = SchemaRegistry()
+remote_cache = RemoteSchemaCache()
@@ -0,0 +1,445 @@
+'''
+Streaming access to large JSON metadata files.
+
+Payload sections are never loaded into memory as a whole. The file is
+memory-mapped and scanned with the C-accelerated JSON decoder one window at
+a time; containers that do not fit into a window are walked recursively.
+Schema validation is split into per-node subschemas (see `get_scope()`), and
+canonical JSON representation is fed to hash objects piece by piece.
+'''
+
+
+import codecs
+import json
+import mmap
+import re
+from collections import namedtuple
+
+from hods import HashMismatchError
+from hods._lib.hash import (
+    encode_batch,
+    encode_key,
+    iter_canonical,
+    pieces_hashes,
+)
+from hods._lib.schemas import Schema, get_items_scope, get_scope
+
+
+WINDOW_SIZE = 1024 * 1024  # values smaller than this are decoded at once
+BATCH_SIZE = 256  # number of array items serialized at once
+
+# Keywords that can not be checked against a placeholder that has only the
+# structure (keys, length) of the original node
+PLACEHOLDER_UNSAFE = {
+    'enum',
+    'const',
+    'contains',
+    'uniqueItems',
+}
+
+Span = namedtuple('Span', 'start,end')
+
+_LARGE = object()  # placeholder for values that were not decoded
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_WHITESPACE_BYTES = re.compile(br'[ \t\n\r]*')
+_STRING = re.compile(br'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_LITERAL = re.compile(br'[^ \t\n\r,\]}]*')
+
+
+class StreamingMetadata:
+    '''
+    Read-only view of a JSON metadata file that may be too large to be loaded
+    into memory.
+
+    Only the `info` section is loaded on initialization; the whole file is
+    scanned to check its syntax. Payload sections are validated and hashed
+    item by item by `validate_hashes()`.
+
+    Schemas that can not be split into per-node parts (e.g. the ones using
+    `anyOf` or `$ref`) are applied to the complete node, which is then loaded
+    into memory.
+    '''
+    __slots__ = (
+        'info',
+        '_file',
+        '_buffer',
+        '_stream',
+        '_members',
+        '_schemas',
+    )
+
+
+    def __init__(self, filename, window=None):
+        self._file = open(filename, 'rb')
+        self._buffer = None
+        try:
+            self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._load(window)
+        except Exception:
+            self.close()
+            raise
+
+
+    def _load(self, window):
+        stream = self._stream = JsonStream(self._buffer, window or WINDOW_SIZE)
+        root = stream.skip_whitespace(0)
+        members = self._members = {}
+        for key, start, end, value in stream.iter_container(root, expect='{'):
+            members[key] = Span(start, end)
+        if stream.skip_whitespace(stream.value_end(root)) != len(self._buffer):
+            raise ValueError('extra data after JSON document')
+
+        self.info = info = stream.load(members['info'])
+        schema = Schema(info['version'])
+        children = split_object_schemas(
+            compiled_schemas([schema]),
+            members,
+            lambda: stream.load(Span(root, stream.value_end(root))),
+        )
+        schemas = self._schemas = {}
+        for key, span in members.items():
+            if key != 'info' and stream.is_large(span):
+                schemas[key] = children[key]
+            else:  # small sections are validated right away
+                value = info if key == 'info' else stream.load(span)
+                for compiled, subschema in children[key]:
+                    compiled.validate_subschema(value, subschema)
+                schemas[key] = []
+        for section, identifier in info['schema'].items():
+            if section not in members:
+                raise KeyError('section not found: {}'.format(section))
+            schemas[section].extend(compiled_schemas([Schema(identifier)]))
+
+
+    def validate_hashes(self, required=('md5', 'sha256')):
+        '''
+        Validate payload sections against their schemas and check their data
+        hashes. Each section is read only once.
+        '''
+        expected = self.info['hashes']
+        actual = {}
+        for section in sorted(self._members):
+            if section == 'info':
+                continue
+            pieces = walk(self._stream, self._members[section], self._schemas[section])
+            if section in expected:
+                algorithms = set(expected[section]).union(required)
+                algorithms.discard('timestamp')
+                actual[section] = pieces_hashes(pieces, algorithms)
+            else:
+                for piece in pieces:
+                    pass
+
+        for section, hashes in expected.items():
+            if section not in actual:
+                raise HashMismatchError('hashes are given for missing section: {}'.format(section))
+            for algo, value in actual[section].items():
+                current = hashes.get(algo)
+                if current is None or current == value:
+                    continue
+                raise HashMismatchError(
+                    '{algo} hash for {section} is {value}, not {current}'.format(**locals())
+                )
+
+
+    def close(self):
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer = None
+        self._file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+
+class JsonStream:
+    '''
+    Scanner for JSON document in a bytes-like buffer (usually a memory map).
+
+    Values are decoded from windows of `window` bytes. Containers that do not
+    fit into a window are represented by their byte spans.
+    '''
+
+
+    def __init__(self, buffer, window=WINDOW_SIZE):
+        self.buffer = buffer
+        self.window = window
+        self._decoder = json.JSONDecoder()
+        self._ends = {}
+
+
+    def is_large(self, span):
+        return span.end - span.start > self.window
+
+
+    def load(self, span):
+        '''Decode value from the given span'''
+        return json.loads(self.buffer[span.start:span.end].decode('utf-8'))
+
+
+    def skip_whitespace(self, pos):
+        return _WHITESPACE_BYTES.match(self.buffer, pos).end()
+
+
+    def decode_key(self, pos):
+        '''Decode mapping key and the following colon, return the key and value position'''
+        match = _STRING.match(self.buffer, pos)
+        if not match:
+            raise ValueError('expected mapping key at {}'.format(pos))
+        key = json.loads(match.group().decode('utf-8'))
+        pos = self.skip_whitespace(match.end())
+        if self.buffer[pos:pos + 1] != b':':
+            raise ValueError('expected ":" at {}'.format(pos))
+        return key, self.skip_whitespace(pos + 1)
+
+
+    def value_end(self, pos):
+        '''Find where the value starting at `pos` ends'''
+        try:
+            return self._ends[pos]
+        except KeyError:
+            pass
+        first = self.buffer[pos:pos + 1]
+        if first in (b'{', b'['):
+            for child in self.iter_container(pos, spans=False):
+                pass
+        elif first == b'"':
+            match = _STRING.match(self.buffer, pos)
+            if not match:
+                raise ValueError('unterminated string at {}'.format(pos))
+            self._ends[pos] = match.end()
+        else:
+            match = _LITERAL.match(self.buffer, pos)
+            json.loads(match.group().decode('utf-8'))  # check syntax
+            self._ends[pos] = match.end()
+        return self._ends[pos]
+
+
+    def iter_container(self, pos, expect=None, spans=True):
+        '''
+        Iterate over children of JSON object or array that starts at `pos`.
+
+        Yield tuples of (key, start, end, value) for each child. Key is None
+        for array items. Value is decoded only if it is small enough to fit
+        into a window, otherwise it is a placeholder and the child must be
+        visited separately. Byte spans of decoded children are calculated
+        only if `spans` is True (None is yielded otherwise).
+        '''
+        opening = self.buffer[pos:pos + 1]
+        if opening not in (b'{', b'['):
+            raise ValueError('expected JSON container at {}'.format(pos))
+        if expect and opening != expect.encode():
+            raise ValueError('expected {!r} at {}'.format(expect, pos))
+        is_dict = opening == b'{'
+        closing = '}' if is_dict else ']'
+        delimiters = (',', closing)
+        raw_decode = self._decoder.raw_decode
+        whitespace = _WHITESPACE.match
+
+        window = Window(self, self.skip_whitespace(pos + 1))
+        text = window.text
+        if text[:1] == closing:
+            self._ends[pos] = window.offset(1)
+            return
+        index = 0
+        key = start = end = None
+        while True:
+            child = index
+            try:
+                if is_dict:
+                    if text[index:index + 1] != '"':
+                        raise ValueError('expected mapping key at {}'.format(window.offset(index)))
+                    key, index = raw_decode(text, index)
+                    index = whitespace(text, index).end()
+                    if text[index:index + 1] != ':':
+                        raise ValueError('expected ":" at {}'.format(window.offset(index)))
+                    index = whitespace(text, index + 1).end()
+                value, value_end = raw_decode(text, index)
+                delimiter = whitespace(text, value_end).end()
+                if text[delimiter:delimiter + 1] not in delimiters:
+                    # Numbers and literals may be cut at the end of window
+                    raise ValueError('expected "," or "{}" at {}'.format(
+                        closing, window.offset(delimiter)))
+            except ValueError:
+                if window.final:
+                    raise
+                if child > 0:  # retry with the window starting at this child
+                    window = Window(self, self.skip_whitespace(window.offset(child)))
+                    text = window.text
+                    index = 0
+                    continue
+                # Child does not fit into a window
+                start = self.skip_whitespace(window.base)
+                if is_dict:
+                    key, start = self.decode_key(start)
+                end = self.value_end(start)
+                value = _LARGE
+                window = Window(self, self.skip_whitespace(end))
+                text = window.text
+                delimiter = 0
+            else:
+                if spans:
+                    start, end = window.offset(index), window.offset(value_end)
+            yield key, start, end, value
+
+            if text[delimiter:delimiter + 1] == closing:
+                self._ends[pos] = window.offset(delimiter + 1)
+                return
+            if text[delimiter:delimiter + 1] != ',':
+                raise ValueError('expected "," or "{}" at {}'.format(
+                    closing, window.offset(delimiter)))
+            index = whitespace(text, delimiter + 1).end()
+
+
+
+class Window:
+    '''Decoded text of a part of JSON stream'''
+
+
+    def __init__(self, stream, base):
+        self.base = base
+        chunk = stream.buffer[base:base + stream.window]
+        self.final = base + len(chunk) >= len(stream.buffer)
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = decoder.decode(chunk, self.final)
+        consumed = len(chunk) - len(decoder.getstate()[0])
+        self.ascii = consumed == len(self.text)
+        self._position = (0, 0)  # last known (char index, byte offset) pair
+
+
+    def offset(self, index):
+        '''Convert character index into byte offset in the buffer'''
+        if self.ascii:
+            return self.base + index
+        known_index, known_offset = self._position
+        if index < known_index:
+            known_index, known_offset = 0, 0
+        known_offset += len(self.text[known_index:index].encode('utf-8'))
+        self._position = (index, known_offset)
+        return self.base + known_offset
+
+
+
+def walk(stream, node, schemas):
+    '''
+    Validate JSON node and yield its canonical JSON representation piece by
+    piece. Node is either a decoded value or a Span in stream.
+    '''
+    schemas = [(compiled, schema) for compiled, schema in schemas if schema is not True]
+    if isinstance(node, Span) and not stream.is_large(node):
+        node = stream.load(node)
+    if not isinstance(node, Span):
+        for compiled, schema in schemas:
+            compiled.validate_subschema(node, schema)
+        yield from iter_canonical(node)
+        return
+
+    first = stream.buffer[node.start:node.start + 1]
+    if first == b'{':
+        yield from walk_object(stream, node, schemas)
+    elif first == b'[':
+        yield from walk_array(stream, node, schemas)
+    else:  # long string
+        yield from walk(stream, stream.load(node), schemas)
+
+
+def walk_object(stream, node, schemas):
+    members = {}
+    for key, start, end, value in stream.iter_container(node.start):
+        members[key] = Span(start, end)
+    children = split_object_schemas(schemas, members, lambda: stream.load(node))
+    separator = '{'
+    for key in sorted(members):
+        yield separator
+        separator = ','
+        yield encode_key(key)
+        yield ':'
+        yield from walk(stream, members[key], children[key])
+    if separator == '{':
+        yield separator
+    yield '}'
+
+
+def walk_array(stream, node, schemas):
+    scopes = []
+    for compiled, schema in schemas:
+        scope = get_items_scope(compiled, schema)
+        if scope is None or PLACEHOLDER_UNSAFE.intersection(scope.schema):
+            compiled.validate_subschema(stream.load(node), schema)
+        else:
+            scopes.append((compiled, scope))
+
+    yield '['
+    separator = ''
+    batch = []
+    count = 0
+    for key, start, end, value in stream.iter_container(node.start, spans=False):
+        item_schemas = []
+        for compiled, scope in scopes:
+            prefix, rest = scope.children
+            subschema = prefix[count] if count < len(prefix) else rest
+            if subschema is not None:
+                item_schemas.append((compiled, subschema))
+        count += 1
+        if value is not _LARGE:
+            for compiled, subschema in item_schemas:
+                if subschema is not True:
+                    compiled.validate_subschema(value, subschema)
+            batch.append(value)
+            if len(batch) < BATCH_SIZE:
+                continue
+        if batch:
+            yield separator
+            yield encode_batch(batch, is_dict=False)
+            separator = ','
+            batch = []
+        if value is _LARGE:
+            yield separator
+            yield from walk(stream, Span(start, end), item_schemas)
+            separator = ','
+    if batch:
+        yield separator
+        yield encode_batch(batch, is_dict=False)
+    yield ']'
+
+    placeholder = [None] * count
+    for compiled, scope in scopes:
+        compiled.validate_subschema(placeholder, scope.schema)
+
+
+def split_object_schemas(schemas, keys, load):
+    '''
+    Validate the structure of a mapping with given keys and return the lists
+    of subschemas for each of its values.
+
+    Schemas that can not be split are applied to the complete mapping, which
+    is obtained by calling `load()`.
+    '''
+    children = {key: [] for key in keys}
+    placeholder = dict.fromkeys(keys)
+    for compiled, schema in schemas:
+        if schema is True:
+            continue
+        scopes = {key: get_scope(compiled, schema, key) for key in keys}
+        if not keys or any(
+            scope is None or PLACEHOLDER_UNSAFE.intersection(scope.schema)
+            for scope in scopes.values()
+        ):
+            compiled.validate_subschema(load(), schema)
+            continue
+        compiled.validate_subschema(placeholder, next(iter(scopes.values())).schema)
+        for key, scope in scopes.items():
+            children[key].extend((compiled, child) for child in scope.children)
+    return children
+
+
+def compiled_schemas(schemas):
+    '''Convert Schema objects into (compiled, subschema) pairs'''
+    return [(schema._compiled, schema.parsed) for schema in schemas if schema.parsed is not None]
+
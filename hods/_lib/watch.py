@@ -0,0 +1,330 @@
+'''
+Watching metadata files for changes
+
+On Linux inotify is used (via ctypes, no extra dependencies are required),
+on other platforms and when inotify is not available file stats are polled
+periodically. Both watchers apply the same filters as `scan_files()`:
+patterns from `.hodsignore` files and include/exclude patterns.
+
+    with get_watcher(recursive=True) as watcher:
+        check(watcher.files)
+        for changed in watcher:
+            check(changed)
+'''
+
+
+import ctypes
+import errno
+import os
+import select
+import struct
+import sys
+import time
+from functools import partial
+
+from hods._lib.cache import get_stat, stat_tuple
+from hods._lib.files import (
+    IGNORE_FILENAME,
+    ScanFilters,
+    ScanTarget,
+    is_metadata,
+    is_wanted_directory,
+    is_wanted_file,
+    local_ignore,
+    parse_patterns,
+    scan_directory,
+    scan_files,
+)
+
+
+DEBOUNCE = 0.2  # seconds of silence that end a burst of events
+MAX_BURST = 2.0  # changes are reported at least this often during long bursts
+POLL_INTERVAL = 1.0
+
+
+def get_watcher(directory='.', recursive=False, include=(), exclude=(), files=None):
+    '''
+    Return the best watcher available on current platform. If the list of
+    `files` is given, only these files are watched.
+    '''
+    if files is None:
+        try:
+            return InotifyWatcher(directory, recursive, include, exclude)
+        except OSError:
+            pass
+    return PollingWatcher(directory, recursive, include, exclude, files)
+
+
+
+class Watcher:
+    '''
+    Base class for file watchers.
+
+    `files` attribute contains the paths of metadata files that were found
+    when the watcher was created. Subclasses implement `poll()`.
+    '''
+
+
+    def poll(self, timeout=None):
+        '''
+        Wait up to `timeout` seconds (forever if None) for changes. Return the
+        set of paths that might have changed, empty set on timeout.
+        '''
+        raise NotImplementedError
+
+
+    def changes(self, debounce=DEBOUNCE, timeout=None):
+        '''
+        Wait for changes and return the set of changed metadata files.
+
+        Changes that follow each other within `debounce` seconds are collected
+        into a single set, so that a file written in several steps or a batch
+        of files written together is reported once. Removed files are not
+        reported. Return empty set if nothing changed within `timeout`.
+        '''
+        changed = self.poll(timeout)
+        if changed:
+            started = time.monotonic()
+            while time.monotonic() - started < MAX_BURST:
+                more = self.poll(debounce)
+                if not more:
+                    break
+                changed.update(more)
+        return {path for path in changed if os.path.isfile(path)}
+
+
+    def close(self):
+        pass
+
+
+    def __iter__(self):
+        '''Yield sets of changed files forever'''
+        while True:
+            changed = self.changes()
+            if changed:
+                yield changed
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+
+class PollingWatcher(Watcher):
+    '''
+    Detects changes by comparing size, modification time and inode number of
+    files (the same values as VerificationCache does) every `interval`
+    seconds. Works everywhere, but each poll scans the whole directory tree.
+    '''
+
+
+    def __init__(self, directory='.', recursive=False, include=(), exclude=(),
+                 files=None, interval=POLL_INTERVAL):
+        self.interval = interval
+        if files is None:
+            self._scan = partial(scan_files, directory, recursive, include, exclude)
+        else:
+            files = list(files)
+            self._scan = lambda: files
+        self._snapshot = self._take_snapshot()
+        self.files = set(self._snapshot)
+
+
+    def _take_snapshot(self):
+        snapshot = {}
+        for entry in self._scan():
+            stat = get_stat(entry)
+            if stat is not None:
+                snapshot[getattr(entry, 'path', entry)] = stat_tuple(stat)
+        return snapshot
+
+
+    def poll(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, deadline - time.monotonic())
+            if delay > 0:
+                time.sleep(delay)
+            snapshot = self._take_snapshot()
+            changed = set(
+                path for path, values in snapshot.items()
+                if self._snapshot.get(path) != values
+            )
+            self._snapshot = snapshot
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE \
+           | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+READ_SIZE = 64 * 1024
+
+
+class InotifyWatcher(Watcher):
+    '''
+    Receives change notifications from Linux kernel. Each watched directory
+    is registered with its ignore patterns, so events are filtered without
+    touching the filesystem.
+
+    New subdirectories are watched as soon as they appear. If the kernel
+    event queue overflows or `.hodsignore` file changes, the tree is scanned
+    again and all files are reported as changed.
+
+    Raises OSError if inotify is not available.
+    '''
+
+
+    def __init__(self, directory='.', recursive=False, include=(), exclude=()):
+        self.directory = directory
+        self.filters = ScanFilters(
+            include=parse_patterns(include),
+            exclude=parse_patterns(exclude),
+            recursive=recursive,
+        )
+        self._libc = load_libc()
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise_errno('inotify_init1')
+        self._targets = {}  # watch descriptor -> ScanTarget
+        try:
+            self.files = self.rescan()
+        except Exception:
+            self.close()
+            raise
+
+
+    def rescan(self):
+        '''Watch the whole directory tree again, return all metadata files'''
+        previous = self._targets
+        self._targets = {}
+        files = self._watch(ScanTarget(path=self.directory, relative='', ignore=()))
+        for wd in set(previous) - set(self._targets):
+            self._libc.inotify_rm_watch(self._fd, wd)
+        return files
+
+
+    def _watch(self, root):
+        '''Watch directory and its subdirectories, return metadata files in them'''
+        files = set()
+        pending = [root]
+        while pending:
+            target = pending.pop()
+            # watch first, then scan: files created in between are not missed
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(target.path), WATCH_MASK)
+            if wd < 0:
+                if ctypes.get_errno() == errno.ENOSPC:  # out of watches
+                    raise_errno('inotify_add_watch')
+                continue  # directory was removed or is not readable
+            entries, directories = scan_directory(target, self.filters)
+            self._targets[wd] = target._replace(ignore=local_ignore(target))
+            files.update(entry.path for entry in entries)
+            pending.extend(directories)
+        return files
+
+
+    def poll(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        changed = set()
+        while not changed:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.monotonic())
+            ready, _, _ = select.select([self._fd], [], [], remaining)
+            if ready:
+                changed.update(self._process(self._read_events()))
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        return changed
+
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            yield wd, mask, os.fsdecode(name)
+
+
+    def _process(self, events):
+        '''Convert inotify events to the set of changed paths'''
+        changed = set()
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                changed.update(self.rescan())
+                continue
+            target = self._targets.get(wd)
+            if target is None:
+                continue
+            if mask & (IN_IGNORED | IN_DELETE_SELF):  # watched directory is gone
+                self._targets.pop(wd)
+                continue
+            relative = target.relative + name
+            if mask & IN_ISDIR:
+                if not self.filters.recursive:
+                    continue
+                if mask & IN_MOVED_FROM:  # paths of watched subdirectories are stale now
+                    changed.update(self.rescan())
+                elif mask & (IN_CREATE | IN_MOVED_TO) \
+                and is_wanted_directory(relative, target.ignore, self.filters):
+                    changed.update(self._watch(ScanTarget(
+                        path=os.path.join(target.path, name),
+                        relative=relative + '/',
+                        ignore=target.ignore,
+                    )))
+            elif name == IGNORE_FILENAME:
+                changed.update(self.rescan())
+            elif is_metadata(name) and is_wanted_file(relative, target.ignore, self.filters):
+                changed.add(os.path.join(target.path, name))
+        return changed
+
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+
+def load_libc():
+    '''Load C library functions required for inotify'''
+    if not sys.platform.startswith('linux'):
+        raise OSError('inotify is not supported on {}'.format(sys.platform))
+    libc = ctypes.CDLL(None, use_errno=True)
+    try:
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except AttributeError:
+        raise OSError('inotify functions are not available in C library')
+    return libc
+
+
+def raise_errno(function):
+    error = ctypes.get_errno()
+    raise OSError(error, '{}: {}'.format(function, os.strerror(error)))
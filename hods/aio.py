@@ -0,0 +1,310 @@
+'''
+Asynchronous API for loading and verifying many metadata files
+
+File reading, parsing and validation are performed in a bounded thread pool,
+so the event loop is never blocked:
+
+    from hods import aio
+
+    async def ingest(filenames):
+        async with aio.load_many(filenames, verify=True) as results:
+            async for filename, result in results:
+                if isinstance(result, Exception):
+                    ...
+
+Schemas used by concurrently loaded files are fetched only once per
+identifier.
+'''
+
+
+import asyncio
+import os
+import weakref
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from hods import Metadata
+from hods._lib.files import get_object
+from hods._lib.schemas import Schema, registry, restore_full_schema_id
+
+
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+
+class AsyncLoader:
+    '''
+    Loads metadata files in a bounded executor without blocking the event
+    loop. If no executor is provided, a thread pool with `workers` threads is
+    created on first use (and shut down by `close()`).
+
+    Unless `loop` is provided, the event loop that runs the calling coroutine
+    is used, so the loader may be created outside of a coroutine.
+    '''
+
+
+    def __init__(self, workers=DEFAULT_WORKERS, executor=None, loop=None):
+        self._loop = loop
+        self._own_executor = executor is None
+        self._executor = executor
+        if executor is not None:
+            workers = getattr(executor, '_max_workers', workers)
+        self.workers = workers
+        self._schemas = {}  # schemas that are being fetched right now
+
+
+    @property
+    def loop(self):
+        return self._loop or running_loop()
+
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+
+    def run(self, function, *args, **kwargs):
+        '''Execute function in the executor, return awaitable result'''
+        return self.loop.run_in_executor(self.executor, partial(function, *args, **kwargs))
+
+
+    async def schema(self, identifier, engine='jsonschema'):
+        '''
+        Get Schema object. Concurrent requests for the same schema are served
+        by a single fetch.
+        '''
+        if not identifier:
+            return Schema(identifier, engine)
+        identifier = restore_full_schema_id(identifier)
+        key = (identifier, engine)
+        if key in registry:
+            return Schema(identifier, engine)
+        future = self._schemas.get(key)
+        if future is None:
+            future = self._schemas[key] = asyncio.ensure_future(
+                self.run(Schema, identifier, engine),
+                loop=self.loop,
+            )
+            future.add_done_callback(lambda _: self._schemas.pop(key, None))
+        return await asyncio.shield(future)
+
+
+    async def load(self, filename, fileformat=None, readonly=False, verify=False):
+        '''
+        Load Metadata object from file. If `verify` is True, data hashes are
+        checked too (HashMismatchError is raised for invalid files).
+        '''
+        data = await self.run(get_object, filename, fileformat, readonly)
+        if not is_metadata_object(data):
+            raise ValueError('not a metadata file: {}'.format(filename))
+        await asyncio.gather(*(self.schema(identifier) for identifier in schema_ids(data)))
+        return await self.run(build, data, filename, fileformat, readonly, verify)
+
+
+    def load_many(self, filenames, limit=None, **kwargs):
+        '''
+        Load multiple files concurrently. Return asynchronous iterator of
+        (filename, result) pairs in order of completion, see LoadResults.
+        Keyword arguments are passed to `load()`.
+        '''
+        return LoadResults(self, filenames, limit, kwargs)
+
+
+    def close(self):
+        if self._own_executor and self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+
+class LoadResults:
+    '''
+    Asynchronous iterator over results of loading multiple files.
+
+    Results are (filename, Metadata) pairs for successfully loaded files and
+    (filename, exception) pairs for failures. At most `limit` files are
+    processed at once, and new files are scheduled only when the results are
+    consumed, so a slow consumer does not cause unbounded memory usage.
+    Filenames may be provided by a lazy iterable.
+
+    Pending operations are cancelled by `aclose()` (called automatically when
+    used as asynchronous context manager) or when the consuming task is
+    cancelled.
+    '''
+
+
+    def __init__(self, loader, filenames, limit=None, options=None):
+        self.loader = loader
+        if limit is None:
+            limit = loader.workers
+        self.limit = limit
+        self.options = options or {}
+        self._filenames = iter(filenames)
+        self._pending = {}  # task -> filename
+        self._done = deque()
+        self._exhausted = False
+
+
+    def _schedule(self):
+        while not self._exhausted and len(self._pending) + len(self._done) < self.limit:
+            try:
+                filename = next(self._filenames)
+            except StopIteration:
+                self._exhausted = True
+                break
+            task = asyncio.ensure_future(
+                self.loader.load(filename, **self.options),
+                loop=self.loader.loop,
+            )
+            self._pending[task] = filename
+
+
+    def __aiter__(self):
+        return self
+
+
+    async def __anext__(self):
+        self._schedule()
+        if not self._done:
+            if not self._pending:
+                raise StopAsyncIteration
+            try:
+                done, _ = await asyncio.wait(
+                    list(self._pending),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+            except asyncio.CancelledError:
+                self.cancel()
+                raise
+            for task in done:
+                filename = self._pending.pop(task)
+                if task.cancelled():
+                    result = asyncio.CancelledError()
+                else:
+                    result = task.exception() or task.result()
+                self._done.append((filename, result))
+        return self._done.popleft()
+
+
+    def cancel(self):
+        '''Cancel pending operations and skip files that were not scheduled yet'''
+        self._exhausted = True
+        for task in self._pending:
+            task.cancel()
+        self._pending.clear()
+
+
+    async def aclose(self):
+        self.cancel()
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, *exc_info):
+        self.cancel()
+
+
+
+async def load(filename, fileformat=None, readonly=False, verify=False):
+    '''Load a single metadata file without blocking the event loop'''
+    async with AsyncLoader(workers=1) as loader:
+        return await loader.load(filename, fileformat, readonly, verify)
+
+
+def load_many(filenames, workers=DEFAULT_WORKERS, limit=None, **kwargs):
+    '''
+    Load multiple files concurrently in a dedicated thread pool. Return
+    asynchronous iterator of (filename, result) pairs, see LoadResults.
+    The thread pool is shut down when iteration is finished or cancelled.
+    '''
+    loader = AsyncLoader(workers=workers)
+    return _OwningResults(loader, filenames, limit, kwargs)
+
+
+
+class _OwningResults(LoadResults):
+    '''
+    LoadResults that close their loader when finished. If iteration is
+    abandoned (e.g. `break` out of `async for` without `async with`), pending
+    operations are cancelled and the loader is closed when the results object
+    is garbage collected.
+    '''
+
+
+    def __init__(self, loader, filenames, limit=None, options=None):
+        super().__init__(loader, filenames, limit, options)
+        weakref.finalize(self, abandon, self._pending, loader)
+
+
+    async def __anext__(self):
+        try:
+            return await super().__anext__()
+        except (StopAsyncIteration, asyncio.CancelledError):
+            self.loader.close()
+            raise
+
+
+    def cancel(self):
+        super().cancel()
+        self.loader.close()
+
+
+
+def abandon(pending, loader):
+    '''Cancel pending tasks and close the loader of unfinished LoadResults'''
+    for task in pending:
+        try:
+            task.cancel()
+        except RuntimeError:  # event loop is closed already
+            pass
+    pending.clear()
+    loader.close()
+
+
+def running_loop():
+    '''Return the event loop of the current coroutine'''
+    try:
+        get_running_loop = asyncio.get_running_loop
+    except AttributeError:  # Python < 3.7
+        return asyncio.get_event_loop()
+    return get_running_loop()
+
+
+def build(data, filename, fileformat=None, readonly=False, verify=False):
+    '''Create Metadata object from loaded data (executed in worker thread)'''
+    meta = Metadata(data, filename=filename, fileformat=fileformat, readonly=readonly)
+    if verify:
+        meta.validate_hashes()
+    return meta
+
+
+def schema_ids(data):
+    '''Return the set of schema identifiers used by a metadata document'''
+    info = data['info']
+    identifiers = {info.get('version')}
+    schemas = info.get('schema')
+    if isinstance(schemas, Mapping):
+        identifiers.update(value for value in schemas.values() if isinstance(value, str))
+    identifiers.discard(None)
+    identifiers.discard('')
+    return identifiers
+
+
+def is_metadata_object(data):
+    try:
+        return isinstance(data['info']['version'], str)
+    except Exception:
+        return False
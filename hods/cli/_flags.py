@@ -4,3 +4,13 @@ subcommands
 '''
 
 RECURSIVE= '--recursive'
+JOBS = '--jobs='
+NO_CACHE = '--no-cache'
+PARANOID = '--paranoid'
+INCLUDE = '--include='
+EXCLUDE = '--exclude='
+PROFILE = '--profile'
+PROFILE_JSON = '--profile-json='
+WATCH = '--watch'
+PATHS = '--paths='
+SCHEMA = '--schema='
@@ -0,0 +1,65 @@
+'''
+Commandline interface to the profiler: `--profile` and `--profile-json=FILE`
+flags shared by subcommands
+'''
+
+
+import sys
+from contextlib import contextmanager
+from functools import wraps
+
+from hods._lib.profile import Profiler
+import hods.cli._flags as flags
+
+
+@contextmanager
+def profile_session(args):
+    '''
+    Enable profiler if requested by commandline flags. Recognized flags are
+    removed from `args` list in place. Yield Profiler or None.
+
+    The report is printed to stderr and/or saved to JSON file when leaving
+    the context.
+    '''
+    show = False
+    dump = None
+    for arg in list(args[2:]):
+        if arg == flags.PROFILE:
+            show = True
+            args.remove(arg)
+        elif arg.startswith(flags.PROFILE_JSON):
+            dump = arg.replace(flags.PROFILE_JSON, '', 1)
+            args.remove(arg)
+
+    if not show and not dump:
+        yield None
+        return
+
+    profiler = Profiler()
+    try:
+        with profiler.activate():
+            yield profiler
+    finally:
+        if dump:
+            profiler.dump(dump)
+        if show:
+            print(profiler.format(), file=sys.stderr, flush=True)
+
+
+def profiled_main(main):
+    '''
+    Decorator for subcommand entry points. The wrapped `main(args, profiler)`
+    receives commandline arguments padded the usual way (two leading and two
+    trailing empty strings) without profiler flags, and is executed inside
+    profile_session(). The resulting function accepts arguments like other
+    entry points: `main(*args)` or `main()` to use sys.argv.
+    '''
+    @wraps(main)
+    def wrapper(*args):
+        if args:
+            args = ['', ''] + list(args) + ['', '']
+        else:
+            args = sys.argv + ['', '']
+        with profile_session(args) as profiler:
+            return main(args, profiler)
+    return wrapper
@@ -1,12 +1,39 @@
 '''
 Usage:
-    {hods} {subcommand} [--recursive] [FILENAME1] [FILENAME2] ...
+    {hods} {subcommand} [--recursive] [--jobs=N] [--no-cache|--paranoid]
+            [--include=GLOB] [--exclude=GLOB] [--watch]
+            [--profile] [--profile-json=FILE] [FILENAME1] [FILENAME2] ...
 
 Check hash values and validate schemas for metadata file(s).
+
+Files are checked in N parallel processes (default: number of CPUs).
+Invalid values of N are reported with exit code 2.
+
+If no files are given, metadata files in current directory are checked.
+Files and directories matching patterns from `.hodsignore` files or from
+`--exclude` flags are skipped. If `--include` flags are given, only matching
+files are checked. Flags may be repeated.
+
+Files that passed the check before and were not modified since then are
+skipped. Results are cached in `.hods-cache` file in current directory.
+Use `--no-cache` or `--paranoid` to verify all files anyway.
+
+Large JSON files are verified without loading them into memory.
+
+With `--watch` all files are checked once, and then the files that change
+are checked again as soon as they are written, until interrupted with
+Ctrl+C. Exit code reflects the status of the files at that moment.
+
+Use `--profile` to print the time spent in each phase of the check and the
+slowest files to stderr, and `--profile-json=FILE` to save the same report
+in JSON format.
 '''
 
 
+import os
 import sys
+from itertools import chain
+from multiprocessing import Pool
 from urllib.error import HTTPError
 
 from hods import (
@@ -14,51 +41,248 @@ from hods import (
     ValidationErrors,
     HashMismatchError,
 )
-from hods._lib.files import get_files
+from hods._lib.cache import VerificationCache, get_stat
+from hods._lib.files import SCAN_THREADS, detect_format, scan_files
+from hods._lib.profile import Profiler, count
+from hods._lib.schemas import Schema
+from hods._lib.stream import StreamingMetadata
+from hods._lib.watch import get_watcher
+from hods.cli._profile import profiled_main
 import hods.cli._flags as flags
 
 
-def main(*args):
-    if args:
-        args = ['', ''] + list(args) + ['', '']
-    else:
-        args = sys.argv + ['', '']
+OK = 'OK'
+CHUNK_SIZE = 16  # number of files sent to a worker process at once
+STREAMING_THRESHOLD = 64 * 1024 * 1024  # larger JSON files are not loaded into memory
+
 
+@profiled_main
+def main(args, profiler=None):
     if flags.RECURSIVE in args:
         recursive = True
         args.pop(args.index(flags.RECURSIVE))
     else:
         recursive = False
 
+    use_cache = True
+    for flag in (flags.NO_CACHE, flags.PARANOID):
+        if flag in args:
+            use_cache = False
+            args.remove(flag)
+
+    jobs = os.cpu_count() or 1
+    for arg in args[2:]:
+        if arg.startswith(flags.JOBS):
+            value = arg.replace(flags.JOBS, '', 1)
+            jobs = int(value) if value.isdigit() else 0
+            if jobs < 1:
+                print(
+                    'Invalid number of jobs: {!r} (positive integer expected)'.format(value),
+                    file=sys.stderr,
+                    flush=True,
+                )
+                sys.exit(2)
+            args.remove(arg)
+            break
+
+    if flags.WATCH in args:
+        watch = True
+        args.remove(flags.WATCH)
+    else:
+        watch = False
+
+    include, exclude = [], []
+    for arg in args[2:]:
+        if arg.startswith(flags.INCLUDE):
+            include.append(arg.replace(flags.INCLUDE, '', 1))
+        elif arg.startswith(flags.EXCLUDE):
+            exclude.append(arg.replace(flags.EXCLUDE, '', 1))
+    args = [a for a in args if not a.startswith((flags.INCLUDE, flags.EXCLUDE))]
+
     files = set(a for a in args[2:] if a)
-    if not files: files = get_files(recursive=recursive)
+    watcher = None
+    if watch:  # watcher scans the directory tree itself
+        watcher = get_watcher(
+            recursive=recursive,
+            include=include,
+            exclude=exclude,
+            files=files or None,
+        )
+        if not files:
+            files = watcher.files
+    elif not files:
+        files = scan_files(
+            recursive=recursive,
+            include=include,
+            exclude=exclude,
+            jobs=SCAN_THREADS,
+        )
+
+    failed = set()
+    cache = VerificationCache() if use_cache else None
+    pool = None
+    try:
+        if watch and jobs > 1:  # keep schemas loaded in workers between changes
+            pool = Pool(jobs, initializer=warm_up)
+        batches = [files] if watcher is None else chain([files], watcher)
+        for batch in batches:
+            for filename, status in check_files(batch, jobs, cache, profiler, pool):
+                print('Checking {}: {}'.format(filename, status), flush=True)
+                if status == OK:
+                    failed.discard(filename)
+                else:
+                    failed.add(filename)
+            if cache:
+                cache.commit()
+    except KeyboardInterrupt:
+        if watcher is None:
+            raise
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if watcher is not None:
+            watcher.close()
+        if cache:
+            cache.close()
+    if failed:
+        sys.exit(1)
+
 
-    exit_code = 0
+def check_files(files, jobs=1, cache=None, profiler=None, pool=None):
+    '''
+    Check multiple files in parallel. Yield pairs of filename and status
+    sorted by filename. Files may be given as paths or as os.DirEntry objects.
+
+    If VerificationCache is provided, unchanged files that passed the check
+    before are not verified again.
+
+    If Profiler is provided, measurements from worker processes are merged
+    into it.
+
+    If multiprocessing Pool is provided, files are checked in it instead of
+    a new pool, and the pool is left running.
+    '''
+    entries = {getattr(item, 'path', item): item for item in files}
+    files = sorted(entries)
+    stats = {}
+    pending = []
     for filename in files:
-        print('Checking {}: '.format(filename), end='')
-        meta = None
-        try:
-            meta = Metadata(filename=filename)
-        except ValidationErrors:
-            print('SCHEMA ERROR')
-            exit_code = 1
-        except FileNotFoundError:
-            print('FILE NOT FOUND')
-            exit_code = 1
-        except HTTPError:
-            print('HTTP ERROR')
-            exit_code = 1
-        except Exception:
-            print('PARSE ERROR')
-            exit_code = 1
-
-        if not meta: continue
+        if cache is not None:
+            stat = stats[filename] = get_stat(entries[filename])
+            if cache.is_verified(filename, stat):
+                count('cached files')
+                continue
+        pending.append(filename)
+
+    worker = verify if profiler is None else verify_profiled
+    own_pool = None
+    jobs = min(jobs, len(pending))
+    if jobs <= 1:
+        results = map(worker, pending)
+    else:
+        if pool is None:
+            pool = own_pool = Pool(jobs, initializer=warm_up)
+        results = pool.imap(worker, pending, chunksize=CHUNK_SIZE)
+
+    try:
+        pending = set(pending)
+        for filename in files:
+            if filename not in pending:
+                yield filename, OK
+                continue
+            if profiler is None:
+                status, schemas = next(results)
+            else:
+                status, schemas, report = next(results)
+                profiler.merge(report)
+            if cache is not None:
+                cache.record(filename, stats[filename], schemas, status)
+            yield filename, status
+    finally:
+        if own_pool is not None:
+            own_pool.terminate()
+
+
+def check(filename):
+    '''Check a single metadata file and return its status'''
+    return verify(filename)[0]
+
+
+def verify(filename):
+    '''
+    Check a single metadata file. Return its status and the list of schema
+    identifiers used by the file
+    '''
+    if is_large_json(filename):
+        return verify_streaming(filename)
+    schemas = ()
+    try:
+        # Plain YAML loader does not enforce StrictYAML restrictions
+        readonly = detect_format(filename) != 'StrictYAML'
+        meta = Metadata(filename=filename, readonly=readonly)
+    except ValidationErrors:
+        return 'SCHEMA ERROR', schemas
+    except FileNotFoundError:
+        return 'FILE NOT FOUND', schemas
+    except HTTPError:
+        return 'HTTP ERROR', schemas
+    except Exception:
+        return 'PARSE ERROR', schemas
+
+    schemas = [meta.info.version]
+    schemas.extend(meta.info.schema[section] for section in meta.info.schema)
+    try:
+        meta.validate_hashes()
+    except HashMismatchError:
+        return 'HASH ERROR', schemas
+    return OK, schemas
 
+
+def verify_profiled(filename):
+    '''Same as verify(), but also return the report of a dedicated profiler'''
+    profiler = Profiler()
+    with profiler.activate(), profiler.track_file(filename):
+        status, schemas = verify(filename)
+    return status, schemas, profiler.report()
+
+
+def verify_streaming(filename):
+    '''Same as verify(), but the file is not loaded into memory as a whole'''
+    schemas = ()
+    try:
+        meta = StreamingMetadata(filename)
+    except ValidationErrors:
+        return 'SCHEMA ERROR', schemas
+    except FileNotFoundError:
+        return 'FILE NOT FOUND', schemas
+    except HTTPError:
+        return 'HTTP ERROR', schemas
+    except Exception:
+        return 'PARSE ERROR', schemas
+
+    with meta:
+        schemas = [meta.info['version']]
+        schemas.extend(meta.info['schema'].values())
         try:
             meta.validate_hashes()
-            print('OK')
+        except ValidationErrors:
+            return 'SCHEMA ERROR', schemas
         except HashMismatchError:
-            print('HASH ERROR')
-            exit_code = 1
-    if exit_code:
-        sys.exit(exit_code)
+            return 'HASH ERROR', schemas
+        except ValueError:
+            return 'PARSE ERROR', schemas
+    return OK, schemas
+
+
+def is_large_json(filename):
+    '''Check if the file should be verified in streaming mode'''
+    try:
+        return detect_format(filename) == 'JSON' \
+           and os.path.getsize(filename) >= STREAMING_THRESHOLD
+    except (ValueError, OSError):
+        return False
+
+
+def warm_up():
+    '''Load frequently used schemas into the worker process'''
+    Schema(Metadata().info.version)
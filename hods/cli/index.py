@@ -0,0 +1,59 @@
+'''
+Usage:
+    {hods} {subcommand} [--recursive] [--include=GLOB] [--exclude=GLOB]
+            [--paths=PREFIX,...] [--profile] [--profile-json=FILE]
+
+Build or update the index of metadata files in current directory.
+
+The index is stored in `.hods-index` file and is used by `query` subcommand.
+Only files that were changed since the previous run are read again, files
+that no longer exist are removed from the index.
+
+Schema identifiers, stored hash values and all scalar values from data
+sections are indexed. Use `--paths` to index only values under given dotted
+path prefixes (e.g. `--paths=data.year,data.artist`). All files are read
+again if the selected paths differ from the previous run.
+
+Use `--profile` or `--profile-json=FILE` to measure where the time is spent
+(see `check` subcommand).
+'''
+
+
+import sqlite3
+import sys
+
+from hods._lib.files import SCAN_THREADS, scan_files
+from hods._lib.index import MetadataIndex
+from hods.cli._profile import profiled_main
+import hods.cli._flags as flags
+
+
+@profiled_main
+def main(args, profiler=None):
+    recursive = flags.RECURSIVE in args
+
+    include, exclude, paths = [], [], []
+    for arg in args[2:]:
+        if arg.startswith(flags.INCLUDE):
+            include.append(arg.replace(flags.INCLUDE, '', 1))
+        elif arg.startswith(flags.EXCLUDE):
+            exclude.append(arg.replace(flags.EXCLUDE, '', 1))
+        elif arg.startswith(flags.PATHS):
+            paths.extend(p for p in arg.replace(flags.PATHS, '', 1).split(',') if p)
+
+    files = scan_files(
+        recursive=recursive,
+        include=include,
+        exclude=exclude,
+        jobs=SCAN_THREADS,
+    )
+    try:
+        with MetadataIndex() as index:
+            stats = index.update(files, paths=paths)
+            total = len(index)
+    except (OSError, sqlite3.Error) as error:
+        print('Can not update index: {}'.format(error), file=sys.stderr, flush=True)
+        sys.exit(1)
+    print('Indexed {} files: {} updated, {} removed, {} failed'.format(
+        total, stats.updated, stats.removed, stats.failed
+    ))
@@ -0,0 +1,58 @@
+'''
+Usage:
+    {hods} {subcommand} [--schema=GLOB] PREDICATE1 [PREDICATE2] ...
+
+Search the index of metadata files (see `index` subcommand) and print paths
+of files that match all predicates.
+
+Predicates refer to dotted data paths:
+
+    data.year=2010      value equals
+    data.year!=2010     no value equals
+    data.year>2000      numeric comparison: <, <=, >, >=
+    data.title~Track*   value matches glob pattern
+    data.comment?       value exists
+
+If `--schema` is given, only files using a matching schema identifier are
+printed. Exit code is 1 if no files match and 2 if the index does not exist
+or the query is invalid.
+'''
+
+
+import sqlite3
+import sys
+
+from hods._lib.index import MetadataIndex
+import hods.cli._flags as flags
+
+
+def main(*args):
+    if args:
+        args = ['', ''] + list(args) + ['', '']
+    else:
+        args = sys.argv + ['', '']
+
+    schema = None
+    for arg in args[2:]:
+        if arg.startswith(flags.SCHEMA):
+            schema = arg.replace(flags.SCHEMA, '', 1)
+            args.remove(arg)
+            break
+
+    predicates = [a for a in args[2:] if a]
+    try:
+        with MetadataIndex(create=False) as index:
+            found = index.query(predicates, schema=schema)
+    except FileNotFoundError:
+        fail('Index not found, run `index` subcommand first')
+    except (ValueError, OSError, sqlite3.Error) as error:
+        fail(error)
+    for path in found:
+        print(path)
+    if not found:
+        sys.exit(1)
+
+
+def fail(message):
+    print('Query failed: {}'.format(message), file=sys.stderr, flush=True)
+    sys.exit(2)
@@ -1,7 +1,7 @@
 '''
 Usage:
     {hods} {subcommand} [--sections=SECTION1,SECTION2|--sections-all]
-            [FILENAME1] [FILENAME2] ...
+            [--profile] [--profile-json=FILE] [FILENAME1] [FILENAME2] ...
 
 Update hash values for metadata file(s).
 
@@ -10,21 +10,20 @@ sections.
 
 If no section names are provided, hashes will be calculated only for sections
 that already have some previous hash value.
-'''
 
+Use `--profile` or `--profile-json=FILE` to measure where the time is spent
+(see `check` subcommand).
+'''
 
-import sys
 
 from hods import Metadata, HashMismatchError
 from hods._lib.files import get_files
+from hods._lib.profile import track_file
+from hods.cli._profile import profiled_main
 
 
-def main(*args):
-    if args:
-        args = ['', ''] + list(args) + ['', '']
-    else:
-        args = sys.argv + ['', '']
-
+@profiled_main
+def main(args, profiler=None):
     sections = []
     all_sections = False
 
@@ -39,13 +38,16 @@ def main(*args):
     if not files: files = get_files()
 
     for filename in files:
-        meta = Metadata(filename=filename)
-        if all_sections:
-            sections = [x for x in meta if x != 'info']
-        try:
-            meta.validate_hashes(sections=sections)
-            print('No changes required for: {}'.format(filename))
-        except HashMismatchError:
-            meta.validate_hashes(sections=sections, write_updates=True)
-            meta.write()
-            print('Data hashes updated for: {}'.format(filename))
+        with track_file(filename):
+            meta = Metadata(filename=filename)
+            if all_sections:
+                sections = [x for x in meta if x != 'info']
+            try:
+                meta.validate_hashes(sections=sections)
+                print('No changes required for: {}'.format(filename))
+            except HashMismatchError:
+                meta.validate_hashes(sections=sections, write_updates=True)
+                if meta.write():
+                    print('Data hashes updated for: {}'.format(filename))
+                else:
+                    print('No changes required for: {}'.format(filename))
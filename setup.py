@@ -12,13 +12,12 @@ setup(
     entry_points={
         'console_scripts': ['hods=hods.cli:main'],
     },
-    packages=find_packages(exclude=('tests',)),
+    packages=find_packages(exclude=('tests', 'benchmarks')),
     include_package_data=True,
     install_requires=[
         'jsonschema',
         'strictyaml',
         'ruamel.yaml',
-        'setuptools',
     ],
     extras_require={
     },
@@ -0,0 +1,181 @@
+'''
+Tests for asynchronous bulk loading API
+'''
+
+import asyncio
+import gc
+import json
+import os
+import threading
+import time
+import warnings
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from hods import HashMismatchError, Metadata, aio
+from hods._lib import schemas
+
+
+class testAsyncLoading(TestCase):
+
+    count = 12
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.files = []
+        for number in range(self.count):
+            filename = os.path.join(self.tempdir.name, 'file{:02d}.json'.format(number))
+            meta = Metadata({'number': number})
+            meta.validate_hashes(write_updates=True)
+            meta.write(filename)
+            self.files.append(filename)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(self.loop.close)
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def collect(self, results):
+        async def consume():
+            collected = {}
+            async with results:
+                async for filename, result in results:
+                    collected[filename] = result
+            return collected
+        return self.run_async(consume())
+
+    def slow_loader(self, delay=0.02):
+        '''Patch file loading to record the number of concurrent calls'''
+        state = {'active': 0, 'peak': 0, 'started': 0}
+        lock = threading.Lock()
+        original = aio.get_object
+        def get_object(*args, **kwargs):
+            with lock:
+                state['active'] += 1
+                state['started'] += 1
+                state['peak'] = max(state['peak'], state['active'])
+            try:
+                time.sleep(delay)
+                return original(*args, **kwargs)
+            finally:
+                with lock:
+                    state['active'] -= 1
+        patcher = patch.object(aio, 'get_object', get_object)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return state
+
+    def test_load(self):
+        meta = self.run_async(aio.load(self.files[3], verify=True))
+        self.assertEqual(meta.data.number, 3)
+        meta.data.number = 33
+        meta.validate_hashes(write_updates=True)
+        self.assertTrue(meta.write())
+        self.assertEqual(Metadata(filename=self.files[3]).data.number, 33)
+
+    def test_load_many(self):
+        results = self.collect(aio.load_many(self.files, verify=True, readonly=True))
+        self.assertEqual(sorted(results), self.files)
+        for number, filename in enumerate(self.files):
+            self.assertEqual(results[filename].data.number, number)
+
+    def test_errors(self):
+        broken = os.path.join(self.tempdir.name, 'broken.json')
+        with open(broken, 'w') as f:
+            f.write('{')
+        payload = os.path.join(self.tempdir.name, 'payload.json')
+        with open(payload, 'w') as f:
+            f.write('{"no": "info"}')
+        changed = self.files[0]
+        with open(changed) as f:
+            content = f.read()
+        with open(changed, 'w') as f:
+            f.write(content.replace('"number": 0', '"number": 100'))
+        missing = os.path.join(self.tempdir.name, 'missing.json')
+        files = [broken, payload, changed, missing, self.files[1]]
+        results = self.collect(aio.load_many(files, verify=True))
+        self.assertIsInstance(results[broken], ValueError)
+        self.assertIsInstance(results[payload], ValueError)
+        self.assertIsInstance(results[changed], HashMismatchError)
+        self.assertIsInstance(results[missing], FileNotFoundError)
+        self.assertIsInstance(results[self.files[1]], Metadata)
+
+    def test_bounded_concurrency(self):
+        state = self.slow_loader()
+        results = self.collect(aio.load_many(self.files, workers=8, limit=3))
+        self.assertEqual(len(results), self.count)
+        self.assertLessEqual(state['peak'], 3)
+        self.assertGreater(state['peak'], 1)
+
+    def test_backpressure(self):
+        state = self.slow_loader(delay=0)
+        async def consume_slowly():
+            async with aio.load_many(iter(self.files), limit=2) as results:
+                await results.__anext__()
+                await asyncio.sleep(0.1)  # consumer is busy
+                return state['started']
+        self.assertLessEqual(self.run_async(consume_slowly()), 3)
+
+    def test_cancellation(self):
+        state = self.slow_loader(delay=0.05)
+        async def consume():
+            async for filename, result in aio.load_many(self.files, workers=2, limit=2):
+                pass
+        async def cancel_soon():
+            task = asyncio.ensure_future(consume())
+            await asyncio.sleep(0.07)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        self.run_async(cancel_soon())
+        time.sleep(0.1)
+        self.assertLess(state['started'], self.count)
+        self.assertEqual(state['active'], 0)
+
+    def test_created_outside_of_coroutine(self):
+        asyncio.set_event_loop(None)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            results = aio.load_many(self.files)
+            self.assertIsNone(results.loader._executor)  # created on first use
+            self.assertEqual(len(self.collect(results)), self.count)
+        self.assertIsNone(results.loader._executor)
+
+    def test_abandoned_iteration(self):
+        async def consume_one(results):
+            async for filename, result in results:
+                break
+        results = aio.load_many(self.files, workers=2)
+        loader = results.loader
+        self.run_async(consume_one(results))
+        self.assertIsNotNone(loader._executor)
+        del results
+        gc.collect()
+        self.assertIsNone(loader._executor)
+
+    def test_schema_deduplication(self):
+        identifier = schemas.restore_full_schema_id('music-album-v1.json')
+        with open('tests/data/samples/sample-music-v1.json') as f:
+            payload = f.read()
+        files = []
+        for number in range(6):
+            filename = os.path.join(self.tempdir.name, 'album{}.json'.format(number))
+            meta = Metadata(json.loads(payload))
+            meta.info.schema.data = identifier
+            meta.validate_hashes(write_updates=True)
+            meta.write(filename)
+            files.append(filename)
+        schemas.registry.invalidate(identifier)
+        original = schemas.fetch_schema
+        fetched = []
+        def fetch_schema(name):
+            fetched.append(name)
+            time.sleep(0.05)
+            return original(name)
+        with patch.object(schemas, 'fetch_schema', fetch_schema):
+            results = self.collect(aio.load_many(files, workers=6))
+        self.assertTrue(all(isinstance(r, Metadata) for r in results.values()))
+        self.assertEqual(fetched, [identifier])
@@ -0,0 +1,41 @@
+'''
+Tests for benchmark runner
+'''
+
+import os
+from contextlib import redirect_stdout
+from io import StringIO
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from benchmarks import run
+
+
+class testBenchmarkRunner(TestCase):
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+    def test_discover(self):
+        names = [b.name for b in run.discover('SchemaSuite')]
+        self.assertIn('bench_schemas.SchemaSuite.time_compile(metadata-v1.json)', names)
+        self.assertTrue(all('SchemaSuite' in name for name in names))
+        skipped = list(run.discover(r'StrictYAML, 10000, False'))
+        self.assertEqual(len(skipped), 1)
+        self.assertIsNone(run.measure(skipped[0], quick=True))
+
+    def test_run_and_compare(self):
+        output = StringIO()
+        with redirect_stdout(output):
+            run.main('--quick', '--results={}'.format(self.tempdir.name), 'SchemaSuite.time_schema_cached')
+        self.assertIn('Results saved to', output.getvalue())
+        saved = []
+        for directory, _, files in os.walk(self.tempdir.name):
+            saved.extend(os.path.join(directory, f) for f in files)
+        self.assertEqual(len(saved), 1)
+
+        previous = {'a': 1.0, 'b': 1.0, 'c': 1.0}
+        current = {'a': 1.1, 'b': 2.0, 'c': 0.5, 'd': 5.0}
+        with redirect_stdout(output):
+            self.assertEqual(run.compare(previous, current), ['b'])
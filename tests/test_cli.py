@@ -0,0 +1,168 @@
+'''
+Tests for command line subcommands
+'''
+
+import os
+import time
+from contextlib import redirect_stderr
+from io import StringIO
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from hods import Metadata
+from hods._lib.cache import CACHE_FILENAME, VerificationCache
+from hods._lib.files import scan_files
+from hods.cli import check
+
+
+class SampleFiles:
+    '''Create a directory with sample metadata files for each test'''
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.directory = self.tempdir.name
+        self.files = []
+        for number in range(8):
+            filename = os.path.join(self.directory, 'file{}.json'.format(number))
+            meta = Metadata({'number': number})
+            meta.validate_hashes(write_updates=True)
+            meta.write(filename)
+            self.files.append(filename)
+        self.broken = os.path.join(self.directory, 'broken.json')
+        with open(self.broken, 'w') as f:
+            f.write('{')
+        self.files.append(self.broken)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+
+class testCheck(SampleFiles, TestCase):
+
+    def test_statuses(self):
+        results = dict(check.check_files(self.files, jobs=1))
+        self.assertEqual(results.pop(self.broken), 'PARSE ERROR')
+        self.assertEqual(set(results.values()), {check.OK})
+
+    def test_strict_yaml_restrictions(self):
+        valid = os.path.join(self.directory, 'valid.syml')
+        meta = Metadata({'key': 'value'})
+        meta.validate_hashes(write_updates=True)
+        meta.write(valid)
+        with open(valid) as f:
+            content = f.read()
+        self.assertIn('data:\n  key: value', content)
+        flow_style = os.path.join(self.directory, 'flow.syml')
+        with open(flow_style, 'w') as f:
+            f.write(content.replace('data:\n  key: value', 'data: {key: value}'))
+        self.assertEqual(check.check(valid), check.OK)
+        self.assertEqual(check.check(flow_style), 'PARSE ERROR')
+
+    def test_parallel(self):
+        sequential = list(check.check_files(self.files, jobs=1))
+        parallel = list(check.check_files(self.files, jobs=3))
+        self.assertEqual(sequential, parallel)
+
+    def test_exit_code(self):
+        with self.assertRaises(SystemExit) as context:
+            check.main('--jobs=2', '--no-cache', *self.files)
+        self.assertEqual(context.exception.code, 1)
+        check.main('--jobs=2', '--no-cache', *self.files[:-1])  # no exception
+
+    def test_invalid_jobs(self):
+        for value in ('abc', '0', '-1', ''):
+            with self.subTest(value=value):
+                with redirect_stderr(StringIO()) as stderr:
+                    with self.assertRaises(SystemExit) as context:
+                        check.main('--jobs=' + value, '--no-cache', *self.files[:-1])
+                self.assertEqual(context.exception.code, 2)
+                self.assertIn('jobs', stderr.getvalue())
+
+    def test_directory_entries(self):
+        entries = list(scan_files(self.directory))
+        results = list(check.check_files(entries, jobs=1))
+        self.assertEqual(results, list(check.check_files(self.files, jobs=1)))
+
+    def test_exclude(self):
+        current = os.getcwd()
+        os.chdir(self.directory)
+        try:
+            check.main('--no-cache', '--exclude=broken.*')  # no exception
+            with self.assertRaises(SystemExit):
+                check.main('--no-cache', '--include=broken.*')
+        finally:
+            os.chdir(current)
+
+
+class testVerificationCache(SampleFiles, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        for filename in self.files:
+            self.backdate(filename)
+        self.verified = []
+        self.original_verify = check.verify
+        def verify(filename):
+            self.verified.append(filename)
+            return self.original_verify(filename)
+        check.verify = verify
+
+    def tearDown(self):
+        check.verify = self.original_verify
+        super().tearDown()
+
+    def backdate(self, filename):
+        '''Make the file old enough to be cached'''
+        past = time.time() - 60
+        os.utime(filename, (past, past))
+
+    def run_check(self):
+        self.verified.clear()
+        with VerificationCache(self.directory) as cache:
+            return dict(check.check_files(self.files, jobs=1, cache=cache))
+
+    def test_unchanged_files_are_skipped(self):
+        first = self.run_check()
+        self.assertEqual(len(self.verified), len(self.files))
+        second = self.run_check()
+        self.assertEqual(first, second)
+        self.assertEqual(self.verified, [self.broken])  # failed files are rechecked
+
+    def test_changed_files_are_checked(self):
+        self.run_check()
+        changed = self.files[0]
+        with open(changed, 'a') as f:
+            f.write('\n')
+        self.run_check()
+        self.assertEqual(sorted(self.verified), sorted([changed, self.broken]))
+
+    def test_recently_modified_files_are_not_cached(self):
+        recent = self.files[0]
+        os.utime(recent)
+        self.run_check()
+        self.run_check()
+        self.assertEqual(sorted(self.verified), sorted([recent, self.broken]))
+        self.backdate(recent)
+        self.run_check()
+        self.run_check()
+        self.assertEqual(self.verified, [self.broken])
+
+    def test_changed_schemas(self):
+        self.run_check()
+        with patch('hods._lib.cache.schema_hash', return_value='changed'):
+            self.run_check()
+        self.assertEqual(len(self.verified), len(self.files))
+        with patch('hods._lib.cache.hods_version', return_value='upgraded'):
+            self.run_check()
+        self.assertEqual(len(self.verified), len(self.files))
+
+    def test_corrupted_cache(self):
+        self.run_check()
+        with open(os.path.join(self.directory, CACHE_FILENAME), 'wb') as f:
+            f.write(b'garbage' * 1000)
+        results = self.run_check()
+        self.assertEqual(len(self.verified), len(self.files))
+        self.assertEqual(results[self.broken], 'PARSE ERROR')
+        self.run_check()
+        self.assertEqual(self.verified, [self.broken])
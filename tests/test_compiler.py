@@ -0,0 +1,251 @@
+'''
+Conformance tests for compiled schema engine: results must match jsonschema
+'''
+
+import json
+from unittest import TestCase
+
+import jsonschema
+
+from hods import ValidationErrors
+from hods._lib.compiler import SchemaCompiler
+from hods._lib.schemas import (
+    Schema,
+    compile_schema,
+    get_scope,
+    load_reference,
+    reference_options,
+)
+
+
+# (schema, instances) pairs covering supported draft-07 keywords
+CASES = [
+    ({'type': 'object'}, [{}, [], 'a', 1, None]),
+    ({'type': 'array'}, [[], {}, 'a']),
+    ({'type': 'string'}, ['', 1, None]),
+    ({'type': 'integer'}, [1, 1.0, 1.5, True, '1', -5, 10 ** 30]),
+    ({'type': 'number'}, [1, 1.5, True, '1', None]),
+    ({'type': 'boolean'}, [True, False, 0, 'true']),
+    ({'type': 'null'}, [None, 0, '', False]),
+    ({'type': ['string', 'null']}, ['a', None, 1]),
+    ({'enum': [1, 'a', None, [1], {'a': 1}]}, [1, 1.0, True, 'a', None, [1], [True], {'a': 1}, 2]),
+    ({'enum': [False, 0]}, [False, 0, 0.0, True]),
+    ({'const': {'a': [1, 2]}}, [{'a': [1, 2]}, {'a': [2, 1]}, {'a': [1, 2], 'b': 1}]),
+    ({'const': True}, [True, 1]),
+    ({'required': ['a', 'b']}, [{'a': 1, 'b': 2}, {'a': 1}, [], 'ab']),
+    ({'minProperties': 1, 'maxProperties': 2}, [{}, {'a': 1}, {'a': 1, 'b': 2, 'c': 3}, []]),
+    (
+        {'properties': {'a': {'type': 'string'}, 'b': True, 'c': False}},
+        [{'a': 'x'}, {'a': 1}, {'b': 1}, {'c': 1}, {'d': 1}, 'a'],
+    ),
+    (
+        {
+            'properties': {'a': {'type': 'integer'}},
+            'patternProperties': {'^x-': {'type': 'string'}, 'z$': {'minLength': 2}},
+            'additionalProperties': False,
+        },
+        [{'a': 1, 'x-b': 'c'}, {'x-b': 1}, {'other': 1}, {'x-z': 'a'}, {'x-z': 'ab'}, {'a': 'x'}],
+    ),
+    (
+        {'patternProperties': {'^a': True}, 'additionalProperties': {'type': 'integer'}},
+        [{'ab': 'x', 'b': 1}, {'b': 'x'}],
+    ),
+    ({'additionalProperties': False}, [{}, {'b': 1}, {'b': 1, 'a': 2}]),
+    (
+        {'patternProperties': {'^a': True, 'b{2}': True}, 'additionalProperties': False},
+        [{'abb': 1}, {'c': 1}, {'d': 1, 'c': 2}],
+    ),
+    ({'patternProperties': {'^a': False}}, [{'ab': 1}, {'b': 1}]),
+    (
+        {'dependencies': {'a': ['b'], 'c': {'required': ['d']}}},
+        [{'a': 1, 'b': 1}, {'a': 1}, {'c': 1}, {'c': 1, 'd': 1}, {'b': 1}],
+    ),
+    ({'propertyNames': {'maxLength': 2}}, [{'ab': 1}, {'abc': 1}, {}]),
+    ({'minItems': 1, 'maxItems': 2}, [[], [1], [1, 2, 3], 'abc']),
+    ({'minItems': 2}, [[1]]),
+    ({'maxItems': 0, 'maxLength': 0, 'maxProperties': 0}, [[1], 'a', {'a': 1}, [], '', {}]),
+    ({'uniqueItems': True}, [[1, 2], [1, 1], [1, True], [[1], [1]], [{'a': 1}, {'a': 2}], [0, False]]),
+    ({'items': {'type': 'integer'}}, [[1, 2], [1, 'a'], []]),
+    (
+        {'items': [{'type': 'integer'}, {'type': 'string'}], 'additionalItems': False},
+        [[1, 'a'], [1], ['a'], [1, 'a', 2], [1, 'a', 2, 'b'], []],
+    ),
+    (
+        {'items': [{'type': 'integer'}], 'additionalItems': {'type': 'string'}},
+        [[1, 'a', 'b'], [1, 'a', 2]],
+    ),
+    ({'contains': {'const': 5}}, [[5], [1, 5], [1], []]),
+    ({'contains': False}, [[1]]),
+    ({'minLength': 2, 'maxLength': 3}, ['a', 'ab', 'abcd', 5]),
+    ({'pattern': '^a+$'}, ['aaa', 'ab', '', 1]),
+    ({'pattern': '\\d'}, ['a1b', 'ab']),
+    ({'minimum': 1, 'maximum': 3}, [0, 1, 3, 3.5, 'a']),
+    ({'exclusiveMinimum': 1, 'exclusiveMaximum': 3}, [1, 2, 3, 1.0001]),
+    ({'multipleOf': 2}, [4, 5, 4.0, 'a']),
+    ({'multipleOf': 0.1}, [0.3, 0.35, 10 ** 308]),
+    ({'allOf': [{'type': 'string'}, {'minLength': 2}]}, ['ab', 'a', 1]),
+    ({'anyOf': [{'type': 'string'}, {'minimum': 2}]}, ['a', 3, 1]),
+    ({'oneOf': [{'type': 'integer'}, {'minimum': 2}]}, [1, 2.5, 3, 1.5]),
+    ({'oneOf': [{'type': 'integer'}, {'minimum': 2}, {'type': 'number'}]}, [3, 1.5, 'a']),
+    ({'not': {'type': 'string'}}, [1, 'a']),
+    ({'not': {'enum': ['{0}']}}, ['{0}']),
+    ({'if': {'type': 'integer'}, 'then': {'minimum': 5}, 'else': {'type': 'string'}}, [6, 1, 'a', None]),
+    ({'if': {'type': 'integer'}, 'then': {'minimum': 5}}, [6, 1, 'a']),
+    ({'then': {'minimum': 5}}, [1]),
+    (True, [1, None]),
+    (False, [1, None]),
+    (
+        {
+            'definitions': {'positive': {'type': 'integer', 'minimum': 1}},
+            'properties': {'a': {'$ref': '#/definitions/positive', 'maximum': 0}},
+        },
+        [{'a': 1}, {'a': 0}, {'a': 'x'}],
+    ),
+    (
+        {
+            'definitions': {
+                'node': {
+                    'type': 'object',
+                    'properties': {'children': {'type': 'array', 'items': {'$ref': '#/definitions/node'}}},
+                    'required': ['name'],
+                },
+            },
+            '$ref': '#/definitions/node',
+        },
+        [
+            {'name': 'root', 'children': [{'name': 'child', 'children': []}]},
+            {'name': 'root', 'children': [{'children': []}]},
+        ],
+    ),
+    (
+        {'properties': {'a~b': {'type': 'string'}, 'c/d': {'$ref': '#/properties/a~0b'}}},
+        [{'c/d': 'x'}, {'c/d': 1}],
+    ),
+    (
+        {'properties': {'album': {'$ref': 'https://hods.ml/schemas/music-album-v1.json'}}},
+        [{'album': {}}, {}],
+    ),
+]
+
+
+def jsonschema_errors(schema, instance):
+    validator = jsonschema.Draft7Validator(schema, **reference_options(schema))
+    return list(validator.iter_errors(instance))
+
+
+def load_sample(name):
+    with open('tests/data/samples/' + name) as f:
+        return json.load(f)
+
+
+def compiled_error(schema, instance):
+    compiled = SchemaCompiler(schema, load=load_reference)
+    try:
+        compiled.validate(instance)
+    except ValidationErrors as error:
+        return error
+    return None
+
+
+class testConformance(TestCase):
+
+    def test_keywords(self):
+        for schema, instances in CASES:
+            for instance in instances:
+                with self.subTest(schema=schema, instance=instance):
+                    expected = jsonschema_errors(schema, instance)
+                    error = compiled_error(schema, instance)
+                    self.assertEqual(error is None, not expected)
+                    if len(expected) != 1:
+                        continue
+                    self.assertEqual(error.message, expected[0].message)
+                    self.assertEqual(error.validator, expected[0].validator)
+                    schema_path = list(expected[0].schema_path)
+                    if expected[0].validator is None:
+                        # jsonschema does not extend the path of errors from false subschemas
+                        self.assertEqual(list(error.schema_path)[:len(schema_path)], schema_path)
+                    else:
+                        self.assertEqual(list(error.path), list(expected[0].path))
+                        self.assertEqual(list(error.schema_path), schema_path)
+
+    def assertSameValidity(self, name, variants):
+        reference = Schema(name)
+        compiled = Schema(name, engine='compiled')
+        for number, variant in enumerate(variants):
+            with self.subTest(schema=name, variant=number):
+                results = []
+                for schema in (reference, compiled):
+                    try:
+                        schema.validate(variant)
+                        results.append(True)
+                    except ValidationErrors:
+                        results.append(False)
+                self.assertEqual(results[1], results[0])
+
+    def test_music_album_schema(self):
+        mutations = [
+            lambda album: None,
+            lambda album: album.update(year=2011),
+            lambda album: album.update(album=''),
+            lambda album: album.update(unknown='value'),
+            lambda album: album.pop('tracks'),
+            lambda album: album['tracks'].append({'number': 1}),
+            lambda album: album['tracks'][0].update(title=None),
+            lambda album: album.update(tracks={}),
+        ]
+        variants = []
+        for mutate in mutations:
+            variant = load_sample('sample-music-v1.json')
+            mutate(variant)
+            variants.append(variant)
+        self.assertSameValidity('music-album-v1.json', variants)
+
+    def test_metadata_schema(self):
+        variants = [
+            load_sample(name)
+            for name in ('sample-v1-01.json', 'sample-v1-02.json', 'sample-music-v1.json')
+        ]
+        variants.extend([{}, {'info': {}, 'data': {}}, {'data': {}}])
+        info = variants[0]['info']
+        variants.append(dict(variants[0], info=dict(info, extra='value')))
+        variants.append(dict(variants[0], info=dict(info, hashes={'data': {}})))
+        self.assertSameValidity('metadata-v1.json', variants)
+
+
+
+class testCompiledEngine(TestCase):
+
+    def test_registry(self):
+        first = Schema('music-album-v1.json', engine='compiled')
+        second = Schema('https://hods.ml/schemas/music-album-v1.json', engine='compiled')
+        self.assertIs(first._compiled, second._compiled)
+        self.assertIsNot(first._compiled, Schema('music-album-v1.json')._compiled)
+
+    def test_error(self):
+        schema = Schema('music-album-v1.json', engine='compiled')
+        album = load_sample('sample-music-v1.json')
+        album['tracks'][1]['title'] = 5
+        with self.assertRaises(ValidationErrors) as context:
+            schema.validate(album)
+        error = context.exception
+        self.assertEqual(list(error.path), ['tracks', 1, 'title'])
+        self.assertEqual(error.validator, 'type')
+        self.assertEqual(error.instance, 5)
+        self.assertIn('tracks/1/title', str(error))
+
+    def test_path_scoped_validation(self):
+        schema = Schema('music-album-v1.json', engine='compiled')
+        album = load_sample('sample-music-v1.json')
+        schema.validate_path(album, ('tracks',))
+        album['tracks'] = [{'number': 1}]
+        with self.assertRaises(ValidationErrors):
+            schema.validate_path(album, ('tracks',))
+        tracks = schema.parsed['patternProperties']['tracks']
+        scope = get_scope(schema._compiled, schema.parsed, 'tracks')
+        self.assertIn(tracks, scope.children)
+
+    def test_unsupported_keywords(self):
+        with self.assertRaises(ValueError):
+            compile_schema(json.dumps({'unevaluatedProperties': False}), engine='compiled')
+        with self.assertRaises(ValueError):
+            compile_schema(json.dumps({'$ref': '#anchor'}), engine='compiled')
@@ -2,7 +2,9 @@
 Unit tests for data classes
 '''
 
+import json
 from unittest import TestCase
+from unittest.mock import patch
 
 from hods import (
     HashMismatchError,
@@ -10,7 +12,9 @@ from hods import (
     TreeStructuredData as TSD,
     ValidationErrors,
 )
-from hods._lib.hash import struct_hash
+from hods._lib import core
+from hods._lib.hash import datahash, struct_hash, struct_hashes
+from hods._lib.schemas import Schema
 
 
 class testTreeWrapper(TestCase):
@@ -56,6 +60,17 @@ class testTreeWrapper(TestCase):
         self.data['tree']['inner'] = 'new2'
         self.assertEqual(self.data.tree.inner, 'new2')
 
+    def test_children_are_not_revalidated(self):
+        calls = []
+        def validator(data):
+            calls.append(data)
+        tree = TSD({'a': {'b': {'c': 1}}}, validator=validator)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(tree.a.b.c, 1)
+        self.assertEqual(len(calls), 1)
+        tree.a.b.c = 2
+        self.assertEqual(len(calls), 2)
+
 
 class testMetadataHolder(TestCase):
 
@@ -107,3 +122,255 @@ class testMetadataHolder(TestCase):
             meta.validate_hashes(sections=('new',))
         meta.validate_hashes(sections=('new',), write_updates=True)
         self.assertEqual(meta.info.hashes.new.md5, struct_hash(new_section_contents, 'md5'))
+
+
+class testIncrementalValidation(TestCase):
+
+    class CountingSchema(Schema):
+        full_validations = 0
+        def validate(self, data):
+            type(self).full_validations += 1
+            return super().validate(data)
+        __call__ = validate
+
+    def test_writes_are_path_scoped(self):
+        schema = self.CountingSchema('music-album-v1.json')
+        with open('tests/data/samples/sample-music-v1.json') as f:
+            album = TSD(json.load(f), validator=schema)
+        before = schema.full_validations
+        album.year = '2011'
+        album.comment = 'updated'
+        with self.assertRaises(ValidationErrors):
+            album.album = ''
+        album.album = 'Cool Album'
+        self.assertEqual(schema.full_validations, before)
+        album.validate()  # full validation is still available on demand
+        self.assertEqual(schema.full_validations, before + 1)
+
+    def test_nested_writes(self):
+        meta = Metadata(filename='tests/data/samples/sample-v1-02.json')
+        meta.data.info.hashes.data.md5 = 'valid'
+        with self.assertRaises(ValidationErrors):
+            meta.data.info.hashes.data.md5 = 'not valid'
+        with self.assertRaises(ValidationErrors):
+            meta.data.info.unknown = 'value'
+
+
+class testTransactions(TestCase):
+
+    def setUp(self):
+        self.meta = Metadata(filename='tests/data/samples/sample-v1-02.json')
+
+    def test_commit(self):
+        with self.meta.transaction():
+            self.meta.data.info.hashes.data.md5 = 'temporarily invalid'
+            self.meta.data.info.hashes.data.sha1 = 'changed'
+            self.meta.data.info.hashes.data.md5 = 'changed'
+        self.assertEqual(self.meta.data.info.hashes.data.sha1, 'changed')
+        self.assertEqual(self.meta.data.info.hashes.data.md5, 'changed')
+
+    def test_rollback(self):
+        original = struct_hash(self.meta._data)
+        with self.assertRaises(ValidationErrors):
+            with self.meta.transaction():
+                self.meta.data.info.hashes.data.md5 = 'changed'
+                self.meta.new_section = {'hello': 'world'}
+                self.meta.data.info.unknown = 'invalid'
+        self.assertEqual(struct_hash(self.meta._data), original)
+        self.assertFalse(hasattr(self.meta, 'new_section'))
+        self.meta.validate()
+
+    def test_nested(self):
+        with self.meta.transaction():
+            with self.meta.data.transaction():
+                self.meta.data.info.hashes.data.md5 = 'temporarily invalid'
+            self.meta.data.info.hashes.data.md5 = 'changed'
+        self.assertEqual(self.meta.data.info.hashes.data.md5, 'changed')
+
+    def test_single_validation(self):
+        class Validator:
+            def __init__(self):
+                self.calls = []
+            def __call__(self, data):
+                self.calls.append(None)
+            def validate_path(self, data, path):
+                self.calls.append(path)
+        validator = Validator()
+        tree = TSD({'a': {'b': 1, 'c': 2}, 'd': {'e': 3}}, validator=validator)
+        validator.calls.clear()
+        with tree.transaction():
+            tree.a.b = 10
+            tree.a.c = 20
+            tree.a.b = 30
+        self.assertEqual(validator.calls, [('a',)])
+        validator.calls.clear()
+        with tree.transaction():
+            tree.a.c = 40
+            tree.a.c = 50
+        self.assertEqual(validator.calls, [('a', 'c')])
+        validator.calls.clear()
+        with tree.transaction():
+            for number in range(100):
+                tree.d.e = number
+                tree.a.b = number
+        self.assertEqual(validator.calls, [('d',), ('a',)])
+        validator.calls.clear()
+        with patch.object(core, 'JOURNAL_LIMIT', 1):
+            with tree.transaction():
+                tree.d.e = 1
+                tree.a.b = 1
+        self.assertEqual(validator.calls, [None])
+
+        calls = []
+        tree = TSD({'a': {'b': 1}}, validator=calls.append)
+        calls.clear()
+        with tree.transaction():
+            for number in range(10):
+                tree.a.b = number
+        self.assertEqual(len(calls), 1)
+
+    def test_reading_uncached_branch(self):
+        self.assertNotIn('schema', self.meta.data.info._children)
+        with self.meta.transaction():
+            self.meta.data.info.hashes.data.md5 = 'temporarily invalid'
+            self.assertEqual(self.meta.data.info.schema.extra, 'string')
+            self.meta.data.info.hashes.data.md5 = 'changed'
+        self.assertEqual(self.meta.data.info.hashes.data.md5, 'changed')
+
+
+class testHashing(TestCase):
+
+    def test_multiple_algorithms(self):
+        data = {'hello': 'world', 'nested': {'list': [1, 2, 3]}}
+        algorithms = ('md5', 'sha1', 'sha256')
+        hashes = struct_hashes(data, algorithms)
+        self.assertEqual(set(hashes), set(algorithms))
+        for algo in algorithms:
+            self.assertEqual(hashes[algo], struct_hash(data, algo))
+
+    def test_unsupported_algorithm(self):
+        with self.assertRaises(ValueError):
+            struct_hashes({}, ('md5', 'no-such-algorithm'))
+
+
+class testCachedHashes(TestCase):
+
+    def setUp(self):
+        self.tree = TSD({
+            'b': {'nested': {'value': 1}, 'other': 'x'},
+            'a': {'list': [1, 2, {'deep': 'dict'}]},
+            'c': 'scalar',
+        })
+        self.tree._own_data()
+
+    def assertHashIsFresh(self):
+        self.assertEqual(datahash(self.tree), struct_hash(self.tree._data))
+
+    def test_writes_invalidate_cache(self):
+        self.assertHashIsFresh()
+        self.tree.b.nested.value = 2
+        self.assertHashIsFresh()
+        self.tree.c = 'changed'
+        self.assertHashIsFresh()
+        self.tree.b.new = {'branch': True}
+        self.assertHashIsFresh()
+        self.tree.b.new.branch = False
+        self.assertHashIsFresh()
+
+    def test_lists_are_not_cached(self):
+        self.assertHashIsFresh()
+        self.tree.a.list.append(3)
+        self.tree.a.list[2]['deep'] = 'changed'
+        self.assertHashIsFresh()
+
+    def test_rollback_invalidates_cache(self):
+        self.tree._validator = lambda data: data['c'] == 'scalar' or int('invalid')
+        self.assertHashIsFresh()
+        with self.assertRaises(ValueError):
+            with self.tree.transaction():
+                self.tree.c = 'invalid'
+                self.assertHashIsFresh()
+        self.assertEqual(self.tree.c, 'scalar')
+        self.assertHashIsFresh()
+
+    def test_shared_data_is_not_cached(self):
+        data = {'a': {'b': 1}, 'c': 'scalar'}
+        tree = TSD(data)
+        datahash(tree)
+        data['a']['b'] = 2
+        self.assertEqual(datahash(tree), struct_hash(data))
+
+    def test_assigned_branches_are_not_cached(self):
+        branch = {'value': 1}
+        self.tree.b.assigned = branch
+        self.assertHashIsFresh()
+        branch['value'] = 2
+        self.assertHashIsFresh()
+
+    def test_metadata(self):
+        meta = Metadata()
+        self.assertEqual(datahash(meta), struct_hash(meta._data))
+        meta.data.value = 'x'
+        self.assertEqual(datahash(meta), struct_hash(meta._data))
+        payload = {'value': {'nested': 1}}
+        meta = Metadata(payload)
+        datahash(meta)
+        payload['value']['nested'] = 2
+        self.assertEqual(datahash(meta), struct_hash(meta._data))
+
+
+class testFrozenView(TestCase):
+
+    def setUp(self):
+        self.meta = Metadata({
+            'title': 'Sample',
+            'nested': {'deeper': {'value': 1}, 'get': 'shadowed'},
+            'list': [{'item': 0}, {'item': 1}],
+        })
+        self.meta.validate_hashes(write_updates=True)
+        self.view = self.meta.freeze()
+
+    def test_attributes(self):
+        view = self.view
+        self.assertEqual(view.data.title, 'Sample')
+        self.assertEqual(view.data.nested.deeper.value, 1)
+        self.assertIs(view.data.nested, view.data.nested)  # cached child views
+        self.assertEqual(view.info.hashes.data.sha256, self.meta.info.hashes.data.sha256)
+        self.assertEqual(view.data.nested['get'], 'shadowed')
+        self.assertEqual(view['data']['nested']['deeper']['value'], 1)
+        self.assertEqual(sorted(view.data), ['list', 'nested', 'title'])
+        self.assertIn('title', view.data)
+        self.assertEqual(len(view.data.nested), 2)
+        self.assertFalse(hasattr(view.data, 'missing'))
+
+    def test_read_only(self):
+        view = self.view
+        with self.assertRaises(AttributeError):
+            view.data.title = 'Changed'
+        with self.assertRaises(AttributeError):
+            view.data['title'] = 'Changed'
+        with self.assertRaises(AttributeError):
+            del view.data.title
+        self.assertEqual(self.meta.data.title, 'Sample')
+        self.assertIs(view.freeze(), view)
+
+    def test_dotted_paths(self):
+        view = self.view
+        self.assertEqual(view.get('data.nested.deeper.value'), 1)
+        self.assertEqual(view.get('data.list.1.item'), 1)
+        self.assertEqual(view.get('data.nested.deeper').value, 1)
+        self.assertEqual(view.data.get('title'), 'Sample')
+        with self.assertRaises(KeyError):
+            view.get('data.list.5.item')
+        with self.assertRaises(KeyError):
+            view.get('data.title.x')
+        self.assertIsNone(view.get('data.missing', None))
+        self.assertEqual(
+            view.select(['data.title', 'data.list.0.item', 'data.missing'], default='-'),
+            ['Sample', 0, '-'],
+        )
+
+    def test_hashes(self):
+        self.assertEqual(datahash(self.view.data), datahash(self.meta.data))
+        self.assertEqual(self.view.data, self.meta.data)
+        self.assertEqual(self.meta.data, self.view.data)
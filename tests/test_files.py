@@ -0,0 +1,323 @@
+'''
+Tests for reading and writing metadata files
+'''
+
+import os
+import stat
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from hods import Metadata
+from hods._lib.cache import get_stat
+from hods._lib.files import (
+    detect_format,
+    get_files,
+    get_object,
+    get_umask,
+    is_metadata,
+    scan_files,
+    write_object,
+)
+from hods._lib.hash import struct_hash
+
+
+YAML_SAMPLE = '''\
+# Comments are not preserved in read-only mode
+title: Sample document
+version: 1.0
+count: 0x1F
+enabled: yes
+empty:
+octal: 0o17
+list:
+  - 1
+  - 2.5e3
+  - ~
+  - 'quoted: string'
+  - {flow: mapping, with: [nested, list]}
+nested:
+  deeper:
+    deepest: true
+  other: false
+anchor: &anchor
+  key: value
+alias: *anchor
+multiline: |
+  first line
+  second line
+'''
+
+STRICT_YAML_SAMPLE = '''\
+title: Sample document
+version: 1.0
+enabled: yes
+list:
+- 1
+- 2.5e3
+- quoted: string
+nested:
+  deeper:
+    deepest: true
+multiline: |
+  first line
+  second line
+'''
+
+
+class testReadOnlyLoaders(TestCase):
+
+    samples = {
+        'sample.yml': YAML_SAMPLE,
+        'sample.syml': STRICT_YAML_SAMPLE,
+    }
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.files = []
+        for name, content in self.samples.items():
+            filename = os.path.join(self.tempdir.name, name)
+            with open(filename, 'w') as f:
+                f.write(content)
+            self.files.append(filename)
+        samples = os.path.join(os.path.dirname(__file__), 'data', 'samples')
+        for name in sorted(os.listdir(samples)):
+            self.files.append(os.path.join(samples, name))
+
+    def test_same_hashes(self):
+        for filename in self.files:
+            with self.subTest(filename=os.path.basename(filename)):
+                roundtrip = get_object(filename)
+                plain = get_object(filename, readonly=True)
+                self.assertEqual(struct_hash(plain), struct_hash(roundtrip))
+
+    def test_plain_objects(self):
+        for filename in self.files:
+            with self.subTest(filename=os.path.basename(filename)):
+                plain = get_object(filename, readonly=True)
+                self.assertIs(type(plain), dict)
+
+    def test_readonly_metadata(self):
+        filename = os.path.join(self.tempdir.name, 'meta.json')
+        meta = Metadata({'key': 'value'})
+        meta.validate_hashes(write_updates=True)
+        meta.write(filename)
+        readonly = Metadata(filename=filename, readonly=True)
+        readonly.validate()
+        readonly.validate_hashes()
+        self.assertEqual(readonly.data.key, 'value')
+        with self.assertRaises(ValueError):
+            readonly.write()
+
+
+class testScanFiles(TestCase):
+
+    tree = {
+        'a.json': '',
+        'b.YAML': '',
+        'c.txt': '',
+        '.hodsignore': '# comment\n\nnode_modules/\n*.draft.json\n/build/*.json\n',
+        'node_modules/x.json': '',
+        'node_modules/y/z.json': '',
+        'drafts/d.draft.json': '',
+        'drafts/e.syml': '',
+        'build/f.json': '',
+        'sub/build/g.json': '',
+        'sub/.hodsignore': 'h.json\n',
+        'sub/h.json': '',
+        'sub/i.yml': '',
+        'h.json': '',
+    }
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.directory = self.tempdir.name
+        for path, content in self.tree.items():
+            filename = os.path.join(self.directory, *path.split('/'))
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, 'w') as f:
+                f.write(content)
+
+    def scan(self, **kwargs):
+        found = set()
+        for entry in scan_files(self.directory, **kwargs):
+            found.add(os.path.relpath(entry.path, self.directory).replace(os.sep, '/'))
+        return found
+
+    def test_ignore_files(self):
+        expected = {'a.json', 'b.YAML', 'h.json', 'drafts/e.syml', 'sub/build/g.json', 'sub/i.yml'}
+        self.assertEqual(self.scan(recursive=True), expected)
+
+    def test_not_recursive(self):
+        self.assertEqual(self.scan(), {'a.json', 'b.YAML', 'h.json'})
+
+    def test_thread_pool(self):
+        self.assertEqual(self.scan(recursive=True, jobs=4), self.scan(recursive=True))
+
+    def test_include_exclude(self):
+        self.assertEqual(
+            self.scan(recursive=True, exclude=['sub/', '*.json']),
+            {'b.YAML', 'drafts/e.syml'},
+        )
+        self.assertEqual(
+            self.scan(recursive=True, include=['*.json'], exclude=['/h.json']),
+            {'a.json', 'sub/build/g.json'},
+        )
+
+    def test_cached_stat(self):
+        for entry in scan_files(self.directory):
+            self.assertEqual(get_stat(entry).st_ino, os.stat(entry.path).st_ino)
+        paths = set(get_files(self.directory))
+        self.assertEqual(paths, {entry.path for entry in scan_files(self.directory)})
+
+    def test_detect_format(self):
+        self.assertEqual(detect_format('a/B.Json'), 'JSON')
+        self.assertEqual(detect_format('c.yaml'), 'YAML')
+        self.assertEqual(detect_format('d.syml'), 'StrictYAML')
+        with self.assertRaises(ValueError):
+            detect_format('.json')
+        self.assertTrue(is_metadata('x.yml'))
+        self.assertFalse(is_metadata('x.txt'))
+
+
+class testAtomicWrite(TestCase):
+
+    payload = {'title': 'Sample', 'list': [1, 2.5, None], 'nested': {'юникод': True}}
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.directory = self.tempdir.name
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def assertNoTemporaryFiles(self):
+        leftovers = [f for f in os.listdir(self.directory) if f.endswith('.tmp')]
+        self.assertEqual(leftovers, [])
+
+    def test_formats(self):
+        for name in ('data.json', 'data.yml', 'data.syml'):
+            with self.subTest(name=name):
+                filename = self.path(name)
+                payload = dict(self.payload)
+                if name.endswith('.syml'):  # all scalars are strings in StrictYAML
+                    payload = {'title': 'Sample', 'list': ['1', '2.5'], 'nested': {'юникод': 'yes'}}
+                write_object(payload, filename)
+                write_object(payload, filename)
+                self.assertEqual(get_object(filename, readonly=True), payload)
+        self.assertNoTemporaryFiles()
+
+    def test_failed_write(self):
+        filename = self.path('data.json')
+        write_object(self.payload, filename)
+        with open(filename) as f:
+            original = f.read()
+        broken = dict(self.payload, zzz=object())  # not serializable
+        with self.assertRaises(TypeError):
+            write_object(broken, filename)
+        with patch('os.replace', side_effect=OSError('disk failure')):
+            with self.assertRaises(OSError):
+                write_object({'other': 'data'}, filename)
+        with open(filename) as f:
+            self.assertEqual(f.read(), original)
+        self.assertNoTemporaryFiles()
+
+    def test_killed_process(self):
+        filename = self.path('data.json')
+        write_object(self.payload, filename)
+        with open(filename) as f:
+            original = f.read()
+        script = '\n'.join([
+            'import os, sys',
+            'from hods._lib.files import AtomicWriter',
+            'with AtomicWriter(sys.argv[1]) as f:',
+            '    f.write("{\\"partial\\": " * 100000)',
+            '    f.flush()',
+            '    os._exit(1)',
+        ])
+        process = subprocess.run(
+            [sys.executable, '-c', script, filename],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
+        self.assertEqual(process.returncode, 1)
+        with open(filename) as f:
+            self.assertEqual(f.read(), original)
+
+    def test_unchanged_file(self):
+        filename = self.path('data.json')
+        self.assertTrue(write_object(self.payload, filename))
+        os.utime(filename, ns=(0, 0))
+        before = os.stat(filename)
+        self.assertFalse(write_object(self.payload, filename, suffix='.bak'))
+        after = os.stat(filename)
+        self.assertEqual((after.st_ino, after.st_mtime_ns), (before.st_ino, 0))
+        self.assertFalse(os.path.exists(filename + '.bak'))
+        self.assertNoTemporaryFiles()
+
+    def test_changed_file(self):
+        filename = self.path('data.json')
+        write_object(self.payload, filename)
+        changes = [
+            dict(self.payload, title='Changed'),  # same length
+            dict(self.payload, zzz='appended'),  # common prefix
+            {'title': 'Sample'},  # shorter
+            {},
+        ]
+        for payload in changes:
+            with self.subTest(payload=payload):
+                self.assertTrue(write_object(payload, filename))
+                self.assertEqual(get_object(filename), payload)
+                self.assertFalse(write_object(payload, filename))
+        self.assertNoTemporaryFiles()
+
+    def test_metadata_write(self):
+        filename = self.path('meta.json')
+        meta = Metadata({'key': 'value'})
+        meta.validate_hashes(write_updates=True)
+        self.assertTrue(meta.write(filename))
+        meta = Metadata(filename=filename)
+        self.assertFalse(meta.write())
+        meta.data.key = 'other value'
+        meta.validate_hashes(write_updates=True)
+        self.assertTrue(meta.write())
+
+    def test_file_mode(self):
+        filename = self.path('data.json')
+        write_object(self.payload, filename)
+        os.chmod(filename, 0o640)
+        write_object(self.payload, filename)
+        self.assertEqual(stat.S_IMODE(os.stat(filename).st_mode), 0o640)
+
+    def test_new_file_mode(self):
+        previous = os.umask(0o027)
+        try:
+            self.assertEqual(get_umask(), 0o027)
+            write_object(self.payload, self.path('new.json'))
+        finally:
+            os.umask(previous)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path('new.json')).st_mode), 0o640)
+
+    def test_backup(self):
+        filename = self.path('data.json')
+        write_object(self.payload, filename)
+        inode = os.stat(filename).st_ino
+        write_object({'new': 'data'}, filename, suffix='.bak')
+        self.assertEqual(os.stat(filename + '.bak').st_ino, inode)
+        self.assertEqual(get_object(filename + '.bak', 'JSON'), self.payload)
+        write_object({'newer': 'data'}, filename, suffix='.bak')
+        self.assertEqual(get_object(filename + '.bak1~', 'JSON'), {'new': 'data'})
+        self.assertEqual(get_object(filename), {'newer': 'data'})
+
+    def test_symlink(self):
+        filename = self.path('data.json')
+        link = self.path('link.json')
+        write_object(self.payload, filename)
+        os.symlink(filename, link)
+        write_object({'new': 'data'}, link)
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(get_object(filename), {'new': 'data'})
@@ -0,0 +1,56 @@
+'''
+Unit tests for hashing structured data
+'''
+
+import hashlib
+import json
+from collections import OrderedDict
+from unittest import TestCase
+
+from hods._lib.hash import (
+    canonical_chunks,
+    canonical_json,
+    struct_hash,
+)
+
+
+def reference_json(data):
+    '''Canonical JSON as defined by specification'''
+    return json.dumps(data, indent=None, separators=',:', sort_keys=True)
+
+
+class testCanonicalEncoder(TestCase):
+
+    samples = [
+        {},
+        [],
+        'string',
+        None,
+        {'b': 1, 'a': [1, 2.5, None, True], 'ж': 'юникод'},
+        OrderedDict([('z', {}), ('y', [{}, []])]),
+        {1: 'int keys', 2: [{'nested': ('tuple', 'values')}]},
+        {'records': [{'id': i, 'tags': ['a', 'b'], 'nested': {'x': [i]}}
+                     for i in range(2000)]},
+        [[[[[{'deep': list(range(300))}]]]]],
+    ]
+
+    def test_identical_output(self):
+        for sample in self.samples:
+            with self.subTest(sample=repr(sample)[:50]):
+                expected = reference_json(sample)
+                self.assertEqual(canonical_json(sample), expected)
+                streamed = b''.join(canonical_chunks(sample, chunk_size=10))
+                self.assertEqual(streamed, expected.encode())
+
+    def test_bounded_chunks(self):
+        sample = self.samples[-2]
+        chunk_size = 1024
+        chunks = list(canonical_chunks(sample, chunk_size=chunk_size))
+        self.assertGreater(len(chunks), 10)
+        self.assertLess(max(len(chunk) for chunk in chunks), 2 * chunk_size)
+
+    def test_hash_values(self):
+        for sample in self.samples:
+            with self.subTest(sample=repr(sample)[:50]):
+                expected = hashlib.sha256(reference_json(sample).encode())
+                self.assertEqual(struct_hash(sample), expected.hexdigest())
@@ -0,0 +1,68 @@
+'''
+Import time budget for HODS package
+
+Command line tools are launched very often (e.g. from hooks), so heavy third
+party modules must be loaded only when they are actually required.
+'''
+
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = {
+    'jsonschema',
+    'pkg_resources',
+    'ruamel',
+    'strictyaml',
+}
+CLI_IMPORT_BUDGET_MS = 100
+
+
+def import_profile(statement):
+    '''
+    Execute statement in a new interpreter with `-X importtime` and return the
+    cumulative import time (in microseconds) for each imported module
+    '''
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=PROJECT_ROOT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    profile = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line.split('|')
+        profile[module.strip()] = int(cumulative)
+    return profile
+
+
+def top_level(modules):
+    return {name.split('.')[0] for name in modules}
+
+
+class testImportTime(TestCase):
+
+    def test_cli_startup(self):
+        profile = import_profile('import hods.cli')
+        self.assertFalse(top_level(profile) & HEAVY_MODULES)
+        self.assertLess(profile['hods.cli'] / 1000, CLI_IMPORT_BUDGET_MS)
+
+    def test_public_api_is_lazy(self):
+        profile = import_profile('import hods; hods.__doc__')
+        self.assertFalse(top_level(profile) & HEAVY_MODULES)
+        profile = import_profile('from hods import Metadata')
+        self.assertIn('jsonschema', top_level(profile))
+
+    def test_json_files_do_not_load_yaml(self):
+        profile = import_profile(
+            'from hods import Metadata;'
+            'Metadata(filename="tests/data/samples/sample-v1-02.json")'
+        )
+        self.assertFalse(top_level(profile) & {'ruamel', 'strictyaml', 'pkg_resources'})
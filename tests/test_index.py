@@ -0,0 +1,187 @@
+'''
+Tests for local index of metadata files
+'''
+
+import os
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from hods import Metadata
+from hods._lib import index as index_module
+from hods._lib.files import scan_files
+from hods._lib.index import INDEX_FILENAME, MetadataIndex, parse_predicate
+from hods.cli import index as index_command, query as query_command
+
+
+ALBUMS = [
+    {'album': 'First', 'year': 1999, 'tags': ['rock', 'live'], 'label': {'name': 'Indie'}},
+    {'album': 'Second', 'year': 2005, 'tags': ['rock']},
+    {'album': 'Third', 'year': 2012, 'tags': [], 'tracks': [{'title': 'skipped'}]},
+]
+
+
+class SampleAlbums:
+    '''Create a directory with sample metadata files for each test'''
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.directory = self.tempdir.name
+        self.files = []
+        for number, payload in enumerate(ALBUMS):
+            self.files.append(self.write('album{}.json'.format(number), payload))
+        self.broken = os.path.join(self.directory, 'broken.json')
+        with open(self.broken, 'w') as f:
+            f.write('{')
+        self.reads = []
+        original = index_module.get_object
+        def get_object(filename, *args, **kwargs):
+            self.reads.append(os.path.basename(filename))
+            return original(filename, *args, **kwargs)
+        patcher = patch.object(index_module, 'get_object', get_object)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, name, payload):
+        filename = os.path.join(self.directory, name)
+        meta = Metadata(payload)
+        meta.validate_hashes(write_updates=True)
+        meta.write(filename)
+        return filename
+
+
+class testMetadataIndex(SampleAlbums, TestCase):
+
+    def update(self, **kwargs):
+        self.reads.clear()
+        with MetadataIndex(self.directory) as index:
+            return index.update(scan_files(self.directory), **kwargs)
+
+    def query(self, *predicates, **kwargs):
+        with MetadataIndex(self.directory) as index:
+            return index.query(predicates, **kwargs)
+
+    def test_incremental_update(self):
+        stats = self.update()
+        self.assertEqual(stats, (3, 0, 1))
+        self.assertEqual(len(self.reads), 4)
+        stats = self.update()
+        self.assertEqual(stats, (0, 0, 1))
+        self.assertEqual(self.reads, ['broken.json'])
+        self.write('album1.json', dict(ALBUMS[1], year=2006))
+        os.remove(self.files[2])
+        stats = self.update()
+        self.assertEqual(stats, (1, 1, 1))
+        self.assertEqual(sorted(self.reads), ['album1.json', 'broken.json'])
+        self.assertEqual(self.query('data.year=2006'), ['album1.json'])
+        self.assertEqual(self.query(), ['album0.json', 'album1.json'])
+
+    def test_predicates(self):
+        self.update()
+        cases = [
+            (['data.year=2005'], ['album1.json']),
+            (['data.year>2000'], ['album1.json', 'album2.json']),
+            (['data.year >= 1999', 'data.year<2012'], ['album0.json', 'album1.json']),
+            (['data.tags=rock'], ['album0.json', 'album1.json']),
+            (['data.tags!=live'], ['album1.json', 'album2.json']),
+            (['data.album~*d'], ['album1.json', 'album2.json']),
+            (['data.label.name?'], ['album0.json']),
+            (['data.tracks?'], []),
+            (['data.missing=1'], []),
+        ]
+        for predicates, expected in cases:
+            with self.subTest(predicates=predicates):
+                self.assertEqual(self.query(*predicates), expected)
+
+    def test_invalid_predicates(self):
+        for text in ['data.year', '=2000', 'data.year>abc']:
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    self.query(text)
+        self.assertEqual(parse_predicate('a.b <= 5'), ('a.b', '<=', '5'))
+        self.assertEqual(parse_predicate('a.b?'), ('a.b', '?', None))
+
+    def test_schema(self):
+        self.update()
+        with MetadataIndex(self.directory) as index:
+            schemas = index.schemas(self.files[0])
+        self.assertEqual(set(schemas), {'info', 'data'})
+        self.assertEqual(len(self.query(schema=schemas['info'])), 3)
+        self.assertEqual(len(self.query(schema='*/metadata-v*.json')), 3)
+        self.assertEqual(self.query(schema='unknown'), [])
+
+    def test_selected_paths(self):
+        self.update(paths=['data.label'])
+        self.assertEqual(self.query('data.label.name=Indie'), ['album0.json'])
+        self.assertEqual(self.query('data.year?'), [])
+
+    def test_changed_paths(self):
+        self.update(paths=['data.label'])
+        self.assertEqual(self.update(paths=['data.label']), (0, 0, 1))
+        self.assertEqual(self.update(), (3, 0, 1))
+        self.assertEqual(self.query('data.year=2005'), ['album1.json'])
+        self.assertEqual(self.update(paths=['data.year']), (3, 0, 1))
+        self.assertEqual(self.query('data.label.name?'), [])
+
+    def test_corrupted_index(self):
+        self.update()
+        with open(os.path.join(self.directory, INDEX_FILENAME), 'wb') as f:
+            f.write(b'garbage' * 1000)
+        self.assertEqual(self.update(), (3, 0, 1))
+
+
+class testIndexCommands(SampleAlbums, TestCase):
+
+    def run_command(self, command, *args):
+        output = StringIO()
+        current = os.getcwd()
+        os.chdir(self.directory)
+        try:
+            with redirect_stdout(output):
+                command.main(*args)
+        finally:
+            os.chdir(current)
+        return output.getvalue().splitlines()
+
+    def test_commands(self):
+        output = self.run_command(index_command)
+        self.assertEqual(output, ['Indexed 3 files: 3 updated, 0 removed, 1 failed'])
+        output = self.run_command(query_command, 'data.year>2000', 'data.tags=rock')
+        self.assertEqual(output, ['album1.json'])
+        with self.assertRaises(SystemExit) as context:
+            self.run_command(query_command, '--schema=unknown')
+        self.assertEqual(context.exception.code, 1)
+
+    def test_reindex_without_paths(self):
+        self.run_command(index_command, '--paths=data.label')
+        with self.assertRaises(SystemExit):  # no matches
+            self.run_command(query_command, 'data.year=2005')
+        output = self.run_command(index_command)
+        self.assertEqual(output, ['Indexed 3 files: 3 updated, 0 removed, 1 failed'])
+        self.assertEqual(self.run_command(query_command, 'data.year=2005'), ['album1.json'])
+
+    def test_query_errors(self):
+        with redirect_stderr(StringIO()):
+            with self.assertRaises(SystemExit) as context:
+                self.run_command(query_command, 'data.year>2000')
+            self.assertEqual(context.exception.code, 2)
+            self.assertFalse(os.path.exists(os.path.join(self.directory, INDEX_FILENAME)))
+            self.run_command(index_command)
+            for predicate in ('data.year>abc', '=value'):
+                with self.subTest(predicate=predicate):
+                    with self.assertRaises(SystemExit) as context:
+                        self.run_command(query_command, predicate)
+                    self.assertEqual(context.exception.code, 2)
+
+    def test_undeletable_corrupted_index(self):
+        filename = os.path.join(self.directory, INDEX_FILENAME)
+        with open(filename, 'wb') as f:
+            f.write(b'garbage' * 1000)
+        with patch.object(index_module.os, 'remove', side_effect=PermissionError):
+            with redirect_stderr(StringIO()):
+                with self.assertRaises(SystemExit) as context:
+                    self.run_command(index_command)
+        self.assertEqual(context.exception.code, 1)
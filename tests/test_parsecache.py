@@ -0,0 +1,165 @@
+'''
+Tests for persistent cache of parsed documents
+'''
+
+import io
+import os
+import time
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from hods._lib.files import get_object, write_yaml
+from hods._lib.parsecache import DEFAULT_SIZE, MIN_SIZE, ParseCache
+from hods._lib.profile import Profiler
+
+
+def sample_yaml(title='Sample', items=350):
+    lines = ['# Comment that must survive caching', 'title: {}'.format(title), 'items:']
+    for number in range(items):
+        lines.append('  - {{number: {}, name: item {}}}  # inline comment'.format(number, number))
+    return '\n'.join(lines) + '\n'
+
+
+class testParseCache(TestCase):
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.cache = ParseCache(
+            directory=os.path.join(self.tempdir.name, 'cache'),
+            max_size=10 * 1024 * 1024,
+            enabled=True,
+        )
+        self.filename = self.write('sample.yml', sample_yaml())
+        self.patcher = patch('hods._lib.files.parse_cache', self.cache)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.tempdir.cleanup()
+
+    def write(self, name, content, age=60):
+        '''Write file with modification time in the past'''
+        filename = os.path.join(self.tempdir.name, name)
+        with open(filename, 'w') as f:
+            f.write(content)
+        past = time.time() - age
+        os.utime(filename, (past, past))
+        return filename
+
+    def load(self, filename=None, readonly=False):
+        '''Return loaded object and the number of cache hits'''
+        profiler = Profiler()
+        with profiler.activate():
+            obj = get_object(filename or self.filename, readonly=readonly)
+        return obj, profiler.counters.get('parse cache hits', 0)
+
+    def test_round_trip(self):
+        first, hits = self.load()
+        self.assertEqual(hits, 0)
+        second, hits = self.load()
+        self.assertEqual(hits, 1)
+        self.assertEqual(second, first)
+        for obj in (first, second):
+            stream = io.StringIO()
+            write_yaml(obj, stream)
+            self.assertIn('# Comment that must survive caching', stream.getvalue())
+            self.assertIn('# inline comment', stream.getvalue())
+
+    def test_variants(self):
+        roundtrip, _ = self.load()
+        plain, hits = self.load(readonly=True)
+        self.assertEqual(hits, 0)
+        self.assertIs(type(plain), dict)
+        plain, hits = self.load(readonly=True)
+        self.assertEqual(hits, 1)
+        self.assertIs(type(plain), dict)
+        self.assertEqual(plain, roundtrip)
+        _, hits = self.load()
+        self.assertEqual(hits, 1)
+
+    def test_modified_file(self):
+        self.load()
+        self.write('sample.yml', sample_yaml('Modified'), age=30)
+        obj, hits = self.load()
+        self.assertEqual(hits, 0)
+        self.assertEqual(obj['title'], 'Modified')
+
+    def test_recently_modified_file(self):
+        filename = self.write('recent.yml', sample_yaml(), age=0)
+        self.load(filename)
+        _, hits = self.load(filename)
+        self.assertEqual(hits, 0)
+
+    def test_not_cached(self):
+        small = self.write('small.yml', 'title: Small\n')
+        large_json = self.write('large.json', '[{}]'.format(', '.join(['1'] * MIN_SIZE)))
+        for filename in (small, large_json):
+            self.load(filename)
+            _, hits = self.load(filename)
+            self.assertEqual(hits, 0)
+        self.assertEqual(list(self.cache.entries()), [])
+
+    def test_damaged_entry(self):
+        self.load()
+        path = self.cache.path(self.filename)
+        with open(path, 'wb') as f:
+            f.write(b'garbage')
+        obj, hits = self.load()
+        self.assertEqual(hits, 0)
+        self.assertEqual(obj['title'], 'Sample')
+        _, hits = self.load()
+        self.assertEqual(hits, 1)
+
+    def test_eviction(self):
+        filenames = [
+            self.write('sample{}.yml'.format(number), sample_yaml(), age=60 - number)
+            for number in range(4)
+        ]
+        self.load(filenames[0])
+        entry_size = os.path.getsize(self.cache.path(filenames[0]))
+        self.cache.max_size = int(entry_size * 2.5)
+        for filename in filenames[1:]:
+            time.sleep(0.01)
+            self.load(filename)
+        cached = [os.path.exists(self.cache.path(f)) for f in filenames]
+        self.assertEqual(cached, [False, False, True, True])  # evicted down to 75% on third write
+        total = sum(size for _, _, size in self.cache.entries())
+        self.assertLessEqual(total, self.cache.max_size)
+
+    def test_recently_used_entries_are_kept(self):
+        first, second, third = [
+            self.write('sample{}.yml'.format(number), sample_yaml(), age=60)
+            for number in range(3)
+        ]
+        self.load(first)
+        entry_size = os.path.getsize(self.cache.path(first))
+        self.cache.max_size = int(entry_size * 2.9)
+        time.sleep(0.01)
+        self.load(second)
+        time.sleep(0.01)
+        _, hits = self.load(first)  # first becomes most recently used
+        self.assertEqual(hits, 1)
+        time.sleep(0.01)
+        self.load(third)
+        self.assertTrue(os.path.exists(self.cache.path(first)))
+        self.assertFalse(os.path.exists(self.cache.path(second)))
+
+    def test_invalidate(self):
+        self.load()
+        self.load(readonly=True)
+        self.cache.invalidate(self.filename)
+        self.assertEqual(list(self.cache.entries()), [])
+        _, hits = self.load()
+        self.assertEqual(hits, 0)
+
+    def test_disabled(self):
+        self.cache.enabled = False
+        self.load()
+        self.assertEqual(list(self.cache.entries()), [])
+
+    def test_invalid_size_setting(self):
+        with patch.dict('os.environ', {'HODS_PARSE_CACHE_SIZE': '1GB'}):
+            with self.assertWarns(UserWarning):
+                cache = ParseCache(directory=self.tempdir.name)
+        self.assertEqual(cache.max_size, DEFAULT_SIZE * 1024 * 1024)
@@ -0,0 +1,124 @@
+'''
+Tests for profiling hooks
+'''
+
+import json
+import os
+import time
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from hods import Metadata, Profiler
+from hods._lib import profile
+from hods._lib.profile import count, profiled, track_file
+from hods.cli import check
+
+
+@profiled('outer')
+def outer(delay):
+    time.sleep(delay)
+    inner(delay)
+
+
+@profiled('inner')
+def inner(delay):
+    time.sleep(delay)
+
+
+class testProfiler(TestCase):
+
+    def test_disabled(self):
+        self.assertIsNone(profile.get_profiler())
+        outer(0)
+        count('counter')
+        with track_file('file'):
+            pass
+        self.assertIsNone(profile.get_profiler())
+
+    def test_nested_phases(self):
+        profiler = Profiler()
+        with profiler.activate():
+            self.assertIs(profile.get_profiler(), profiler)
+            outer(0.01)
+            outer(0.01)
+            count('counter', 5)
+            with track_file('file'):
+                inner(0.01)
+        self.assertIsNone(profile.get_profiler())
+        calls, total, own, longest = profiler.phases['outer']
+        self.assertEqual(calls, 2)
+        self.assertGreaterEqual(total, 0.04)
+        self.assertLess(own, total - 0.015)
+        self.assertEqual(profiler.phases['inner'][0], 3)
+        self.assertEqual(profiler.counters, {'counter': 5})
+        self.assertGreaterEqual(profiler.files['file'], 0.01)
+        self.assertGreaterEqual(profiler.wall, total)
+
+    def test_exception(self):
+        profiler = Profiler()
+        with profiler.activate():
+            with self.assertRaises(ValueError):
+                profiled('failing')(int)('abc')
+        self.assertEqual(profiler.phases['failing'][0], 1)
+        self.assertEqual(profiler._stack, [])
+
+    def test_merge(self):
+        first, second = Profiler(), Profiler()
+        for profiler in (first, second):
+            with profiler.activate():
+                with track_file('file'):
+                    outer(0)
+        first.merge(json.loads(json.dumps(second.report())))
+        self.assertEqual(first.phases['outer'][0], 2)
+        self.assertEqual(first.phases['inner'][0], 2)
+        self.assertEqual(list(first.files), ['file'])
+        self.assertIn('outer', first.format())
+
+    def test_library_phases(self):
+        with TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'meta.json')
+            profiler = Profiler()
+            with profiler.activate():
+                meta = Metadata({'key': 'value'})
+                meta.validate_hashes(write_updates=True)
+                meta.write(filename)
+                Metadata(filename=filename)
+        self.assertTrue({'parse', 'schema', 'validate', 'hash', 'write'}.issubset(profiler.phases))
+
+
+class testProfileCommandline(TestCase):
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.files = []
+        for number in range(4):
+            filename = os.path.join(self.tempdir.name, 'file{}.json'.format(number))
+            meta = Metadata({'number': number})
+            meta.validate_hashes(write_updates=True)
+            meta.write(filename)
+            self.files.append(filename)
+
+    def test_workers(self):
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs):
+                profiler = Profiler()
+                with profiler.activate():
+                    results = list(check.check_files(self.files, jobs, profiler=profiler))
+                self.assertEqual({status for _, status in results}, {check.OK})
+                self.assertEqual(sorted(profiler.files), self.files)
+                self.assertEqual(profiler.phases['hash'][0], len(self.files))
+
+    def test_flags(self):
+        dump = os.path.join(self.tempdir.name, 'profile.out')
+        stderr, stdout = StringIO(), StringIO()
+        with redirect_stderr(stderr), redirect_stdout(stdout):
+            check.main('--no-cache', '--profile', '--profile-json={}'.format(dump), *self.files)
+        self.assertIn('Slowest files:', stderr.getvalue())
+        self.assertNotIn('Slowest files:', stdout.getvalue())
+        with open(dump) as f:
+            report = json.load(f)
+        self.assertEqual(sorted(report['files']), self.files)
+        self.assertIn('validate', report['phases'])
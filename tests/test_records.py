@@ -0,0 +1,226 @@
+'''
+Tests for append-only record logs
+'''
+
+import json
+import os
+import shutil
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from hods import HashMismatchError, Metadata, RecordLog, ValidationErrors
+from hods._lib.hash import struct_hash
+from hods._lib.records import read_info
+
+
+def track(number, title='Track'):
+    return {'number': str(number), 'title': '{} {}'.format(title, number), 'artist': ''}
+
+
+def album(tracks):
+    return {
+        'album': 'Album',
+        'artist': 'Performer',
+        'year': '2010',
+        'image_url': '',
+        'genre': '',
+        'comment': '',
+        'composer': '',
+        'orig_artist': '',
+        'cd': '',
+        'tracks': [track(number) for number in range(tracks)],
+    }
+
+
+class testRecordLog(TestCase):
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.filename = self.write('album.json', album(3))
+
+    def write(self, name, payload):
+        filename = os.path.join(self.tempdir.name, name)
+        meta = Metadata(payload)
+        meta.info.schema.data = 'music-album-v1.json'
+        meta.validate_hashes(write_updates=True)
+        meta.write(filename)
+        return filename
+
+    def open(self, filename=None):
+        return RecordLog(filename or self.filename, path=['tracks'])
+
+    def test_append(self):
+        log = self.open()
+        self.assertEqual(list(log), [])
+        log.append(track(3))
+        log.append(track(4), track(5))
+        self.assertEqual(list(self.open()), [track(3), track(4), track(5)])
+        reopened = self.open()
+        reopened.append(track(6))
+        self.assertEqual(reopened.verify(), 4)
+
+    def test_item_schema(self):
+        log = self.open()
+        for record in [{'number': 1}, dict(track(1), title=''), dict(track(1), extra='')]:
+            with self.subTest(record=record):
+                with self.assertRaises(ValidationErrors):
+                    log.append(record)
+        self.assertFalse(os.path.exists(log.log))
+
+    def test_compact(self):
+        log = self.open()
+        log.append(*[track(number) for number in range(3, 10)])
+        self.assertEqual(log.compact(), 7)
+        self.assertFalse(os.path.exists(log.log))
+        meta = Metadata(filename=self.filename)
+        meta.validate_hashes()
+        expected = Metadata(album(10))
+        self.assertEqual(
+            meta.info.hashes.data.sha256,
+            struct_hash(expected._data['data']),
+        )
+        log.append(track(10))
+        self.assertEqual(self.open().verify(), 1)
+        self.assertEqual(log.compact(), 1)
+        self.assertEqual(len(Metadata(filename=self.filename).data.tracks), 11)
+
+    def test_changed_base(self):
+        log = self.open()
+        log.append(track(3))
+        meta = Metadata(filename=self.filename)
+        meta.data.album = 'Changed'
+        meta.validate_hashes(write_updates=True)
+        meta.write()
+        with self.assertRaises(ValueError):
+            self.open()
+
+    def test_tampered_base(self):
+        log = self.open()
+        log.append(track(3))
+        with open(self.filename) as f:
+            content = f.read()
+        with open(self.filename, 'w') as f:
+            f.write(content.replace('"Performer"', '"Impostor"'))
+        files = []
+        for name in (self.filename, log.log):
+            with open(name, 'rb') as f:
+                files.append(f.read())
+        with self.assertRaises(HashMismatchError):
+            log.compact()
+        for name, expected in zip((self.filename, log.log), files):
+            with open(name, 'rb') as f:
+                self.assertEqual(f.read(), expected)
+        self.assertEqual(list(self.open()), [track(3)])
+
+    def test_malformed_header(self):
+        for header in [
+            {'hods-records': 1, 'section': 'data'},
+            {'hods-records': 1, 'path': ['tracks']},
+            {'hods-records': 1, 'section': 'data', 'path': 'tracks'},
+        ]:
+            with self.subTest(header=header):
+                with open(self.filename + '.records.jsonl', 'w') as f:
+                    f.write(json.dumps(header) + '\n')
+                with self.assertRaises(ValueError):
+                    self.open()
+
+    def test_stale_log(self):
+        log = self.open()
+        log.append(track(3))
+        saved = os.path.join(self.tempdir.name, 'saved.jsonl')
+        shutil.copy(log.log, saved)
+        log.compact()
+        shutil.copy(saved, log.log)  # log without compaction marker
+        with self.assertRaises(ValueError):
+            self.open()
+
+    def test_interrupted_compaction(self):
+        log = self.open()
+        log.append(track(3), track(4))
+        with patch('hods._lib.records.os.remove'):  # crash before the log is removed
+            log.compact()
+        self.assertTrue(os.path.exists(log.log))
+        reopened = self.open()
+        self.assertFalse(os.path.exists(log.log))
+        self.assertEqual(reopened.verify(), 0)
+        reopened.append(track(5))
+        reopened.compact()
+        tracks = Metadata(filename=self.filename).data.tracks
+        self.assertEqual([t['number'] for t in tracks], [str(n) for n in range(6)])
+
+    def test_failed_compaction(self):
+        log = self.open()
+        log.append(track(3))
+        with open(log.log, 'rb') as f:
+            content = f.read()
+        with patch.object(Metadata, 'write', side_effect=OSError):
+            with self.assertRaises(OSError):
+                log.compact()
+        with open(log.log, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        marker = b'{"compacted":"0123"}\n'
+        with open(log.log, 'ab') as f:
+            f.write(marker)  # crash before the base document was replaced
+        reopened = self.open()
+        self.assertEqual(list(reopened), [track(3)])
+        reopened.append(track(4))
+        self.assertEqual(self.open().verify(), 2)
+
+    def test_info_is_read_without_payload(self):
+        for name, content in [
+            ('partial.json', '{"info": %s, "data": {"tracks": [garbage' % json.dumps(self.info())),
+            ('partial.yml', 'info:\n  version: metadata-v1.json\ndata: [garbage\n'),
+        ]:
+            with self.subTest(name=name):
+                filename = os.path.join(self.tempdir.name, name)
+                with open(filename, 'w') as f:
+                    f.write(content)
+                self.assertTrue(read_info(filename)['version'].endswith('metadata-v1.json'))
+
+    def info(self):
+        with open(self.filename) as f:
+            return json.load(f)['info']
+
+    def test_tampering(self):
+        log = self.open()
+        log.append(track(3), track(4), track(5))
+        with open(log.log) as f:
+            lines = f.readlines()
+        samples = [
+            lines[:2] + [lines[2].replace('Track 4', 'Track 0')] + lines[3:],
+            lines[:2] + lines[3:],
+            lines[:1] + [lines[2], lines[1]] + lines[3:],
+        ]
+        for sample in samples:
+            with self.subTest(sample=sample):
+                with open(log.log, 'w') as f:
+                    f.writelines(sample)
+                with self.assertRaises(HashMismatchError):
+                    self.open().verify()
+
+    def test_interrupted_append(self):
+        log = self.open()
+        log.append(track(3), track(4))
+        with open(log.log, 'a') as f:
+            f.write('{"chain": "0123", "rec')
+        reopened = self.open()
+        self.assertEqual(reopened.verify(), 2)
+        reopened.append(track(5))
+        self.assertEqual(self.open().verify(), 3)
+
+    def test_yaml(self):
+        filename = self.write('album.yml', album(2))
+        log = self.open(filename)
+        log.append(track(2))
+        log.compact()
+        meta = Metadata(filename=filename)
+        meta.validate_hashes()
+        self.assertEqual(meta.data.tracks[-1]['title'], 'Track 2')
+
+    def test_unhashed_base(self):
+        filename = os.path.join(self.tempdir.name, 'unhashed.json')
+        Metadata({'records': []}).write(filename)
+        with self.assertRaises(ValueError):
+            RecordLog(filename, path=['records'])
@@ -0,0 +1,299 @@
+'''
+Unit tests for schema helpers
+'''
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+from urllib.error import URLError
+
+from hods import ValidationErrors
+from hods._lib.schemas import (
+    RemoteSchemaCache,
+    Schema,
+    SchemaRegistry,
+    compile_schema,
+    get_items_scope,
+    registry,
+)
+
+
+SCHEMA_ID = 'https://hods.ml/schemas/metadata-v1.json'
+
+
+class testSchemaRegistry(TestCase):
+
+    def setUp(self):
+        self.registry = SchemaRegistry(maxsize=2)
+
+    def test_hits_and_misses(self):
+        first = self.registry.get(SCHEMA_ID)
+        second = self.registry.get(SCHEMA_ID)
+        self.assertIs(first, second)
+        info = self.registry.info()
+        self.assertEqual((info.hits, info.misses, info.size), (1, 1, 1))
+
+    def test_size_limit(self):
+        self.registry.get(SCHEMA_ID)
+        self.registry.get('https://hods.ml/schemas/music-album-v1.json')
+        self.registry.get(SCHEMA_ID)  # refresh least recently used entry
+        self.registry.get('http://hods.ml/schemas/metadata-v1.json')
+        self.assertEqual(len(self.registry), 2)
+        self.assertIn((SCHEMA_ID, 'jsonschema'), self.registry)
+        self.assertNotIn(
+            ('https://hods.ml/schemas/music-album-v1.json', 'jsonschema'),
+            self.registry
+        )
+
+    def test_invalidation(self):
+        self.registry.get(SCHEMA_ID)
+        self.registry.invalidate(SCHEMA_ID, engine='other')
+        self.assertEqual(len(self.registry), 1)
+        self.registry.invalidate(SCHEMA_ID)
+        self.assertEqual(len(self.registry), 0)
+        self.registry.get(SCHEMA_ID)
+        self.assertEqual(self.registry.info().misses, 2)
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            self.registry.get(SCHEMA_ID, engine='unknown')
+
+
+class testSchema(TestCase):
+
+    def test_shared_validator(self):
+        first = Schema('metadata-v1.json')
+        second = Schema(SCHEMA_ID)
+        self.assertIs(first.parsed, second.parsed)
+        self.assertIn((SCHEMA_ID, 'jsonschema'), registry)
+
+    def test_validation(self):
+        schema = Schema('metadata-v1.json')
+        with self.assertRaises(ValidationErrors):
+            schema.validate({'hello': 'world'})
+
+    def test_empty_schema(self):
+        schema = Schema()
+        self.assertIsNone(schema.validate({'hello': 'world'}))
+
+
+class testPathScopedValidation(TestCase):
+
+    def setUp(self):
+        self.schema = Schema('music-album-v1.json')
+        with open('tests/data/samples/sample-music-v1.json') as f:
+            self.album = json.load(f)
+
+    def test_valid_changes(self):
+        self.album['year'] = '2011'
+        self.schema.validate_path(self.album, ('year',))
+        self.album['tracks'] = []
+        self.schema.validate_path(self.album, ('tracks',))
+
+    def test_invalid_changes(self):
+        changes = [
+            ('album', ''),
+            ('year', 2011),
+            ('unknown', 'value'),
+            ('tracks', [{'number': 1}]),
+            ('image_url', ['']),
+        ]
+        for key, value in changes:
+            with self.subTest(key=key, value=value):
+                album = dict(self.album)
+                album[key] = value
+                with self.assertRaises(ValidationErrors):
+                    self.schema.validate_path(album, (key,))
+                with self.assertRaises(ValidationErrors):
+                    self.schema.validate(album)
+
+    def test_nested_path(self):
+        document = {
+            'info': {
+                'version': 'metadata-v1.json',
+                'schema': {'data': ''},
+                'hashes': {'data': {'timestamp': 'now'}},
+            },
+            'data': {},
+        }
+        schema = Schema('metadata-v1.json')
+        document['info']['hashes']['data']['md5'] = 'hash'
+        schema.validate_path(document, ('info', 'hashes', 'data', 'md5'))
+        document['info']['hashes']['data']['md5'] = 'with whitespace'
+        with self.assertRaises(ValidationErrors):
+            schema.validate_path(document, ('info', 'hashes', 'data', 'md5'))
+        document['info']['hashes']['data']['md5'] = 'hash'
+        document['info']['extra'] = 'not allowed'
+        with self.assertRaises(ValidationErrors):
+            schema.validate_path(document, ('info', 'extra'))
+
+
+    def test_items_scope(self):
+        compiled = self.schema._compiled
+        tracks = self.schema.parsed['patternProperties']['tracks']
+        scope = get_items_scope(compiled, tracks)
+        self.assertEqual(scope.schema, {'type': 'array'})
+        self.assertEqual(scope.children, ([], tracks['items']))
+        self.assertIs(get_items_scope(compiled, tracks), scope)
+
+        tuples = {'items': [{'type': 'string'}], 'additionalItems': {'type': 'integer'}}
+        self.assertEqual(
+            get_items_scope(compiled, tuples).children,
+            ([{'type': 'string'}], {'type': 'integer'}),
+        )
+        for unscoped in ({'items': [{}], 'additionalItems': False}, {'anyOf': [{}]}):
+            with self.subTest(schema=unscoped):
+                self.assertIsNone(get_items_scope(compiled, unscoped))
+
+
+class SchemaServer(ThreadingMixIn, HTTPServer):
+    '''Local HTTP server that serves a single schema with ETag header'''
+
+    daemon_threads = True
+    content = b'{"type": "object"}'
+    etag = '"version-1"'
+
+    def __init__(self):
+        self.requests = []
+        super().__init__(('127.0.0.1', 0), SchemaRequestHandler)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/schema.json'.format(self.server_port)
+
+
+class SchemaRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('ETag', server.etag)
+        self.end_headers()
+        self.wfile.write(server.content)
+
+    def log_message(self, *args):
+        pass
+
+
+class testRemoteSchemaCache(TestCase):
+
+    def setUp(self):
+        self.server = SchemaServer()
+        thread = threading.Thread(
+            target=self.server.serve_forever,
+            kwargs=dict(poll_interval=0.05),
+            daemon=True,
+        )
+        thread.start()
+        self.tempdir = TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tempdir.cleanup()
+
+    def cache(self, **kwargs):
+        return RemoteSchemaCache(directory=self.tempdir.name, timeout=5, **kwargs)
+
+    def test_fresh_entries(self):
+        cache = self.cache(ttl=60)
+        self.assertEqual(cache.get(self.server.url), '{"type": "object"}')
+        self.assertEqual(self.cache(ttl=60).get(self.server.url), '{"type": "object"}')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_conditional_revalidation(self):
+        cache = self.cache(ttl=0)
+        cache.get(self.server.url)
+        self.assertEqual(cache.get(self.server.url), '{"type": "object"}')
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[-1].get('If-None-Match'), '"version-1"')
+        self.assertNotIn('If-Modified-Since', self.server.requests[-1])  # server sent no date
+
+    def test_invalid_environment(self):
+        environment = {'HODS_SCHEMA_TTL': 'one day', 'HODS_TIMEOUT': '10s'}
+        with patch.dict('os.environ', environment):
+            with self.assertWarns(UserWarning):
+                cache = RemoteSchemaCache(directory=self.tempdir.name)
+        self.assertEqual(cache.ttl, 24 * 60 * 60)
+        self.assertEqual(cache.timeout, 10)
+
+    def test_offline_mode(self):
+        with self.assertRaises(URLError):
+            self.cache(offline=True).get(self.server.url)
+        self.cache(ttl=0).get(self.server.url)
+        self.server.content = b'{"changed": true}'
+        self.server.etag = '"version-2"'
+        self.assertEqual(
+            self.cache(ttl=0, offline=True).get(self.server.url),
+            '{"type": "object"}'
+        )
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.cache(ttl=0).get(self.server.url), '{"changed": true}')
+
+    def test_stale_entry_when_server_is_down(self):
+        cache = self.cache(ttl=0)
+        url = self.server.url
+        cache.get(url)
+        self.server.shutdown()
+        self.server.server_close()
+        self.assertEqual(cache.get(url), '{"type": "object"}')
+
+
+
+class testReferences(TestCase):
+
+    def setUp(self):
+        self.server = SchemaServer()
+        self.server.content = b'{"type": "string", "minLength": 2}'
+        thread = threading.Thread(
+            target=self.server.serve_forever,
+            kwargs=dict(poll_interval=0.05),
+            daemon=True,
+        )
+        thread.start()
+        self.tempdir = TemporaryDirectory()
+        remote = RemoteSchemaCache(directory=self.tempdir.name, ttl=0, timeout=5)
+        self.patcher = patch('hods._lib.schemas.remote_cache', remote)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        self.tempdir.cleanup()
+
+    def test_bundled_schemas(self):
+        schema = json.dumps({
+            'type': 'object',
+            'properties': {
+                'album': {'$ref': 'https://hods.ml/schemas/music-album-v1.json'},
+                'meta': {'$ref': 'http://hods.ml/schemas/metadata-v1.json#/patternProperties/info'},
+                'short': {'$ref': 'music-album-v1.json#/patternProperties/tracks'},
+            },
+        })
+        with patch('hods._lib.schemas.download', side_effect=AssertionError('network access')):
+            compiled = compile_schema(schema)
+            compiled.validate({})
+            for invalid in ({'album': {}}, {'meta': 'not an object'}, {'short': [{}]}):
+                with self.subTest(data=invalid):
+                    with self.assertRaises(ValidationErrors):
+                        compiled.validate(invalid)
+
+    def test_remote_schemas_are_fetched_once(self):
+        schema = json.dumps({'items': {'$ref': self.server.url}})
+        validators = [compile_schema(schema) for _ in range(3)]
+        for compiled in validators:
+            compiled.validate(['ok', 'fine'])
+            with self.assertRaises(ValidationErrors):
+                compiled.validate(['ok', 'x'])
+        self.assertEqual(len(self.server.requests), 1)
@@ -0,0 +1,155 @@
+'''
+Tests for streaming verification of large JSON files
+'''
+
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from hods import Metadata
+from hods._lib.stream import JsonStream, StreamingMetadata
+from hods.cli import check
+
+
+class testJsonStream(TestCase):
+
+    samples = [
+        '[]',
+        '{}',
+        '[1, 22, 333, -2.5e10, 1E+2, true, false, null, "abc", "юникод \\" \\\\", [[]], {}]',
+        '{"a": 1, "bb": [1, 2, 3], "юю": {"x": "yyyyyyyy"}, "c": null, "a": 2}',
+        '[\n  {"nested": {"deeper": [1, [2, [3, [4]]]]}},\n  "' + 'long' * 50 + '"\n]',
+    ]
+
+    def test_children(self):
+        for sample in self.samples:
+            expected = json.loads(sample)
+            if isinstance(expected, dict):
+                expected = list(expected.items())
+            for window in range(1, len(sample) + 2):
+                with self.subTest(sample=sample[:20], window=window):
+                    buffer = sample.encode()
+                    stream = JsonStream(buffer, window)
+                    children = []
+                    for key, start, end, value in stream.iter_container(0):
+                        value = json.loads(buffer[start:end].decode())
+                        children.append(value if key is None else (key, value))
+                    if isinstance(expected, list) and expected and isinstance(expected[0], tuple):
+                        children = list(dict(children).items())
+                    self.assertEqual(children, expected)
+                    self.assertEqual(stream.value_end(0), len(buffer))
+
+    def test_invalid(self):
+        for sample in ['[1, 2', '[1 2]', '{"a" 1}', '{1: 2}', '[1,]', '[tru]']:
+            for window in (1, 3, 1024):
+                with self.subTest(sample=sample, window=window):
+                    stream = JsonStream(sample.encode(), window)
+                    with self.assertRaises(ValueError):
+                        stream.value_end(0)
+
+
+class testStreamingVerification(TestCase):
+
+    windows = (16, 100, 4096)
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        with open('tests/data/samples/sample-music-v1.json') as f:
+            payload = json.load(f)
+        track = payload['tracks'][0]
+        payload['tracks'] = [dict(track, number=i) for i in range(300)]
+        meta = Metadata(payload)
+        meta.info.schema.data = 'music-album-v1.json'
+        meta.validate_hashes(write_updates=True)
+        self.valid = self.write('valid.json', meta)
+        self.payload = payload
+        self.meta = meta
+
+    def write(self, name, meta=None, content=None):
+        filename = os.path.join(self.tempdir.name, name)
+        if meta is not None:
+            meta.write(filename)
+        else:
+            with open(filename, 'w') as f:
+                f.write(content)
+        return filename
+
+    def modified(self, name, function):
+        '''Write a copy of valid file changed by the given function'''
+        with open(self.valid) as f:
+            content = json.load(f)
+        function(content)
+        return self.write(name, content=json.dumps(content, indent=2, ensure_ascii=False))
+
+    def assertSameStatus(self, filename, expected):
+        self.assertEqual(check.verify(filename)[0], expected)
+        for window in self.windows:
+            with self.subTest(file=os.path.basename(filename), window=window):
+                with patch('hods._lib.stream.WINDOW_SIZE', window):
+                    self.assertEqual(check.verify_streaming(filename)[0], expected)
+
+    def test_valid(self):
+        self.assertSameStatus(self.valid, check.OK)
+        self.assertEqual(check.verify_streaming(self.valid), check.verify(self.valid))
+
+    def test_other_sections(self):
+        def add_section(content):
+            content['extra'] = {'list': [{'юникод': i} for i in range(100)]}
+            content['info']['hashes']['extra'] = {'timestamp': 'now', 'md5': 'wrong'}
+        filename = self.modified('other-sections.json', add_section)
+        self.assertSameStatus(filename, 'HASH ERROR')
+
+    def test_missing_section(self):
+        def add_hashes(content):
+            content['info']['hashes']['missing'] = {'timestamp': 'now', 'md5': 'value'}
+        filename = self.modified('missing-section.json', add_hashes)
+        for window in self.windows:
+            with self.subTest(window=window):
+                with patch('hods._lib.stream.WINDOW_SIZE', window):
+                    self.assertEqual(check.verify_streaming(filename)[0], 'HASH ERROR')
+
+    def test_hash_error(self):
+        def change_track(content):
+            content['data']['tracks'][150]['title'] = 'Changed'
+        filename = self.modified('hash-error.json', change_track)
+        self.assertSameStatus(filename, 'HASH ERROR')
+
+    def test_schema_error(self):
+        def break_track(content):
+            content['data']['tracks'][150]['title'] = ''
+        def break_album(content):
+            content['data']['album'] = ''
+        def add_root_key(content):
+            content['data']['unexpected'] = [1, 2, 3]
+        def break_info(content):
+            content['info']['hashes']['data'].pop('timestamp')
+        for number, function in enumerate([break_track, break_album, add_root_key, break_info]):
+            filename = self.modified('schema-error{}.json'.format(number), function)
+            self.assertSameStatus(filename, 'SCHEMA ERROR')
+
+    def test_parse_error(self):
+        with open(self.valid) as f:
+            content = f.read()
+        samples = [
+            content[:len(content) // 2],
+            content + '{}',
+            content.replace('"title"', '"title" 1', 1),
+            '',
+        ]
+        for number, sample in enumerate(samples):
+            filename = self.write('parse-error{}.json'.format(number), content=sample)
+            self.assertSameStatus(filename, 'PARSE ERROR')
+
+    def test_readonly(self):
+        with StreamingMetadata(self.valid) as meta:
+            self.assertEqual(meta.info['schema']['data'], 'music-album-v1.json')
+            meta.validate_hashes()
+
+    def test_threshold(self):
+        with patch.object(check, 'STREAMING_THRESHOLD', 0), \
+             patch.object(check, 'verify_streaming', return_value=('STREAMED', [])):
+            self.assertEqual(check.verify(self.valid)[0], 'STREAMED')
+        self.assertEqual(check.verify(self.valid)[0], check.OK)
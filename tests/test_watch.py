@@ -0,0 +1,213 @@
+'''
+Tests for watching metadata files for changes
+'''
+
+import os
+from contextlib import redirect_stdout
+from io import StringIO
+from multiprocessing import Pool
+from tempfile import TemporaryDirectory
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+
+from hods import Metadata
+from hods._lib.watch import InotifyWatcher, PollingWatcher, Watcher
+from hods.cli import check
+
+
+def inotify_available():
+    try:
+        InotifyWatcher(os.path.dirname(__file__)).close()
+    except OSError:
+        return False
+    return True
+
+
+def write_metadata(filename, number):
+    meta = Metadata({'number': number})
+    meta.validate_hashes(write_updates=True)
+    meta.write(filename)
+
+
+class WatcherTests:
+    '''Common tests for all watcher implementations'''
+
+    DEBOUNCE = 0.1
+    TIMEOUT = 2
+    QUIET = 0.3
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.directory = self.tempdir.name
+        self.first = self.path('first.json')
+        write_metadata(self.first, 1)
+        write_metadata(self.path('ignored.json'), 2)
+        with open(self.path('.hodsignore'), 'w') as f:
+            f.write('ignored.json\n')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def changes(self, watcher):
+        return watcher.changes(debounce=self.DEBOUNCE, timeout=self.TIMEOUT)
+
+    def assertNoChanges(self, watcher):
+        self.assertEqual(watcher.changes(debounce=self.DEBOUNCE, timeout=self.QUIET), set())
+
+    def test_initial_files(self):
+        with self.make_watcher() as watcher:
+            self.assertEqual(watcher.files, {self.first})
+
+    def test_modified_file(self):
+        with self.make_watcher() as watcher:
+            write_metadata(self.first, 100)
+            self.assertEqual(self.changes(watcher), {self.first})
+
+    def test_burst_is_reported_once(self):
+        second = self.path('second.yml')
+        with self.make_watcher() as watcher:
+            for number in range(3):
+                write_metadata(self.first, 1000 + number)
+                write_metadata(second, 1000 + number)
+            self.assertEqual(self.changes(watcher), {self.first, second})
+            self.assertNoChanges(watcher)
+
+    def test_ignored_files(self):
+        with self.make_watcher() as watcher:
+            write_metadata(self.path('ignored.json'), 100)
+            with open(self.path('notes.txt'), 'w') as f:
+                f.write('not a metadata file')
+            self.assertNoChanges(watcher)
+
+    def test_removed_files(self):
+        with self.make_watcher() as watcher:
+            os.remove(self.first)
+            self.assertNoChanges(watcher)
+
+    def test_new_subdirectory(self):
+        with self.make_watcher(recursive=True) as watcher:
+            os.makedirs(self.path('sub', 'deeper'))
+            nested = self.path('sub', 'deeper', 'nested.json')
+            write_metadata(nested, 100)
+            write_metadata(self.path('sub', 'ignored.json'), 100)
+            self.assertEqual(self.changes(watcher), {nested})
+            write_metadata(nested, 200)
+            self.assertEqual(self.changes(watcher), {nested})
+
+    def test_subdirectories_are_not_watched(self):
+        with self.make_watcher(recursive=False) as watcher:
+            os.makedirs(self.path('sub'))
+            write_metadata(self.path('sub', 'nested.json'), 100)
+            self.assertNoChanges(watcher)
+
+
+
+class testPollingWatcher(WatcherTests, TestCase):
+
+    def make_watcher(self, recursive=False):
+        return PollingWatcher(self.directory, recursive=recursive, interval=0.02)
+
+    def test_explicit_files(self):
+        second = self.path('second.json')
+        watcher = PollingWatcher(files=[self.first, second], interval=0.02)
+        self.assertEqual(watcher.files, {self.first})
+        write_metadata(second, 100)
+        write_metadata(self.path('other.json'), 100)
+        self.assertEqual(self.changes(watcher), {second})
+
+
+
+@skipUnless(inotify_available(), 'inotify is not available')
+class testInotifyWatcher(WatcherTests, TestCase):
+
+    def make_watcher(self, recursive=False):
+        return InotifyWatcher(self.directory, recursive=recursive)
+
+    def test_changed_ignore_file(self):
+        with self.make_watcher() as watcher:
+            with open(self.path('.hodsignore'), 'w') as f:
+                f.write('first.json\n')
+            self.assertEqual(self.changes(watcher), {self.path('ignored.json')})
+            write_metadata(self.first, 100)
+            self.assertNoChanges(watcher)
+
+
+
+class FakeWatcher(Watcher):
+    '''Make changes with given functions one by one, then simulate Ctrl+C'''
+
+    def __init__(self, files, steps):
+        self.files = set(files)
+        self.steps = list(steps)
+        self.closed = False
+
+    def changes(self, debounce=None, timeout=None):
+        if not self.steps:
+            raise KeyboardInterrupt
+        return self.steps.pop(0)()
+
+    def close(self):
+        self.closed = True
+
+
+
+class testCheckWatch(TestCase):
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.good = os.path.join(self.tempdir.name, 'good.json')
+        self.bad = os.path.join(self.tempdir.name, 'bad.json')
+        write_metadata(self.good, 1)
+        self.corrupt(self.bad)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def corrupt(self, filename):
+        with open(filename, 'w') as f:
+            f.write('{')
+        return {filename}
+
+    def fix(self, filename):
+        write_metadata(filename, 2)
+        return {filename}
+
+    def run_watch(self, *steps):
+        watcher = FakeWatcher([self.good, self.bad], steps)
+        output = StringIO()
+        with patch.object(check, 'get_watcher', return_value=watcher), \
+             redirect_stdout(output):
+            try:
+                check.main('--watch', '--no-cache', '--jobs=1')
+                exit_code = 0
+            except SystemExit as exc:
+                exit_code = exc.code
+        self.assertTrue(watcher.closed)
+        return exit_code, output.getvalue().splitlines()
+
+    def test_fixed_file(self):
+        exit_code, lines = self.run_watch(lambda: self.fix(self.bad))
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(lines, [
+            'Checking {}: PARSE ERROR'.format(self.bad),
+            'Checking {}: OK'.format(self.good),
+            'Checking {}: OK'.format(self.bad),
+        ])
+
+    def test_broken_file(self):
+        exit_code, lines = self.run_watch(
+            lambda: self.fix(self.bad),
+            lambda: self.corrupt(self.good),
+        )
+        self.assertEqual(exit_code, 1)
+        self.assertEqual(lines[-1], 'Checking {}: PARSE ERROR'.format(self.good))
+
+    def test_external_pool(self):
+        with Pool(2, initializer=check.warm_up) as pool:
+            files = [self.good, self.bad]
+            for _ in range(2):
+                results = dict(check.check_files(files, jobs=2, pool=pool))
+                self.assertEqual(results, {self.good: check.OK, self.bad: 'PARSE ERROR'})